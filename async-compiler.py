@@ -1,23 +1,33 @@
+import profiling
 import os, sys, shutil
 import atexit
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import time
 
-import pyparsing
-import grammar
+import compilation
+import heapfile
+import heapwatch
+import parsecache
 import ntpath
-import csv
-import os
+
+# Profiling is enabled with --profile, see profiling.py
+profiling.configure(sys.argv)
+startup = profiling.startup('async-compiler')
 
 if len(sys.argv) > 1:
     os.chdir(sys.argv[1])
 
-with open('tmp_all_vars.csv', 'rb') as csvfile:
-    rows = list(csv.reader(csvfile))
-    heap = dict(zip(rows[0],
-                    [float(e) if e != 'NA' else
-                     None for e in rows[2]]))
+with startup.phase('heap'):
+    heap = heapfile.load('tmp_all_vars.csv')
+
+# The heap is reloaded when the CSV changes (see heapwatch.py)
+def swap_heap(newHeap):
+    global heap
+    heap = newHeap
+
+if heapwatch.enabled():
+    heapwatch.HeapWatcher('tmp_all_vars.csv', heap, swap_heap).start()
 
 compiler_in = "_compiler_in"
 compiler_out = "_compiler_out"
@@ -54,21 +64,28 @@ class CompilerHandler(FileSystemEventHandler):
                 code = open(event.src_path, 'r').readline().strip()
                 if code[0] == '"':
                     code = code[1:-1]
-                compiled = grammar.formula.parseString(code)[0].compile(heap)
-                print ("Compilation successful")
-                print (compiled)
-                with open(compiler_out + "\\" + filename, 'w') as f:
-                    f.write(compiled)
-
-            except pyparsing.ParseException as e:
-                print (str(e))
+                with profiling.formula(code) as profile:
+                    with profile.phase('codegen'):
+                        compiled = compilation.compile_formula(code, heap)
+                    print ("Compilation successful")
+                    print (compiled)
+                    with profile.phase('write'):
+                        with open(os.path.join(compiler_out, filename), 'w') as f:
+                            f.write(compiled)
+                    profile.count('output', len(compiled))
+
             except:
-                print (str(sys.exc_info()[0]))
-                print
+                e = sys.exc_info()[1]
+                if parsecache.isParseError(e):
+                    print (str(e))
+                else:
+                    print (str(sys.exc_info()[0]))
+                    print
 
 observer = Observer()
 observer.schedule(CompilerHandler(), path = compiler_in)
 observer.start()
+startup.write()
 
 print ("Ready to compile\n")
 
@@ -0,0 +1,221 @@
+import sys, json, argparse, multiprocessing
+from collections import OrderedDict
+
+import blocks
+import compilation
+import cse
+import heapfile
+import resultcache
+import simplify
+
+# Batch compilation: compiles a whole model file in a single process,
+# so that the grammar and the heap are only loaded once
+# The input holds one formula per line (possibly between double quotes, as passed by eViews)
+# The compiled code of each formula is written in order, one block per formula;
+# formulas that can't be compiled are reported as "Error\r\n<message>", and the run goes on
+# With --jobs N, formulas are compiled by a pool of N processes; the output order is unchanged
+# With --period, Conditions are evaluated in the given period of the heap (its label, e.g. 2006)
+# rather than in the first one
+# With --incremental, the compiled code of each formula is kept in a cache directory, and only
+# the formulas whose text, or the heap values their Conditions read, changed are compiled again
+# (see resultcache.py); the number of formulas reused and rebuilt is reported
+# With --simplify (or MODEL_SIMPLIFY=1), the compiled code is simplified with the values of the heap
+# (see simplify.py), and the number of equations and terms before and after is reported
+# With --cse [SIZE], the subexpressions of at least SIZE nodes (default: 3) that occur more than once
+# in the compiled code of the model, often enough to make it smaller, are computed once, by auxiliary equations
+# written before the code of the first formula (see cse.py), and the number of auxiliary equations and of nodes
+# before and after is reported
+# With --blocks FILE, the compiled equations of all formulas are written in block order instead (see blocks.py),
+# after the errors, and the blocks are written to FILE, one JSON object per line, with:
+#   first, equations   the position of the first equation of the block, among the ordered equations,
+#                      and the number of its equations
+#   simultaneous       whether the block has to be solved iteratively
+#   variables          the variables determined by its equations
+#   pattern            its sparsity pattern, as [equation, variable] positions within the block
+# Usage: python batch.py [input file] [-o output file] [--heap tmp_all_vars.csv] [--jobs N] [--period P]
+#                        [--incremental [directory]] [--simplify] [--cse [SIZE]] [--blocks FILE]
+
+def read_formulas(f):
+    return [line.strip() for line in f if len(line.strip()) > 0]
+
+# Cache of the compiled code, on disk in `directory` for incremental builds
+def results_cache(directory):
+    return resultcache.ResultCache(directory = directory) if directory is not None else resultcache.cache
+
+# Compiles a formula, and returns its output, whether it was reused from the cache of results,
+# and the compilation time this saved
+def build(code, heap, results):
+    reused, saved = results.hits + results.diskHits, results.saved
+    output = compilation.compile_or_error(code, heap, results, simplifying = False)
+    return output, results.hits + results.diskHits > reused, results.saved - saved
+
+# Heap and cache of the worker processes
+# A binary heap is opened again from its file by each worker, so that all of them share
+# the same memory-mapped pages; any other heap is passed once to each worker, never with the tasks
+workerHeap = None
+workerResults = None
+
+def init_worker(heap, path, period, directory):
+    global workerHeap, workerResults
+    workerHeap = heapfile.Heap(path, period) if path is not None else heap
+    workerResults = results_cache(directory)
+
+def build_in_worker(code):
+    return build(code, workerHeap, workerResults)
+
+def build_in_pool(formulas, heap, jobs, directory):
+    if isinstance(heap, heapfile.Heap):
+        initargs = (None, heap.path, heap.period, directory)
+    else:
+        initargs = (heap, None, None, directory)
+
+    pool = multiprocessing.Pool(jobs, init_worker, initargs)
+    try:
+        # imap returns the outputs in the order of the formulas
+        for b in pool.imap(build_in_worker, formulas, max(1, len(formulas) // (jobs * 4))):
+            yield b
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def build_all(formulas, heap, jobs = 1, directory = None):
+    if jobs <= 1:
+        results = results_cache(directory)
+        return (build(code, heap, results) for code in formulas)
+    else:
+        return build_in_pool(formulas, heap, jobs, directory)
+
+def compile_all(formulas, heap, jobs = 1, directory = None):
+    return (output for output, reused, saved in build_all(formulas, heap, jobs, directory))
+
+# Simplifies the outputs of the builds in this process, as they come
+# With a pool, the workers meanwhile compile the next formulas
+def simplify_all(builds, heap, report):
+    for output, reused, saved in builds:
+        if not output.startswith("Error\r\n"):
+            output = simplify.simplify(output, heap, report)
+        yield output, reused, saved
+
+# Hoists the subexpressions repeated over the equations of all the builds, and appends the report to `reports`
+# The auxiliary equations are yielded first, as the output of a build of their own, then the builds
+# with their equations rewritten
+def hoist_all(builds, threshold, reports):
+    builds = list(builds)
+    outputs = [output.split('\n') if not output.startswith("Error\r\n") else [] for output, reused, saved in builds]
+    equations = [e for lines in outputs for e in lines if len(e) > 0]
+    auxiliary, rewritten = cse.hoist(equations, threshold)
+    reports.append(cse.summary(equations, auxiliary, rewritten))
+
+    if len(auxiliary) > 0:
+        yield '\n'.join(auxiliary), False, 0.0
+    rewritten = iter(rewritten)
+    for (output, reused, saved), lines in zip(builds, outputs):
+        if not output.startswith("Error\r\n"):
+            output = '\n'.join([next(rewritten) if len(e) > 0 else e for e in lines])
+        yield output, reused, saved
+
+# Orders the equations of all the builds in blocks, which are appended to `found` and written to `path`
+# The outputs of the formulas that couldn't be compiled are yielded first, then all the equations
+# in block order, as the output of a single build
+def order_all(builds, path, found):
+    builds = list(builds)
+    equations = [e for output, reused, saved in builds if not output.startswith("Error\r\n")
+                 for e in output.split('\n') if len(e) > 0]
+    found.extend(blocks.order(equations))
+    with open(path, 'w') as f:
+        first = 0
+        for b in found:
+            f.write(json.dumps(OrderedDict([('first', first), ('equations', len(b.equations)), ('simultaneous', b.simultaneous),
+                                            ('variables', b.variables), ('pattern', b.pattern)])) + "\n")
+            first += len(b.equations)
+
+    compiled = [b for b in builds if not b[0].startswith("Error\r\n")]
+    for b in builds:
+        if b[0].startswith("Error\r\n"):
+            yield b
+    if len(compiled) > 0:
+        yield ('\n'.join(['\n'.join(b.equations) for b in found]),
+               sum([reused for output, reused, saved in compiled]), sum([saved for output, reused, saved in compiled]))
+
+# Writes the outputs of the builds in order
+# Returns the number of errors, the number of results reused, and the compilation time saved
+def write_all(builds, f):
+    errors, reused, saved = 0, 0, 0.0
+    for output, isReused, seconds in builds:
+        if output.startswith("Error\r\n"):
+            errors += 1
+        reused += isReused
+        saved += seconds
+        f.write(output + "\n")
+    return errors, reused, saved
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser(description = "Compiles a file of formulas, one per line")
+    parser.add_argument('input', nargs = '?', default = '-', help = "file of formulas, or - for stdin (default)")
+    parser.add_argument('-o', '--output', default = '-', help = "file for the compiled code, or - for stdout (default)")
+    parser.add_argument('--heap', default = 'tmp_all_vars.csv', help = "values of the variables (default: tmp_all_vars.csv)")
+    parser.add_argument('-j', '--jobs', type = int, default = 1, help = "number of compiling processes (default: 1)")
+    parser.add_argument('--period', help = "label of the period of the heap for Conditions (default: the first one)")
+    parser.add_argument('--incremental', nargs = '?', const = '_build_cache', metavar = 'DIRECTORY',
+                        help = "only compile the formulas that changed since the last build (default directory: _build_cache)")
+    parser.add_argument('--simplify', action = 'store_true', default = simplify.enabled(),
+                        help = "simplify the compiled code with the values of the heap, and report how much it shrank")
+    parser.add_argument('--cse', nargs = '?', type = int, const = cse.THRESHOLD, metavar = 'SIZE',
+                        help = "compute the repeated subexpressions of at least SIZE nodes once (default size: %d)" % cse.THRESHOLD)
+    parser.add_argument('--blocks', metavar = 'FILE',
+                        help = "write the equations in block order, and the blocks with their sparsity patterns to FILE")
+    return parser.parse_args(args)
+
+def main(args):
+    options = parse_arguments(args)
+
+    if options.input == '-':
+        formulas = read_formulas(sys.stdin)
+    else:
+        with open(options.input, 'r') as f:
+            formulas = read_formulas(f)
+
+    heap = heapfile.load(options.heap)
+    if options.period is not None:
+        try:
+            heap = heap.at(options.period)
+        except KeyError as e:
+            sys.stderr.write(e.args[0] + "\n")
+            return 2
+    builds = build_all(formulas, heap, options.jobs, options.incremental)
+    if options.simplify:
+        report = simplify.Report()
+        builds = simplify_all(builds, heap, report)
+    if options.cse is not None:
+        reports = []
+        builds = hoist_all(builds, options.cse, reports)
+    if options.blocks is not None:
+        found = []
+        builds = order_all(builds, options.blocks, found)
+
+    try:
+        if options.output == '-':
+            errors, reused, saved = write_all(builds, sys.stdout)
+        else:
+            with open(options.output, 'w') as f:
+                errors, reused, saved = write_all(builds, f)
+    except ValueError as e:
+        # The equations can't be ordered, e.g. as two of them determine the same variable
+        sys.stderr.write(str(e) + "\n")
+        return 2
+
+    sys.stderr.write("%d formulas compiled, %d errors\n" % (len(formulas), errors))
+    if options.incremental is not None:
+        sys.stderr.write("%d reused, %d rebuilt, %.3f s of compilation saved\n" % (reused, len(formulas) - reused, saved))
+    if options.simplify:
+        sys.stderr.write(report.summary() + "\n")
+    if options.cse is not None:
+        sys.stderr.write(reports[0] + "\n")
+    if options.blocks is not None:
+        sys.stderr.write(blocks.summary(found) + "\n")
+    return 1 if errors > 0 else 0
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,26 @@
+import os, sys, time, multiprocessing
+
+# Every formula of the corpus is compiled again, whatever the number of processes
+os.environ['MODEL_RESULT_CACHE'] = '0'
+
+import batch
+import heapfile
+import bench_server
+
+# Measures how batch compilation scales with the number of processes (batch.py --jobs)
+# Usage: python bench_jobs.py [number of formulas] [maximum number of processes]
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    maxJobs = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+    formulas = [bench_server.formulas[i % len(bench_server.formulas)] for i in range(count)]
+    heap = heapfile.load('tmp_all_vars.csv')
+
+    reference = None
+    for jobs in range(1, maxJobs + 1):
+        start = time.time()
+        list(batch.compile_all(formulas, heap, jobs))
+        elapsed = time.time() - start
+        reference = reference or elapsed
+        print ("%2d jobs  %7.2f s  %7.1f formulas/s  speedup %.2f" % (jobs, elapsed, count / elapsed, reference / elapsed))
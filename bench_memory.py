@@ -0,0 +1,54 @@
+import sys, gc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import parsecache
+import benchmark
+
+# Measures the memory taken by parsed Formulas, as kept by a long-running compiler
+# The formulas of the benchmark corpus are parsed many times over, each copy with its own
+# variable names (as in a real model), so that the parse cache doesn't share them
+# Sizes are those of all the objects reachable from the parsed Formulas, each counted once
+# Usage: python bench_memory.py [copies]
+
+def rename(code, i):
+    # Appends a suffix to the variables on the left-hand side of the formula
+    lhs, sep, rhs = code.partition('=')
+    return lhs.replace('[', '_%d[' % i, 1) + sep + rhs if sep else code
+
+# The size of the instances of classes without __slots__ includes the pointer to their dict
+def deep_size(roots):
+    seen = set()
+    stack = list(roots)
+    size = count = 0
+    while len(stack) > 0:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        count += 1
+        if isinstance(o, (tuple, list)):
+            stack.extend(o)
+    return size, count
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource is not None else 0
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    corpus = benchmark.load_corpus(benchmark.CORPUS)
+    codes = [rename(code, i) for i in range(copies) for code in corpus]
+
+    gc.collect()
+    before = peak_rss()
+    formulas = [parsecache.parse(code) for code in codes]
+    gc.collect()
+    after = peak_rss()
+
+    size, count = deep_size(formulas)
+    print ("%d formulas  %d objects  %.1f MB  %.0f bytes/formula  peak RSS +%d kB" %
+           (len(formulas), count, size / 1e6, float(size) / len(formulas), after - before))
@@ -0,0 +1,37 @@
+import sys
+from timeit import default_timer as timer
+
+import parsecache
+import grammar
+
+# Compares the parsers (see parsecache.py) as the nesting depth of sums
+# and the length of formulas grow
+# Usage: python bench_parser.py [repetitions]
+
+def nested_sums(depth):
+    code = "X[c0]"
+    for i in range(1, depth + 1):
+        code = "sum(%s + Y[c%d], c%d in 01 02)" % (code, i, i)
+    return "Z = " + code
+
+def long_formula(terms):
+    return "Z[c] = " + " + ".join(["log(A%d[c]) * B%d[c](-1)" % (i, i) for i in range(terms)]) + ", c in 01 02"
+
+def best_time(code, parser, repetitions):
+    times = []
+    for i in range(repetitions):
+        start = timer()
+        parsecache.parse(code, parser)
+        times.append(timer() - start)
+    return min(times)
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print ("%-8s %5s " % ('', 'size') + ' '.join(['%10s' % p for p in parsecache.BACKENDS]))
+    for name, generate, sizes in [('depth', nested_sums, [2, 4, 6, 8, 10]),
+                                  ('length', long_formula, [10, 20, 40, 80, 160])]:
+        for size in sizes:
+            code = generate(size)
+            print ("%-8s %5d " % (name, size) +
+                   ' '.join(['%10.4f' % best_time(code, p, repetitions) for p in parsecache.BACKENDS]))
+    grammar.setPackrat(False)
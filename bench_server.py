@@ -0,0 +1,86 @@
+import os, sys, time, shutil, tempfile, threading, subprocess
+
+import heapfile
+import server
+import client
+
+# Compares the latency and throughput of the compile server (server.py)
+# with the file-drop path of the watchdog compiler (async-compiler.py)
+# Usage: python bench_server.py [number of formulas]
+
+sectors = ' '.join(['%02d' % i for i in range(1, 25)])
+
+formulas = ["|V|[com] = |V|D[com] + |V|M[com], V in Q CH G I DS, com in " + sectors,
+            "CI[s] = sum(CID[c, s] + CIM[c, s] if CID[c, s] <> 0, c in " + sectors + "), s in " + sectors,
+            "!pv CH[c] = CHD[c] + CHM[c] if CH[c] > 0, c in " + sectors,
+            "EBE[s] = VA[s] - @elem(PK[s](-1), %baseyear) * Tdec[s] * K[s](-1), s in " + sectors]
+
+def summary(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    print ("%-10s %5d formulas  mean %7.2f ms  p50 %7.2f ms  p95 %7.2f ms  %7.1f formulas/s" %
+           (name, len(latencies),
+            1000 * sum(latencies) / len(latencies),
+            1000 * latencies[len(latencies) // 2],
+            1000 * latencies[int(len(latencies) * 0.95)],
+            len(latencies) / elapsed))
+
+def bench_server(count, heap):
+    compileServer = server.CompileServer(('127.0.0.1', 0), heap)
+    thread = threading.Thread(target = compileServer.serve_forever)
+    thread.start()
+
+    compileClient = client.Client(compileServer.port)
+    latencies = []
+    start = time.time()
+    for i in range(count):
+        t = time.time()
+        compileClient.compile(formulas[i % len(formulas)])
+        latencies.append(time.time() - t)
+    elapsed = time.time() - start
+
+    compileClient.shutdown()
+    compileClient.close()
+    thread.join()
+    compileServer.server_close()
+    summary("server", latencies, elapsed)
+
+def wait_for(path, timeout = 30):
+    deadline = time.time() + timeout
+    while not (os.path.exists(path) and os.path.getsize(path) > 0):
+        if time.time() > deadline:
+            raise IOError("Timed out waiting for " + path)
+        time.sleep(0.001)
+
+def bench_file_drop(count):
+    directory = tempfile.mkdtemp()
+    shutil.copy('tmp_all_vars.csv', directory)
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'async-compiler.py')
+    log = open(os.path.join(directory, 'log.txt'), 'w')
+    process = subprocess.Popen([sys.executable, '-u', script, directory], stdout = log)
+    while 'Ready' not in open(log.name).read():
+        time.sleep(0.01)
+
+    compiler_in = os.path.join(directory, '_compiler_in')
+    compiler_out = os.path.join(directory, '_compiler_out')
+    latencies = []
+    start = time.time()
+    for i in range(count):
+        filename = str(i) + '.txt'
+        t = time.time()
+        with open(os.path.join(compiler_in, filename), 'w') as f:
+            f.write(formulas[i % len(formulas)])
+        wait_for(os.path.join(compiler_out, filename))
+        latencies.append(time.time() - t)
+    elapsed = time.time() - start
+
+    with open(os.path.join(compiler_in, 'shutdown.txt'), 'w') as f:
+        f.write('shutdown')
+    process.wait()
+    log.close()
+    shutil.rmtree(directory)
+    summary("file drop", latencies, elapsed)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    bench_server(count, heapfile.load('tmp_all_vars.csv'))
+    bench_file_drop(count)
@@ -0,0 +1,61 @@
+import sys, time
+import numpy as np
+
+import blocks
+import simulation
+
+# Measures the simulation of compiled equations (simulation.py) on a model of `sectors` sectors,
+# whose equations have the forms of the compiled code:
+#   Q_k = 0.3 * Q_k+1 + 0.2 * Q_k-1 + D_k                          one simultaneous block of all the sectors
+#   d(log(K_k)) = 0.5 * d(log(Q_k)) + 0.01                         recursive, over time, by Newton steps
+#   PQ_k * Q_k = @elem(PQ_k(-1), %baseyear) * Q_k + W_k * Q_k(-1)  recursive, by Newton steps
+# over `periods` periods of random data. The model is solved for all periods at once, and period by period;
+# the simultaneous block is then solved by Newton's method, for a smaller number of sectors
+# Usage: python bench_simulation.py [sectors] [periods]
+
+def model(sectors):
+    equations = []
+    for k in range(sectors):
+        names = dict(k = k, next = (k + 1) % sectors, previous = (k - 1) % sectors)
+        equations.append("Q_%(k)d = 0.3 * Q_%(next)d + 0.2 * Q_%(previous)d + D_%(k)d" % names)
+        equations.append("d(log(K_%(k)d)) = 0.5 * d(log(Q_%(k)d)) + 0.01" % names)
+        equations.append("PQ_%(k)d * Q_%(k)d = @elem(PQ_%(k)d(-1), %%baseyear) * Q_%(k)d + W_%(k)d * Q_%(k)d(-1)" % names)
+    return equations
+
+def data(sectors, periods):
+    random = np.random.RandomState(0)
+    labels = [str(2000 + t) for t in range(periods)]
+    series = {}
+    for k in range(sectors):
+        for name in ['D', 'W', 'Q', 'K', 'PQ']:
+            series['%s_%d' % (name, k)] = list(random.uniform(1.0, 2.0, periods))
+    return simulation.from_series(labels, series)
+
+def run(sectors, periods, method, byPeriod = False):
+    start = time.time()
+    m = simulation.Model(model(sectors), data(sectors, periods), {'%baseyear': '2001'})
+    compiled = time.time() - start
+
+    start = time.time()
+    if byPeriod:
+        results = [r for t in range(m.lag, periods) for r in m.solve(t, t, method)]
+    else:
+        results = m.solve(method = method)
+    solved = time.time() - start
+
+    equations = sum([len(b.equations) for b in m.blocks])
+    largest = max([r.iterations for r in results if r.block.simultaneous])
+    print ("%-12s %-10s %6d equations x %3d periods  compile %6.2f s  solve %7.2f s  %9.0f equation-periods/s  "
+           "%4d iterations of the largest block  %s" %
+           (method, 'by period' if byPeriod else 'at once', equations, periods - m.lag, compiled, solved,
+            equations * (periods - m.lag) / solved, largest, simulation.summary(results)))
+    return m
+
+if __name__ == '__main__':
+    sectors = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    periods = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    m = run(sectors, periods, 'gauss-seidel')
+    print (blocks.summary(m.blocks))
+    run(sectors, periods, 'gauss-seidel', byPeriod = True)
+    run(min(sectors, 200), periods, 'newton')
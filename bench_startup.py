@@ -0,0 +1,74 @@
+import os, sys, json, shutil, tempfile, subprocess
+
+# Startup time of the compiler
+# compiler.py runs in a new process for each formula compiled from eViews, which first imports
+# the compiler and loads the heap: for most formulas, this takes much longer than compiling them.
+# Measures, each in a new process and as the best of a number of repetitions:
+#   the time taken to import each module (including the modules it imports itself)
+#   the time taken by compiler.py to compile a formula, from start to exit, with the parse and result
+#   caches disabled, and the heavy modules (NumPy, pyparsing) it had to import
+# Usage: python bench_startup.py [repetitions]
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+MODULES = ['profiling', 'heapfile', 'evaluator', 'elements', 'fastparser', 'parsecache', 'resultcache',
+           'compilation', 'numpy', 'pyparsing', 'grammar']
+
+FORMULAS = ["Q[c] = QD[c] + QM[c], c in 01 02 03 04",
+            "CH[c] = CHD[c] if CHD[c] > 1000, c in 01 02 03 04",
+            "= QD[c]"]
+
+HEAVY = ['numpy', 'pyparsing']
+
+IMPORT = """
+from timeit import default_timer as timer
+start = timer()
+import %s
+print (timer() - start)
+"""
+
+# Runs compiler.py as the frozen executable would, and reports the heavy modules it imported
+RUN = """
+import sys, json, runpy
+from timeit import default_timer as timer
+start = timer()
+sys.argv = ['compiler.py']
+runpy.run_path(%r, run_name = '__main__')
+print (json.dumps([timer() - start, [m for m in %r if m in sys.modules]]))
+"""
+
+# Runs Python code in a new process, and returns the last line it printed
+def python(source, cwd = ROOT, env = None):
+    lines = subprocess.check_output([sys.executable, '-c', source], cwd = cwd, env = env).decode('ascii').strip().splitlines()
+    return lines[-1] if len(lines) > 0 else None
+
+def import_time(module, repetitions):
+    return min([float(python(IMPORT % module)) for i in range(repetitions)])
+
+def compile_time(code, directory, repetitions):
+    with open(os.path.join(directory, 'in.txt'), 'w') as f:
+        f.write(code + "\n")
+    env = dict(os.environ, MODEL_PARSE_CACHE = '0', MODEL_RESULT_CACHE = '0', PYTHONPATH = ROOT)
+    runs = [json.loads(python(RUN % (os.path.join(ROOT, 'compiler.py'), HEAVY), directory, env))
+            for i in range(repetitions)]
+    return min([r[0] for r in runs]), runs[0][1]
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    print ("%-12s %10s" % ("import", "ms"))
+    for module in MODULES:
+        print ("%-12s %10.1f" % (module, import_time(module, repetitions) * 1e3))
+
+    directory = tempfile.mkdtemp()
+    try:
+        shutil.copy(os.path.join(ROOT, 'tmp_all_vars.csv'), directory)
+        # Converts the heap once, as a previous compilation would have
+        python("import heapfile; heapfile.load('tmp_all_vars.csv')", directory, dict(os.environ, PYTHONPATH = ROOT))
+        print ("")
+        print ("%-10s %s" % ("compile ms", "formula (heavy modules imported)"))
+        for code in FORMULAS:
+            seconds, heavy = compile_time(code, directory, repetitions)
+            print ("%10.1f %s (%s)" % (seconds * 1e3, code, ', '.join(heavy) or 'none'))
+    finally:
+        shutil.rmtree(directory)
@@ -0,0 +1,35 @@
+import sys, time
+
+import grammar
+
+# Compares code generation through Templates (Formula.compile)
+# with compiling the Equation tree for each binding (Equation.compile), on large loops
+# Usage: python bench_template.py [repetitions]
+
+sectors = ' '.join(['%02d' % i for i in range(1, 25)])
+
+formulas = ["|V|[c, s, r] = |V|D[c, s, r] * A[c] + |V|M[c, s, r], V in Q CH G I DS X M, c in " + sectors +
+            ", s in " + sectors + ", r in R1 R2 R3 R4 R5",
+            "!pv |V|[c, s] = value(|V|D[c, s] + |V|M[c, s]) + @elem(PK[s](-1), %baseyear) * d(log(CK[s])), " +
+            "V in Q CH G I DS X M, c in " + sectors + ", s in " + sectors]
+
+def walk_tree(formula, heap):
+    option = formula.option()
+    return "\n".join([formula.equation.compile(b, heap, option) for b in formula.iter_bindings({}, heap)])
+
+def timed(function, repetitions):
+    start = time.time()
+    for i in range(repetitions):
+        output = function()
+    return output, (time.time() - start) / repetitions
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    for code in formulas:
+        formula = grammar.formula.parseString(code)[0]
+        bindings, bindingsTime = timed(lambda: list(formula.iter_bindings({}, {})), repetitions)
+        walked, walkTime = timed(lambda: walk_tree(formula, {}), repetitions)
+        filled, fillTime = timed(lambda: formula.compile({}), repetitions)
+        assert walked == filled
+        print ("%6d bindings  bindings only %.3f s  tree walk %.3f s  template %.3f s  codegen speedup %.1fx" %
+               (len(bindings), bindingsTime, walkTime, fillTime, (walkTime - bindingsTime) / (fillTime - bindingsTime)))
@@ -0,0 +1,169 @@
+import os, sys, json, time, shutil, tempfile, argparse, platform, subprocess, multiprocessing
+from timeit import default_timer as timer
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import heapfile
+import parsecache
+from elements import Template
+
+# Benchmark suite of the compiler
+# Each formula of the corpus (benchmarks/corpus.txt) is measured separately, phase by phase:
+#   parse        parsing the formula (without any cache)
+#   bindings     generating the iterator bindings
+#   conditions   evaluating the condition for all bindings
+#   codegen      generating the code of the bindings for which the condition holds
+#                (this includes sums, and thus the evaluation of their own conditions)
+#   compile      Formula.compile, i.e. everything but parsing
+# Times are the best of a number of repetitions. Loading the heap is measured separately.
+# Peak memory is measured by compiling each formula in a new process.
+# Results are written as JSON, and two result files can be compared:
+# Usage: python benchmark.py [-o results.json] [--repetitions N]
+#        python benchmark.py --compare before.json after.json
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'corpus.txt')
+
+PHASES = ['parse', 'bindings', 'conditions', 'codegen', 'compile']
+
+def load_corpus(path):
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if len(line.strip()) > 0 and not line.startswith('#')]
+
+def best_time(function, repetitions):
+    times = []
+    for i in range(repetitions):
+        start = timer()
+        function()
+        times.append(timer() - start)
+    return min(times)
+
+def peak_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+# The heap is converted in a temporary directory, so that the heap of the CSV isn't replaced
+def measure_heap(csvPath, repetitions):
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, os.path.basename(heapfile.heapPath(csvPath)))
+    try:
+        return { 'csv': best_time(lambda: heapfile.readCSV(csvPath), repetitions),
+                 'convert': best_time(lambda: heapfile.convert(csvPath, path), repetitions),
+                 'open': best_time(lambda: heapfile.Heap(path).close(), repetitions) }
+    finally:
+        shutil.rmtree(directory)
+
+def measure_formula(code, heap, repetitions):
+    formula = parsecache.parse(code)
+    iteratorDicts = formula.build_iterator_dicts()
+    conditions = formula.evaluate_conditions({}, heap, iteratorDicts)
+    bindings = [b for c, b in zip(conditions, iteratorDicts) if c]
+    option = formula.option()
+
+    def codegen():
+        if len(bindings) > 0:
+            template = Template.for_bindings(formula.equation, bindings[0], option)
+            return "\n".join([template.fill(b, heap) for b in bindings])
+
+    output = formula.compile(heap)
+    return { 'formula': code,
+             'bindings_count': len(iteratorDicts),
+             'lines': len(output.splitlines()),
+             'parse': best_time(lambda: parsecache.parse(code), repetitions),
+             'bindings': best_time(formula.build_iterator_dicts, repetitions),
+             'conditions': best_time(lambda: formula.evaluate_conditions({}, heap, iteratorDicts), repetitions),
+             'codegen': best_time(codegen, repetitions),
+             'compile': best_time(lambda: formula.compile(heap), repetitions) }
+
+# Run in a new process, see measure_memory
+def compile_for_memory(arguments):
+    code, heapPath = arguments
+    heap = heapfile.Heap(heapPath)
+    formula = parsecache.parse(code)
+    before = peak_rss()
+    formula.compile(heap)
+    return before, peak_rss()
+
+def measure_memory(corpus, heapPath):
+    if resource is None:
+        return [None for code in corpus]
+    pool = multiprocessing.Pool(1, maxtasksperchild = 1)
+    try:
+        rss = pool.map(compile_for_memory, [(code, heapPath) for code in corpus], 1)
+    finally:
+        pool.close()
+        pool.join()
+    # ru_maxrss is in kilobytes
+    return [{ 'peak_rss_kb': after, 'compile_rss_kb': after - before } for before, after in rss]
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd = os.path.dirname(os.path.abspath(__file__))).strip().decode('ascii')
+    except Exception:
+        return None
+
+def run(corpusPath, csvPath, repetitions):
+    corpus = load_corpus(corpusPath)
+    results = { 'commit': git_commit(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'repetitions': repetitions,
+                'heap': measure_heap(csvPath, repetitions) }
+
+    heap = heapfile.load(csvPath)
+    formulas = [measure_formula(code, heap, repetitions) for code in corpus]
+    for f, memory in zip(formulas, measure_memory(corpus, heap.path)):
+        f['memory'] = memory
+    results['formulas'] = formulas
+    results['totals'] = dict([(p, sum([f[p] for f in formulas])) for p in PHASES])
+    return results
+
+def report(results):
+    print ("heap: csv %(csv).4f s  convert %(convert).4f s  open %(open).6f s" % results['heap'])
+    print ("%3s %8s %7s " % ('#', 'bindings', 'lines') + ' '.join(['%10s' % p for p in PHASES]) + ' %10s' % 'rss kB')
+    for i, f in enumerate(results['formulas']):
+        memory = f['memory']['compile_rss_kb'] if f['memory'] is not None else '-'
+        print ("%3d %8d %7d " % (i + 1, f['bindings_count'], f['lines']) +
+               ' '.join(['%10.4f' % f[p] for p in PHASES]) + ' %10s' % memory)
+    print ("%3s %8s %7s " % ('', '', 'total') + ' '.join(['%10.4f' % results['totals'][p] for p in PHASES]))
+
+def compare(before, after):
+    print ("before: %s  after: %s" % (before['commit'], after['commit']))
+    print ("%3s " % '#' + ' '.join(['%10s' % p for p in PHASES]))
+    rows = [(str(i + 1), b, a) for i, (b, a) in enumerate(zip(before['formulas'], after['formulas']))
+            if b['formula'] == a['formula']]
+    rows.append(('all', before['totals'], after['totals']))
+    for name, b, a in rows:
+        print ("%3s " % name + ' '.join(['%9.2fx' % (b[p] / a[p]) if a[p] > 0 else '%10s' % '-' for p in PHASES]))
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser(description = "Benchmarks parsing, condition evaluation and code generation")
+    parser.add_argument('--corpus', default = CORPUS, help = "file of formulas, one per line")
+    parser.add_argument('--heap', default = 'tmp_all_vars.csv', help = "values of the variables (default: tmp_all_vars.csv)")
+    parser.add_argument('-r', '--repetitions', type = int, default = 5, help = "repetitions of each measure (default: 5)")
+    parser.add_argument('-o', '--output', help = "JSON file for the results")
+    parser.add_argument('--compare', nargs = 2, metavar = ('BEFORE', 'AFTER'), help = "compare two JSON result files (speedups)")
+    return parser.parse_args(args)
+
+def main(args):
+    options = parse_arguments(args)
+    if options.compare:
+        with open(options.compare[0]) as before, open(options.compare[1]) as after:
+            compare(json.load(before), json.load(after))
+        return 0
+
+    results = run(options.corpus, options.heap, options.repetitions)
+    report(results)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+    return 0
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+from collections import namedtuple
+
+import simplify
+
+# Block structure of a compiled model
+# eViews solves a model block by block: the equations are ordered so that each block only depends
+# on the blocks before it, and only the simultaneous blocks need to be solved iteratively.
+# The compiled equations of a whole model are thus ordered here once, rather than by eViews each time.
+# Each equation determines the first variable of its left-hand side, as in eViews
+# (e.g. PCH_01 in PCH_01 * CH_01 = ..., K_01 in d(log(K_01)) = ...),
+# and depends on the variables it refers to in the current period, on either side, and in later periods:
+# variables in earlier periods (e.g. K_01(-1)) and the arguments of @elem are given when solving a period.
+# The strongly connected components of the graph of these dependencies are the blocks:
+# a block is simultaneous if it holds more than one equation, or if its equation depends on its own variable,
+# and recursive otherwise. The sparsity pattern of a block gives the variables of the block
+# each of its equations refers to, as (row, column) positions of its equations and their variables.
+# Variables which no equation determines are exogenous, and left out of the graph.
+# The graph is built, and its components found, in time linear in the size of the equations
+
+Block = namedtuple("Block", ['equations', 'variables', 'simultaneous', 'pattern'])
+
+# Equal signs which are part of comparisons
+COMPARISONS = ['<', '>', '!']
+
+# The variable an equation determines, and the variables it depends on, in their order
+def incidence(equation):
+    tokens = simplify.tokenize(equation, strict = False)
+    variable, references = None, []
+    depth, i = 0, 0
+    while i < len(tokens):
+        kind, text = tokens[i]
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        if kind == 2 and following == '(':
+            offset, length = offsetAt(tokens, i + 2) if text[0] not in '@%' else (None, 0)
+            if offset is not None:
+                # X(-1) is given, X(1) isn't
+                if offset >= 0:
+                    references.append(text.upper())
+                i += 2 + length
+                continue
+            if text.lower() == '@elem':
+                i = closing(tokens, i + 1) + 1
+                continue
+        elif kind == 2 and text[0] not in '@%':
+            references.append(text.upper())
+        elif text == '(':
+            depth += 1
+        elif text == ')':
+            depth -= 1
+        elif text == '=' and depth == 0 and variable is None and following != '=' and \
+             (i == 0 or tokens[i - 1][1] not in COMPARISONS):
+            # The variable determined isn't a dependency, unless the equation refers to it again
+            variable = references.pop(0) if len(references) > 0 else ''
+        i += 1
+    if not variable:
+        raise ValueError("No variable on the left-hand side of: " + equation)
+    return variable, references
+
+# Time offset given by the tokens following an opening parenthesis, e.g. -1 for X(-1),
+# and the number of tokens it takes, closing parenthesis included
+def offsetAt(tokens, start):
+    texts = [t[1] for t in tokens[start:start + 3]]
+    if len(texts) >= 2 and texts[0].isdigit() and texts[1] == ')':
+        return int(texts[0]), 2
+    if len(texts) == 3 and texts[0] == '-' and texts[1].isdigit() and texts[2] == ')':
+        return -int(texts[1]), 3
+    return None, 0
+
+# Position of the parenthesis closing the one at `start`
+def closing(tokens, start):
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i][1] == '(':
+            depth += 1
+        elif tokens[i][1] == ')':
+            depth -= 1
+            if depth == 0:
+                return i
+    raise ValueError("Unbalanced parentheses")
+
+# The equations each equation depends on, by position, and the variable each one determines
+def dependencies(equations):
+    variables, references = [], []
+    for e in equations:
+        variable, refs = incidence(e)
+        variables.append(variable)
+        references.append(refs)
+
+    determinedBy = {}
+    for k, v in enumerate(variables):
+        if v in determinedBy:
+            raise ValueError("Variable " + v + " is determined by several equations: " +
+                             equations[determinedBy[v]] + ", " + equations[k])
+        determinedBy[v] = k
+
+    successors = []
+    for refs in references:
+        positions, seen = [], set()
+        for r in refs:
+            k = determinedBy.get(r)
+            if k is not None and k not in seen:
+                positions.append(k)
+                seen.add(k)
+        successors.append(positions)
+    return variables, successors
+
+# Strongly connected components of a graph, given by the successors of each node, with Tarjan's algorithm
+# Each component comes after the components it depends on, i.e. those its nodes have edges to
+# The depth-first search keeps its own stack, as models are far deeper than Python's recursion limit
+def components(successors):
+    index = [None] * len(successors)
+    lowlink = [0] * len(successors)
+    onStack = [False] * len(successors)
+    stack, found, counter = [], [], 0
+    for root in range(len(successors)):
+        if index[root] is not None:
+            continue
+        work = [(root, 0)]
+        while len(work) > 0:
+            node, next = work.pop()
+            if next == 0:
+                index[node] = lowlink[node] = counter
+                counter += 1
+                stack.append(node)
+                onStack[node] = True
+            recursed = False
+            edges = successors[node]
+            while next < len(edges):
+                s = edges[next]
+                next += 1
+                if index[s] is None:
+                    work.append((node, next))
+                    work.append((s, 0))
+                    recursed = True
+                    break
+                elif onStack[s]:
+                    lowlink[node] = min(lowlink[node], index[s])
+            if recursed:
+                continue
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    s = stack.pop()
+                    onStack[s] = False
+                    component.append(s)
+                    if s == node:
+                        break
+                component.reverse()
+                found.append(component)
+            if len(work) > 0:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+    return found
+
+# Orders equations in blocks, each block coming after those it depends on
+def order(equations):
+    variables, successors = dependencies(equations)
+    blocks = []
+    for component in components(successors):
+        column = dict([(k, c) for c, k in enumerate(component)])
+        pattern = [(r, column[s]) for r, k in enumerate(component) for s in successors[k] if s in column]
+        # The equation of a variable refers to it, at least implicitly
+        pattern = sorted(set(pattern) | set([(r, r) for r in range(len(component))]))
+        simultaneous = len(component) > 1 or component[0] in successors[component[0]]
+        blocks.append(Block([equations[k] for k in component], [variables[k] for k in component],
+                            simultaneous, pattern))
+    return blocks
+
+# Counts of the blocks, for reports
+def summary(blocks):
+    simultaneous = [b for b in blocks if b.simultaneous]
+    largest = max([len(b.equations) for b in simultaneous]) if len(simultaneous) > 0 else 0
+    return "%d equations in %d blocks: %d recursive, %d simultaneous (largest: %d equations)" % \
+        (sum([len(b.equations) for b in blocks]), len(blocks), len(blocks) - len(simultaneous), len(simultaneous), largest)
@@ -0,0 +1,95 @@
+import os, threading, hashlib
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Base class of the caches used by the compiler (see parsecache.py and resultcache.py)
+# Entries are kept in a bounded, least recently used, in-memory cache,
+# and optionally in a directory on disk, one pickle file per entry, so that
+# they can be shared between processes (e.g. successive runs of compiler.py)
+class Cache(object):
+    # Change this whenever the classes in elements.py or resultcache.py change, to ignore older pickles
+    FORMAT = '3'
+
+    def __init__(self, maxsize = 1024, directory = None, enabled = True):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+
+        if self.enabled and self.directory is not None and not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def stats(self):
+        return { 'hits': self.hits, 'diskHits': self.diskHits, 'misses': self.misses, 'size': len(self.entries) }
+
+    def entryPath(self, key):
+        return os.path.join(self.directory, hashlib.sha1((self.FORMAT + key).encode('utf-8')).hexdigest() + '.pickle')
+
+    def load(self, key):
+        path = self.entryPath(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                storedKey, value = pickle.load(f)
+            return value if storedKey == key else None
+        # An unreadable entry (e.g. written by an older version) is simply a miss
+        except Exception:
+            return None
+
+    def store(self, key, value):
+        path = self.entryPath(key)
+        tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmpPath, 'wb') as f:
+            pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(tmpPath, path)
+
+    def remember(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+
+    # Returns the cached value for a key, from memory or from disk, or None
+    # Values for which `valid` is false are discarded
+    def fetch(self, key, valid = lambda value: True):
+        with self.lock:
+            value = self.entries.pop(key, None)
+            if value is not None and valid(value):
+                self.entries[key] = value
+                self.hits += 1
+                return value
+
+        if self.directory is not None:
+            value = self.load(key)
+            if value is not None and valid(value):
+                self.diskHits += 1
+                self.remember(key, value)
+                return value
+            elif value is not None:
+                os.remove(self.entryPath(key))
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self.remember(key, value)
+        if self.directory is not None:
+            self.store(key, value)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def enabled(variable):
+    return os.environ.get(variable, '1') != '0'
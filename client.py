@@ -0,0 +1,59 @@
+import os, sys, socket, time, random
+
+import protocol
+
+# Client of the compile server (server.py)
+class Client(object):
+    def __init__(self, port = protocol.PORT, host = '127.0.0.1'):
+        self.sock = socket.create_connection((host, port))
+
+    def request(self, command, argument = None):
+        protocol.send(self.sock, protocol.request(command, argument))
+        return protocol.receive(self.sock)
+
+    def compile(self, code):
+        return self.request(protocol.COMPILE, code)
+
+    def ping(self):
+        return self.request(protocol.PING)
+
+    def shutdown(self):
+        return self.request(protocol.SHUTDOWN)
+
+    def close(self):
+        self.sock.close()
+
+def ensure_directory(_path):
+    if not os.path.exists(_path):
+        os.makedirs(_path)
+
+# Drop-in replacement for imcompiler.py, which compiles through the server
+# instead of loading the grammar and the heap in a new process
+# The formula to be compiled is passed in the first command line argument,
+# or --shutdown to stop the server
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(0)
+
+    try:
+        client = Client()
+        if sys.argv[1] == '--shutdown':
+            print (client.shutdown())
+            sys.exit(0)
+        output = client.compile(sys.argv[1])
+        client.close()
+    except socket.error as e:
+        output = "Error\r\nCompile server not reachable: " + repr(e)
+
+    compiler_out = "_compiler_out"
+    ensure_directory(compiler_out)
+
+    # Name of the file where the output will be saved
+    filename = str(int(time.time())) + str(random.randint(0, 999)) + ".txt"
+
+    # Writes the output, compiled code or error message to a file in _compiler_out
+    with open(os.path.join(compiler_out, filename), 'w') as f:
+        f.write(output)
+
+    # Prints the filename to stdout, so that eViews can then load it
+    print (filename)
@@ -0,0 +1,30 @@
+import parsecache
+import resultcache
+import simplify
+
+# Formulas are passed by eViews between double quotes
+def clean(code):
+    code = code.strip()
+    if len(code) > 0 and code[0] == '"':
+        code = code[1:-1]
+    return code.strip()
+
+# The compiled code is simplified with the values of the heap if `simplifying`, by default
+# if the MODEL_SIMPLIFY environment variable is set to 1 (see simplify.py)
+# It is simplified after the cache of results, so that the heap values it reads needn't be recorded
+def compile_formula(code, heap, results = resultcache.cache, parser = parsecache.cache, simplifying = None):
+    output = results.compile(code, heap, parser)
+    if simplifying or (simplifying is None and simplify.enabled()):
+        output = simplify.simplify(output, heap)
+    return output
+
+# Compiles a formula, and returns either the compiled code,
+# or "Error" followed by the error message, which is how errors are reported to eViews
+def compile_or_error(code, heap, results = resultcache.cache, simplifying = None):
+    try:
+        return compile_formula(clean(code), heap, results, simplifying = simplifying)
+    except Exception as e:
+        return error(e)
+
+def error(e):
+    return "Error\r\n" + (str(e) if parsecache.isParseError(e) else repr(e))
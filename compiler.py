@@ -1,7 +1,14 @@
-import os, sys, csv
+import profiling
+import sys
 
-import pyparsing
-import grammar
+import compilation
+import heapfile
+import parsecache
+import resultcache
+
+# Profiling is enabled with --profile, see profiling.py
+profiling.configure(sys.argv)
+startup = profiling.startup('compiler')
 
 # The code to be compiled is passed in file in.txt
 with open("in.txt", "r") as f:
@@ -11,23 +18,31 @@ if code[0] == '"':
     code = code[1:-1]
 
 # Load values of all variables
-with open('tmp_all_vars.csv', 'rb') as csvfile:
-    rows = list(csv.reader(csvfile))
-    heap = dict(zip(rows[0],
-                    [float(e) if e != 'NA' else
-                     None for e in rows[2]]))
-
-# Compilation
-if len(sys.argv) > 1:
-    output = grammar.formula.parseString(code)[0].compile(heap)
-else:
-    try:
-        output = grammar.formula.parseString(code)[0].compile(heap)
-    except pyparsing.ParseException as e:
-        output = "Error\r\n" + str(e)
-    except Exception as e:
-        output = "Error\r\n" + repr(e)
-
-# Writes the output, compiled code or error message to file out.txt
-with open("out.txt", 'w') as f:
-    f.write(output)
+# A CSV newer than its binary heap is read lazily rather than converted
+with startup.phase('heap'):
+    heap = heapfile.load('tmp_all_vars.csv', lazy = True)
+
+# Parsed and compiled formulas are cached on disk between runs
+cache = parsecache.persistent_cache()
+results = resultcache.persistent_cache()
+startup.write()
+
+def compile_formula(code):
+    with profiling.phase('codegen'):
+        return compilation.compile_formula(code, heap, results, cache)
+
+with profiling.formula(code) as profile:
+    # Compilation
+    if len(sys.argv) > 1:
+        output = compile_formula(code)
+    else:
+        try:
+            output = compile_formula(code)
+        except Exception as e:
+            output = compilation.error(e)
+
+    # Writes the output, compiled code or error message to file out.txt
+    with profile.phase('write'):
+        with open("out.txt", 'w') as f:
+            f.write(output)
+    profile.count('output', len(output))
@@ -0,0 +1,147 @@
+import hashlib
+from collections import Counter, OrderedDict
+
+import simplify
+
+# Common subexpression elimination
+# Expanding a formula over its iterators repeats the same subexpressions over many equations,
+# e.g. d(log(CK_01)) or @elem(PK_01(-1), %baseyear) in each equation of sector 01.
+# Each subexpression which occurs more than once in the right-hand sides of the equations of a model,
+# which has at least THRESHOLD nodes (variables, constants, operators and functions), and whose hoisting
+# makes the model smaller, is computed once by an auxiliary equation, e.g. CSE_3F2A9C0B1D4E = d(log(CK_01)),
+# and replaced by its variable.
+# Hoisting a subexpression of `size` nodes which occurs `count` times saves size - 1 nodes in each of
+# its occurrences but one, which moves to the auxiliary equation; that costs 2 nodes, the variable of
+# the auxiliary equation and the one replacing the last occurrence, e.g. a product of two variables
+# is only hoisted if it occurs at least 4 times, and d(log(CK_01)) 3 times.
+# Its name is given by a hash of its code, so that it is the same in each build of the model.
+# The largest subexpressions are hoisted first; the subexpressions of hoisted ones which still occur
+# more than once are then hoisted in turn.
+# Function calls are hoisted as a whole, but never their arguments: the arguments of functions such
+# as d or @elem are read in other periods, for which auxiliary equations aren't solved.
+# The left-hand sides of equations, which give the variables they determine, are left as they are,
+# as are the equations which can't be parsed (see simplify.py).
+# Hoisting is enabled with the --cse option of batch.py, as the same subexpression may occur in several
+# formulas, and must then be defined once for the whole model
+
+PREFIX = 'CSE_'
+THRESHOLD = 3
+
+# Length of the hashes in the names, in hexadecimal digits, extended in case of a collision
+HASH = 12
+
+def size(node):
+    return 1 + sum([size(c) for c in simplify.children(node)])
+
+# Nodes saved by hoisting a subexpression
+def saving(node, count):
+    return (count - 1) * (size(node) - 1) - 2
+
+def isLeaf(node):
+    return isinstance(node, (simplify.Num, simplify.Ref, simplify.Atom))
+
+# Counts the subexpressions which can be hoisted, i.e. those outside of the arguments of functions
+def count(node, counts):
+    if isLeaf(node):
+        return
+    counts[node] += 1
+    if not isinstance(node, simplify.Call):
+        for c in simplify.children(node):
+            count(c, counts)
+
+# The node, with its children rebuilt by `f`
+def rebuild(node, f):
+    if isinstance(node, simplify.Neg):
+        return simplify.Neg(f(node.operand))
+    if isinstance(node, simplify.Sum):
+        return simplify.Sum(tuple([(s, f(t)) for s, t in node.terms]))
+    if isinstance(node, simplify.Product):
+        return simplify.Product(tuple([(o, f(c)) for o, c in node.factors]))
+    if isinstance(node, simplify.Power):
+        return simplify.Power(f(node.base), f(node.exponent))
+    return node
+
+# Auxiliary equations of the hoisted subexpressions, by name
+class Hoisting(object):
+    def __init__(self, taken, prefix = PREFIX):
+        self.taken = taken
+        self.prefix = prefix
+        self.names = {}
+        self.bodies = OrderedDict()
+
+    def name(self, node):
+        if node not in self.names:
+            digest = hashlib.sha1(simplify.write(node).encode('utf-8')).hexdigest().upper()
+            length = HASH
+            while self.prefix + digest[:length] in self.taken and length < len(digest):
+                length += 4
+            name = self.prefix + digest[:length]
+            self.taken.add(name)
+            self.names[node] = name
+            self.bodies[name] = node
+        return self.names[node]
+
+    # Replaces the subexpressions of a node which are in `hoisted`, or were hoisted before, by their variables,
+    # from the top
+    def replace(self, node, hoisted):
+        if node in hoisted or node in self.names:
+            return simplify.Ref(self.name(node), None)
+        if isLeaf(node) or isinstance(node, simplify.Call):
+            return node
+        return rebuild(node, lambda c: self.replace(c, hoisted))
+
+# Names of the variables of a model, which the auxiliary equations mustn't take
+def variable_names(equations):
+    return set([n.upper() for e in equations for n in simplify.NAME.findall(e)])
+
+# Hoists the repeated subexpressions of equations
+# Returns the auxiliary equations, and the equations with their subexpressions replaced
+def hoist(equations, threshold = THRESHOLD, prefix = PREFIX):
+    parsed = []
+    for e in equations:
+        try:
+            parsed.append(simplify.parse_equation(e))
+        except SyntaxError:
+            parsed.append(None)
+    hoisting = Hoisting(variable_names(equations), prefix)
+    rhs = [p[1] if p is not None else None for p in parsed]
+
+    while True:
+        counts = Counter()
+        for r in rhs:
+            if r is not None:
+                count(r, counts)
+        # The body of an auxiliary equation is only counted once, by its own equation
+        bodies = list(hoisting.bodies.items())
+        for name, body in bodies:
+            if not isinstance(body, simplify.Call):
+                for c in simplify.children(body):
+                    count(c, counts)
+        hoisted = set([n for n, c in counts.items() if size(n) >= threshold and saving(n, c) > 0])
+        if len(hoisted) > 0:
+            rhs = [hoisting.replace(r, hoisted) if r is not None else None for r in rhs]
+        # Subexpressions hoisted in this pass are only looked into in the next one, once counted again,
+        # and the last pass only replaces the subexpressions of the bodies which were hoisted elsewhere
+        for name, body in (bodies if len(hoisted) > 0 else hoisting.bodies.items()):
+            hoisting.bodies[name] = rebuild(body, lambda c: hoisting.replace(c, hoisted))
+        if len(hoisted) == 0:
+            break
+
+    auxiliary = [name + ' = ' + simplify.write(body) for name, body in hoisting.bodies.items()]
+    rewritten = [e if p is None or p[1] == r else simplify.write(p[0]) + ' = ' + simplify.write(r)
+                 for e, p, r in zip(equations, parsed, rhs)]
+    return auxiliary, rewritten
+
+# Number of nodes of an equation; those which can't be parsed, and are kept as they are, are counted by their operands
+def nodes(equation):
+    try:
+        lhs, rhs = simplify.parse_equation(equation)
+        return size(lhs) + size(rhs)
+    except SyntaxError:
+        return len(simplify.OPERAND.findall(equation))
+
+# Counts of the auxiliary equations, and of the nodes before and after hoisting
+def summary(equations, auxiliary, rewritten):
+    before = sum([nodes(e) for e in equations])
+    after = sum([nodes(e) for e in auxiliary + rewritten])
+    return "%d auxiliary equations for repeated subexpressions, %s nodes" % (len(auxiliary), simplify.shrink([before, after]))
@@ -1,2 +1,6 @@
-pyinstaller -F compiler.py
-copy dist\compiler.exe ..\ThreeME\src\addin\
+rem One-dir builds: a single-file executable unpacks itself to a temporary directory at each launch
+rem The files of both builds are copied next to each other, compiler.exe and batch.exe keeping their paths
+pyinstaller -D compiler.py
+xcopy /E /Y dist\compiler ..\ThreeME\src\addin\
+pyinstaller -D batch.py
+xcopy /E /Y dist\batch ..\ThreeME\src\addin\
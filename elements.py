@@ -1,48 +1,165 @@
 from collections import *
-from funcy import *
 
 import itertools
 
+import evaluator
+import profiling
+
+# Concatenates lists, as funcy's cat (importing funcy takes a noticeable part of the startup time)
+def cat(seqs):
+    return list(itertools.chain.from_iterable(seqs))
+
 def priceVolume(base, option):
     if option == '!pv':
         return 'P' + base + ' * ' + base
     else:
         return base
 
+# Bindings of VariableNames to their values, within those of an enclosing scope
+# (e.g. the bindings of the iterators of a sum, within those of its Formula)
+# The enclosing bindings are looked up when a name isn't bound in the scope itself,
+# rather than copied into a new dict for each binding: the bindings of the scope are those
+# of the dict, so that most lookups stay plain dict lookups
+class Scope(dict):
+    __slots__ = ('parent',)
+
+    def __init__(self, parent):
+        dict.__init__(self)
+        self.parent = parent
+
+    def __missing__(self, key):
+        return self.parent[key]
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.parent
+
+    def get(self, key, default = None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return list(set(dict.keys(self)).union(self.parent.keys()))
+
+# Templates
+# Compiling an Equation for each binding walks the whole tree of elements every time,
+# although only the parts that depend on the bindings change.
+# An Equation is thus first lowered into a flat Template, a sequence of literal strings
+# and of Slots, which are then filled in for each binding.
+# Each element has a `lower` method, which mirrors its `compile` method, and returns its parts
+
+# A Slot is filled in with the value of a VariableName in the bindings
+class Slot(namedtuple("Slot", ['variableName'])):
+    __slots__ = ()
+
+    def fill(self, bindings, heap):
+        return bindings[self.variableName]
+
+# A CompiledSlot is filled in by compiling an element with each binding
+# It is used for elements which can't be lowered, such as sums
+class CompiledSlot(namedtuple("CompiledSlot", ['element', 'option'])):
+    __slots__ = ()
+
+    def fill(self, bindings, heap):
+        return self.element.compile(bindings, heap, self.option)
+
+def isSlot(part):
+    return isinstance(part, (Slot, CompiledSlot))
+
+def priceVolumeParts(parts, option):
+    if option == '!pv':
+        return ['P'] + parts + [' * '] + parts
+    else:
+        return parts
+
+def joinParts(separator, partsList):
+    parts = []
+    for i, p in enumerate(partsList):
+        if i > 0:
+            parts.append(separator)
+        parts.extend(p)
+    return parts
+
+class Template(object):
+    def __init__(self, parts):
+        # The literal parts and the slots are merged into a single format string
+        self.format = ''.join(['%s' if isSlot(p) else p.replace('%', '%%') for p in parts])
+        self.slots = [p for p in parts if isSlot(p)]
+
+    def fill(self, bindings, heap):
+        return self.format % tuple([s.fill(bindings, heap) for s in self.slots])
+
+    # All the bindings of a Formula bind the same VariableNames,
+    # so that the Template lowered for one of them can be filled in with any other
+    @staticmethod
+    def for_bindings(element, bindings, option):
+        return Template(element.lower(frozenset(bindings.keys()), option))
+
+# Elements are immutable namedtuples
+# Each class declares empty __slots__, so that its instances are as small as plain tuples,
+# without a dict: many parsed Formulas are kept in the caches of long-running compilers
 class BaseElement(namedtuple("BaseElement", ['value'])):
+    __slots__ = ()
+
     def compile(self, bindings, heap, option):
         return str(self.value)
 
+    # `bound` is the set of the VariableNames which will be found in the bindings
+    def lower(self, bound, option):
+        return [str(self.value)]
+
 # Used to mark parsed elements that contain immediate (ie constant) values
-class Immediate: pass
+class Immediate(object):
+    __slots__ = ()
 
 # Numerical types
-class Integer(BaseElement, Immediate): pass
-class Real(BaseElement, Immediate): pass
+class Integer(BaseElement, Immediate):
+    __slots__ = ()
+class Real(BaseElement, Immediate):
+    __slots__ = ()
 
 # A VariableName must start with an alphabetical character or an underscore,
 # and can contain any number of alphanumerical characters or underscores
 class VariableName(BaseElement):
+    __slots__ = ()
+
+    # Names are interned, as the same names occur over and over in a model
+    def __new__(cls, value):
+        return BaseElement.__new__(cls, intern(value) if isinstance(value, str) else value)
+
     def getLoopCounterVariable(self):
         return VariableName('$' + self.value)
 
     def compile(self, bindings, heap, option):
-        if self in bindings.keys():
+        if self in bindings:
             return str(bindings[self])
         else:
             return priceVolume(str(self.value), option)
 
+    def lower(self, bound, option):
+        if self in bound:
+            return [Slot(self)]
+        else:
+            return [priceVolume(str(self.value), option)]
+
 # A Placeholder is a VariableName enclosed in curly brackets, e.g. `{X}`
 class Placeholder(BaseElement):
+    __slots__ = ()
+
     def compile(self, bindings, heap, option):
         return bindings[self.value]
 
-class HasIteratedVariables:
+    def lower(self, bound, option):
+        return [Slot(self.value)]
+
+class HasIteratedVariables(object):
+    __slots__ = ()
+
     def getIteratedVariableNames(self): raise NotImplementedError
 
 # An identifier is a combination of one or more VariableNames and Placeholders
 # e.g. {V}_energy, or Price{O}
 class Identifier(BaseElement, HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return [e.value for e in self.value if isinstance(e, Placeholder)]
 
@@ -51,21 +168,36 @@ class Identifier(BaseElement, HasIteratedVariables):
         # without the price-volume option, if any
         return priceVolume(''.join([e.compile(bindings, heap, '') for e in self.value]), option)
 
+    def lower(self, bound, option):
+        return priceVolumeParts(cat([e.lower(bound, '') for e in self.value]), option)
+
 # An Index is used in an Array to address its individual elements
 # It can have multiple dimensions, e.g. [com, sec]
 class Index(BaseElement, HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return cat([e.getIteratedVariableNames() for e in self.value])
 
     def compile(self, bindings, heap, option):
         return '_'.join([e.compile(bindings, heap, option) for e in self.value])
 
+    def lower(self, bound, option):
+        return joinParts('_', [e.lower(bound, option) for e in self.value])
+
 class TimeOffset(BaseElement):
+    __slots__ = ()
+
     def compile(self, bindings, heap, option):
         return '(' + self.value.compile(bindings, heap, option) + ')'
 
+    def lower(self, bound, option):
+        return ['('] + self.value.lower(bound, option) + [')']
+
 # An Array is a combination of a Identifier and an Index
 class Array(namedtuple("Array", ['identifier', 'index', 'timeOffset']), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return self.identifier.getIteratedVariableNames() + self.index.getIteratedVariableNames()
 
@@ -75,26 +207,67 @@ class Array(namedtuple("Array", ['identifier', 'index', 'timeOffset']), HasItera
         timeOffset = self.timeOffset[0].compile(bindings, heap, option) if len(self.timeOffset) > 0 else ''
         return priceVolume(self.identifier.compile(bindings, heap, '') + '_' + self.index.compile(bindings, heap, ''), option) + timeOffset
 
+    def lower(self, bound, option):
+        timeOffset = self.timeOffset[0].lower(bound, option) if len(self.timeOffset) > 0 else []
+        return priceVolumeParts(self.identifier.lower(bound, '') + ['_'] + self.index.lower(bound, ''), option) + timeOffset
+
 # An Expression is the building block of an equation
 # Expressions can include operators, functions and any operand (Array, Identifier, or number)
 class Expression(namedtuple("Expression", ['value']), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return cat([e.getIteratedVariableNames() for e in self.value if isinstance(e, HasIteratedVariables)])
 
     def compile(self, bindings, heap, option):
         return ' '.join([e.compile(bindings, heap, option) for e in self.value])
 
-    def evaluate(self, bindings, heap):
-        return eval(' '.join([e.compile(bindings, heap, '') if isinstance(e, Immediate) else
-                              str(heap[e.compile(bindings, heap, '').upper()]) for e in self.value]))
-
-class Operator(BaseElement, Immediate): pass
-
-class ComparisonOperator(BaseElement, Immediate): pass
+    def lower(self, bound, option):
+        return joinParts(' ', [e.lower(bound, option) for e in self.value])
 
-class BooleanOperator(BaseElement, Immediate): pass
+    def evaluate(self, bindings, heap):
+        profiling.count('conditions')
+        profiling.count('evals')
+        with profiling.phase('conditions'):
+            return eval(' '.join([e.compile(bindings, heap, '') if isinstance(e, Immediate) else
+                                  str(heap[e.compile(bindings, heap, '').upper()]) for e in self.value]))
+
+    # Same as evaluate, but for a list of bindings at once
+    # Returns a boolean NumPy array, with one element per binding
+    def evaluate_all(self, bindingsList, heap):
+        profiling.count('conditions', len(bindingsList))
+        profiling.count('evals')
+        with profiling.phase('conditions'):
+            tokens = [e.compile({}, {}, '') if isinstance(e, Immediate) else None for e in self.value]
+            operandValues = [[heap[e.compile(bindings, heap, '').upper()] for bindings in bindingsList]
+                             for e in self.value if not isinstance(e, Immediate)]
+            return evaluator.evaluate(tokens, operandValues, len(bindingsList))
+
+# Elements whose instances with the same value are a single, shared object
+# e.g. all the '+' Operators of all parsed Formulas
+# Instances are still equal to and hashed as other elements with the same value
+class Shared(object):
+    __slots__ = ()
+    instances = {}
+
+    def __new__(cls, value):
+        key = (cls, value)
+        if key not in Shared.instances:
+            Shared.instances[key] = super(Shared, cls).__new__(cls, value)
+        return Shared.instances[key]
+
+class Operator(Shared, BaseElement, Immediate):
+    __slots__ = ()
+
+class ComparisonOperator(Shared, BaseElement, Immediate):
+    __slots__ = ()
+
+class BooleanOperator(Shared, BaseElement, Immediate):
+    __slots__ = ()
 
 class SumFunc(namedtuple("SumFunc", ['formula']), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return set(self.formula.iterated_variables()) - set(self.formula.iterator_variables())
 
@@ -105,7 +278,13 @@ class SumFunc(namedtuple("SumFunc", ['formula']), HasIteratedVariables):
         else:
             return "0"
 
+    # Which terms a sum holds depends on the heap, so it is compiled with each binding
+    def lower(self, bound, option):
+        return [CompiledSlot(self, option)]
+
 class Func(namedtuple("Func", ['variableName', 'expressions']), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return cat([e.getIteratedVariableNames() for e in self.expressions])
 
@@ -119,8 +298,16 @@ class Func(namedtuple("Func", ['variableName', 'expressions']), HasIteratedVaria
         else:
             return self.variableName.compile({}, {}, '') + '(' + ', '.join([e.compile(bindings, heap, '') for e in self.expressions]) + ')'
 
+    def lower(self, bound, option):
+        if self.variableName.value == 'value':
+            return self.expressions[0].lower(bound, '!pv')
+        else:
+            return self.variableName.lower(frozenset(), '') + ['('] + joinParts(', ', [e.lower(bound, '') for e in self.expressions]) + [')']
+
 # An Equation is made of two Expressions separated by an equal sign
 class Equation(namedtuple("Equation", ['lhs', 'rhs']), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return self.lhs.getIteratedVariableNames() + self.rhs.getIteratedVariableNames()
 
@@ -133,16 +320,49 @@ class Equation(namedtuple("Equation", ['lhs', 'rhs']), HasIteratedVariables):
         else:
             return volumeEquation
 
+    def lower(self, bound, option):
+        volumeEquation = self.lhs.lower(bound, '') + [' = '] + self.rhs.lower(bound, '')
+        if option == '!pv':
+            priceEquation = self.lhs.lower(bound, option) + [' = '] + self.rhs.lower(bound, option)
+            return priceEquation + ['\n'] + volumeEquation
+        else:
+            return volumeEquation
+
 class Condition(namedtuple("Condition", ["expression"]), HasIteratedVariables):
+    __slots__ = ()
+
     def getIteratedVariableNames(self):
         return self.expression.getIteratedVariableNames()
 
     def evaluate(self, bindings, heap):
         return self.expression.evaluate(bindings, heap)
 
+    def evaluate_all(self, bindingsList, heap):
+        return self.expression.evaluate_all(bindingsList, heap)
+
+    # The Expressions joined by `and` in the Condition, e.g. [X[c] > 0, Y[s] <> 0] for `X[c] > 0 and Y[s] <> 0`
+    # A Condition with an `or` or a `xor` outside of parentheses is a single conjunct
+    def conjuncts(self):
+        tokens = self.expression.value
+        if any([isinstance(e, BooleanOperator) and e.value != 'and' for e in tokens]):
+            return [self.expression]
+        parts = [[]]
+        for e in tokens:
+            if isinstance(e, BooleanOperator):
+                parts.append([])
+            else:
+                parts[-1].append(e)
+        return [Expression(tuple(p)) for p in parts]
+
 # A Lst is a sequence of space-delimited strings (usually numbers), used for an iterator
 # e.g. 01 02 03 04 05 06
 class Lst(namedtuple("LstBase", ['base', 'remove'])):
+    __slots__ = ()
+
+    # Values are interned, as the same lists occur over and over in a model
+    def __new__(cls, base, remove):
+        return super(Lst, cls).__new__(cls, tuple([intern(e) for e in base]), tuple([intern(e) for e in remove]))
+
     def compile(self):
         return [e for e in self.base if e not in self.remove]
 
@@ -150,6 +370,8 @@ class Lst(namedtuple("LstBase", ['base', 'remove'])):
 # a comma-delimited list of elements, between parentheses
 # (notably used to iterate over multiple variables simultaneously)
 class Grouped(BaseElement):
+    __slots__ = ()
+
     def compile(self):
         return zip(*[e.compile() for e in self.value])
 
@@ -160,9 +382,11 @@ class Grouped(BaseElement):
 # If the Lsts contains multiple Lst, then each list in the Lsts
 # are iterated over in parallel
 class Iter(namedtuple("Iter", ['variableNames_', 'lsts_'])):
+    __slots__ = ()
+
     @property
     def variableNames(self):
-        return self.variableNames_
+        return self.variableNames_.value
 
     @property
     def lsts(self):
@@ -173,7 +397,22 @@ class Iter(namedtuple("Iter", ['variableNames_', 'lsts_'])):
         # This is because the list removal feature is designed to skip an equation,
         # but the loop counter is usually used to iterate over rows or columns of data
         # which ignore this skipping
-        return {self.variableNames[0].getLoopCounterVariable(): range(1, len(self.lsts[0].base) + 1) }
+        # Each value of the compiled list is thus given its (1-based) position in the base list
+        base = self.lsts_.value[0]
+        return {(self.variableNames[0].getLoopCounterVariable(),): [(base.base.index(e) + 1,) for e in base.compile()]}
+
+    # The VariableNames of the iterator and its loop counter, their values, and whether each value is kept
+    # e.g. c in 01 02 03 \ 02 gives ('c', '$c'), [('01', 1), ('02', 2), ('03', 3)], [True, False, True]
+    # The removals of a single list are applied as a mask over its base list, which gives the loop counter
+    # Parallel lists are zipped once their removals are applied, as in Grouped.compile
+    def dimension(self):
+        variableNames = tuple(self.variableNames) + (self.variableNames[0].getLoopCounterVariable(),)
+        lsts = self.lsts_.value
+        if len(lsts) == 1:
+            base = lsts[0]
+            return variableNames, [(e, n + 1) for n, e in enumerate(base.base)], [e not in base.remove for e in base.base]
+        counter, counts = self.compileLoopCounter().items()[0]
+        return variableNames, [tuple(v) + n for v, n in zip(self.lsts, counts)], [True] * len(counts)
 
     # # Return a dict of: {VariableName: compiled Lst}
     # def compile(self):
@@ -183,56 +422,202 @@ class Iter(namedtuple("Iter", ['variableNames_', 'lsts_'])):
     #     else:
     #         return self.variableNames, self.lsts.compile()
 
+# Sums held by an element, outside of any other sum
+def iter_sums(element):
+    if isinstance(element, SumFunc):
+        yield element
+    elif isinstance(element, Equation):
+        for e in [element.lhs, element.rhs]:
+            for s in iter_sums(e):
+                yield s
+    elif isinstance(element, (Expression, Func)):
+        for e in (element.value if isinstance(element, Expression) else element.expressions):
+            for s in iter_sums(e):
+                yield s
+
+# VariableNames held by an element, at any depth
+# (getIteratedVariableNames only gives those of the Placeholders, not those of the Indexes)
+def iter_variable_names(element):
+    if isinstance(element, VariableName):
+        yield element
+    elif isinstance(element, tuple):
+        for e in element:
+            for v in iter_variable_names(e):
+                yield v
+
+# Bindings of a combination of values, given by their position, of some of the iterators
+# Within enclosing bindings, the dict is a Scope of these bindings
+def bind(dimensions, combination, positions, bindings):
+    d = Scope(bindings) if bindings else {}
+    for k, r in zip(positions, combination):
+        variableNames, values, kept = dimensions[k]
+        d.update(zip(variableNames, values[r]))
+    return d
+
+# The cartesian product of the iterators of a Formula, as a table with one column per iterator,
+# holding the positions of its values (see Iter.dimension), built with NumPy
+# Row access is thus constant-time, and a row is only turned into a dict of bindings
+# once the Condition holds for it.
+# The Condition is split into its conjuncts, and each conjunct which doesn't depend on all iterators
+# (e.g. `CHD[c] > 0` in `|V|[c, s] = ... if CHD[c] > 0, V in Q CH, c in 01 02, s in 01 02`)
+# is evaluated once for each combination of the values of the iterators it depends on;
+# its result is then broadcast over the table as a mask, as are the removals of the lists.
+# The conjuncts which depend on all iterators are evaluated on the remaining rows.
+# In both cases, each operand is looked up in the heap once for each combination of the values
+# of the iterators it depends on, and the values are gathered for the rows.
+# Evaluated on its own, a conjunct may raise an error (e.g. a division by zero) for values which
+# another conjunct rules out: the whole Condition is then evaluated on all rows instead, with the
+# short-circuits of `and`, as for each binding
+class IteratorTable(object):
+    def __init__(self, dimensions, bindings, heap):
+        evaluator.importNumPy()
+        np = evaluator.np
+        self.dimensions = dimensions
+        self.bindings = bindings
+        self.heap = heap
+        self.sizes = tuple([len(values) for variableNames, values, kept in dimensions])
+        self.names = [set(variableNames) for variableNames, values, kept in dimensions]
+        # Bindings of each value of each iterator, as (VariableName, value) pairs
+        self.items = [[zip(variableNames, v) for v in values] for variableNames, values, kept in dimensions]
+        # Rows of the whole product which are kept so far
+        self.mask = np.ones(self.sizes, dtype = bool)
+        for k, (variableNames, values, kept) in enumerate(dimensions):
+            self.mask &= self.broadcast(np.array(kept, dtype = bool), (k,))
+
+    # Reshapes an array over the iterators at `positions` so that it broadcasts over the whole product
+    def broadcast(self, array, positions):
+        return array.reshape([self.sizes[k] if k in positions else 1 for k in range(len(self.sizes))])
+
+    # Positions of the iterators an element depends on
+    def positions(self, element):
+        names = set(iter_variable_names(element))
+        return tuple([k for k, variableNames in enumerate(self.names) if names & variableNames])
+
+    # Evaluates an Expression for rows, given by the columns of the positions of the values
+    # of the iterators at `positions`; returns a boolean NumPy array, with one element per row
+    def evaluate(self, expression, positions, columns, count):
+        np = evaluator.np
+        profiling.count('conditions', count)
+        profiling.count('evals')
+        if count == 0:
+            return np.zeros(0, dtype = bool)
+        with profiling.phase('conditions'):
+            tokens = [e.compile({}, {}, '') if isinstance(e, Immediate) else None for e in expression.value]
+            operands = []
+            for e in expression.value:
+                if isinstance(e, Immediate):
+                    continue
+                depends = [k for k in self.positions(e) if k in positions]
+                if len(depends) > 0:
+                    sizes = [self.sizes[k] for k in depends]
+                    keys = np.ravel_multi_index([columns[positions.index(k)] for k in depends], sizes)
+                    unique, rows = np.unique(keys, return_inverse = True)
+                    combinations = zip(*np.unravel_index(unique, sizes))
+                else:
+                    combinations, rows = [()], np.zeros(count, dtype = int)
+                # The name of the operand is lowered once to a Template, filled for each combination
+                names = None
+                values = []
+                for c in combinations:
+                    b = bind(self.dimensions, c, depends, self.bindings)
+                    if names is None:
+                        names = Template.for_bindings(e, b, '')
+                    values.append(self.heap[names.fill(b, self.heap).upper()])
+                operands.append(evaluator.toColumn(values).take(rows))
+            return evaluator.evaluateColumns(tokens, operands, count)
+
+    # Masks the rows for which a conjunct which depends on the iterators at `positions` doesn't hold
+    # A conjunct which depends on no iterator is evaluated once, and keeps all rows or none
+    def prefilter(self, conjunct, positions):
+        np = evaluator.np
+        if len(positions) == 0:
+            if self.mask.any() and not self.evaluate(conjunct, positions, [], 1)[0]:
+                self.mask[...] = False
+            return
+        kept = self.mask.any(axis = tuple([k for k in range(len(self.sizes)) if k not in positions]))
+        columns = np.nonzero(kept)
+        holds = np.zeros(kept.shape, dtype = bool)
+        holds[columns] = self.evaluate(conjunct, positions, columns, len(columns[0]))
+        self.mask &= self.broadcast(holds, positions)
+
+    # Generates the bindings of the rows for which the Condition holds
+    def iter_bindings(self, condition, chunkSize):
+        np = evaluator.np
+        allPositions = tuple(range(len(self.sizes)))
+        conjuncts = [(c, self.positions(c)) for c in condition.conjuncts()]
+        residual = [c for c, positions in conjuncts if positions == allPositions]
+        if len(residual) < len(conjuncts):
+            mask = self.mask.copy()
+            try:
+                for c, positions in conjuncts:
+                    if positions != allPositions:
+                        self.prefilter(c, positions)
+            except Exception:
+                self.mask, residual = mask, condition.conjuncts()
+        expression = Expression(tuple(cat([[BooleanOperator('and')] + list(c.value) for c in residual])[1:]))
+
+        rows = np.nonzero(self.mask)
+        for start in range(0, len(rows[0]), chunkSize):
+            columns = [r[start:start + chunkSize] for r in rows]
+            count = len(columns[0])
+            profiling.count('bindings', count)
+            if len(residual) > 0:
+                holds = np.flatnonzero(self.evaluate(expression, allPositions, columns, count))
+                columns = [c[holds] for c in columns]
+            for row in zip(*[c.tolist() for c in columns]):
+                yield self.bind(row)
+
+    # Bindings of a row
+    def bind(self, row):
+        d = Scope(self.bindings) if self.bindings else {}
+        for items, r in zip(self.items, row):
+            d.update(items[r])
+        return d
+
 # A Formula is the combination of an Equation, zero or one Condition, and one or more Iter(ators)
 # This is the full form of the code passed from eViews to the compiler
 # e.g. {V}[com] = {V}D[com] + {V}M[com], V in Q CH G I DS, com in 01 02 03 04 05 06 07 08 09
 class Formula(namedtuple("Formula", ['options', 'equation', 'conditions', 'iterators'])):
+    __slots__ = ()
+
     def iterator_variables(self):
         return [v for i in self.iterators for v in i.variableNames]
 
     def iterated_variables(self):
         return self.equation.getIteratedVariableNames()
 
-    # Cartesian product of all iterators, returned as dicts
-    # Turns {['V']: [['Q'], ['X']], ['c', 's']: [['01', '22'], ['02', '23'], ['03', '24']]}
-    # into [{'V': 'Q', 'c': '01', 's': '22'}, {'V': 'Q', 'c': '02', 's': '23'}, {'V': 'Q', 'c': '03', 's': '24'},
-    #       {'X': 'Q', 'c': '01', 's': '22'}, {'X': 'Q', 'c': '02', 's': '23'}, {'X': 'Q', 'c': '03', 's': '24'} ]
-    def cartesianProduct(self, iterators):
-        # First, cartesian product of all Lst values
-        # e.g. [[['Q'], ['01', '22']], [['Q'], ['02', '23']], [['Q'], ['03', '24']],
-        #       [['X'], ['01', '22']], [['X'], ['02', '23']], [['X'], ['03', '24']]]
-        cartesianProd = [l for l in apply(itertools.product, iterators.values())]
-        # Second, combine the cartesian product values with their respective VariableNames
-        # (stored in iterators.keys)
-        # e.g. [[['V']: ['Q']], [['c', 's']: ['01', '22']]
-        zipped = [zip(iterators.keys(), p) for p in cartesianProd]
-        # Finally, create and merge all the inner dicts
-        return [merge(*[dict(zip(*l)) for l in z]) for z in zipped]
-        # return [dict(zip(iterators.keys(), p)) for p in cartesianProd]
-
-    def build_iterator_dicts(self):
+    # Iterators as (VariableNames, values, kept), see Iter.dimension
+    def iterator_dimensions(self):
         # Check that each iterator is defined only once
         if len(self.iterator_variables()) > len(set(self.iterator_variables())):
             raise NameError("Some iterated variables are defined multiple times")
-
-        # Compile each iterator to get a dict of {VariableNames: Iter}
-        # iterators = cat(i.variableNames, [i.compile()[1] for i in self.iterators]))
-
-        # Zip in the loop counters
-        #lsts = [zip(i.lsts(),
-        loopCounters = dict(cat([i.compileLoopCounter().items() for i in self.iterators]))
-
-        iteratorDicts = self.cartesianProduct(iterators)
-        loopCounterDicts = self.cartesianProduct(loopCounters)
-
-        return [merge(iterDict, counterDict) for iterDict, counterDict in zip(iteratorDicts, loopCounterDicts)]
-
+        return [i.dimension() for i in self.iterators]
+
+    # Cartesian product of all iterators, generated as dicts
+    # Turns V in Q X, (c, s) in (01 02 03, 22 23 24)
+    # into {'V': 'Q', '$V': 1, 'c': '01', 's': '22', '$c': 1}, {'V': 'Q', '$V': 1, 'c': '02', 's': '23', '$c': 2}, ...
+    #      {'V': 'X', '$V': 2, 'c': '01', 's': '22', '$c': 1}, ...
+    # The order of the iterators in the Formula gives the order of the compiled equations
+    def iter_iterator_dicts(self, bindings = {}):
+        # Bindings of each value kept, as (VariableName, value) pairs
+        items = [[zip(variableNames, v) for v, k in zip(values, kept) if k]
+                 for variableNames, values, kept in self.iterator_dimensions()]
+        for combination in itertools.product(*items):
+            d = Scope(bindings) if bindings else {}
+            for i in combination:
+                d.update(i)
+            yield d
+
+    def build_iterator_dicts(self, bindings = {}):
+        return list(self.iter_iterator_dicts(bindings))
+
+    # The iterator dicts are those built within `bindings`, which they already include
     def evaluate_conditions(self, bindings, heap, iteratorDicts):
         # Evaluate the condition for each iterator binding
         if len(self.conditions) > 0:
             if len(self.iterators) > 0:
-                conditions = [self.conditions[0].evaluate(dict(bindings.items() + local_bindings.items()), heap)
-                              for local_bindings in iteratorDicts]
+                # All bindings are evaluated at once, see evaluator.py
+                conditions = self.conditions[0].evaluate_all(iteratorDicts, heap).tolist()
             else:
                 conditions = [self.conditions[0].evaluate(bindings, heap)]
         else:
@@ -242,19 +627,49 @@ class Formula(namedtuple("Formula", ['options', 'equation', 'conditions', 'itera
                 conditions = [True]
         return conditions
 
-    def init_compilation(self, bindings, heap):
-        iteratorDicts = self.build_iterator_dicts()
-        conditions = self.evaluate_conditions(bindings, heap, iteratorDicts)
-        option = self.options[0].lower() if len(self.options) > 0 else ''
-        return iteratorDicts, conditions, option
+    # Number of iterator bindings whose conditions are evaluated at once
+    # This bounds the memory used by the compilation of formulas with many iterations
+    chunkSize = 4096
+
+    # Generates the iterator bindings for which the condition holds
+    # Conditions over iterators are evaluated on an IteratorTable, so that only the bindings
+    # for which they hold are built
+    def iter_bindings(self, bindings, heap):
+        if len(self.conditions) > 0 and len(self.iterators) > 0:
+            for b in IteratorTable(self.iterator_dimensions(), bindings, heap).iter_bindings(self.conditions[0], self.chunkSize):
+                yield b
+            return
+
+        iteratorDicts = self.iter_iterator_dicts(bindings)
+        while True:
+            chunk = list(itertools.islice(iteratorDicts, self.chunkSize))
+            if len(chunk) == 0:
+                return
+            profiling.count('bindings', len(chunk))
+            for condition, local_bindings in zip(self.evaluate_conditions(bindings, heap, chunk), chunk):
+                if condition:
+                    yield local_bindings
+
+    def option(self):
+        return self.options[0].lower() if len(self.options) > 0 else ''
+
+    # Generates the compiled equations for each binding for which the condition holds
+    def iter_fill(self, bindings, heap, option):
+        template = None
+        for allBindings in self.iter_bindings(bindings, heap):
+            if template is None:
+                template = Template.for_bindings(self.equation, allBindings, option)
+            yield template.fill(allBindings, heap)
 
     def compile_sum(self, bindings, heap, option):
-        iteratorDicts, conditions, _ = self.init_compilation(bindings, heap)
-        return " + ".join([self.equation.compile(dict(local_bindings.items() + bindings.items()), heap, option)
-                           for condition, local_bindings in zip(conditions, iteratorDicts) if condition])
+        return " + ".join(self.iter_fill(bindings, heap, option))
 
-    def compile(self, heap):
-        iteratorDicts, conditions, option = self.init_compilation({}, heap)
+    # Generates the compiled equations one by one
+    # `period` selects the period of the heap in which Conditions are evaluated (see heapfile.Heap.at),
+    # by default that of the heap
+    def iter_compile(self, heap, period = None):
+        if period is not None:
+            heap = heap.at(period)
 
         # Check that all VariableNames used as iterators in the equation are defined
         # in the iterators section of the Formula
@@ -262,5 +677,15 @@ class Formula(namedtuple("Formula", ['options', 'equation', 'conditions', 'itera
         if len(missingVars) > 0:
             raise IndexError("These iterated variables are not defined: " + ", ".join([e.value for e in missingVars]))
 
-        return "\n".join([self.equation.compile(bindings, heap, option)
-                          for condition, bindings in zip(conditions, iteratorDicts) if condition])
+        for equation in self.iter_fill({}, heap, self.option()):
+            yield equation
+
+    # Writes the compiled equations to a file, as they are compiled
+    def write_compiled(self, heap, f, period = None):
+        for i, equation in enumerate(self.iter_compile(heap, period)):
+            if i > 0:
+                f.write("\n")
+            f.write(equation)
+
+    def compile(self, heap, period = None):
+        return "\n".join(self.iter_compile(heap, period))
@@ -0,0 +1,176 @@
+import ast
+from collections import namedtuple
+
+# NumPy is imported when a condition is first evaluated, rather than with the compiler:
+# importing it takes a large share of the startup time of compiler.py, and many formulas
+# have no condition
+np = None
+
+def importNumPy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+
+# Batch evaluation of Conditions
+# Expression.evaluate builds, for each binding, a Python source string where every operand
+# is replaced by its value in the heap, and eval()s it.
+# Here the same source string is built only once, with each operand replaced by a slot name
+# (_0, _1, ...), and parsed by Python's own parser, so that operator precedence, comparison
+# chaining and the meaning of `<>` are exactly those of the per-binding path.
+# The resulting tree is then evaluated over all bindings at once, as NumPy arrays.
+
+def slotName(position):
+    return '_' + str(position)
+
+# A Column holds the values of an operand for all bindings
+# NA values (None in the heap) are tracked in a separate mask, so that they behave
+# like None in the per-binding path: lower than any number in comparisons,
+# false when tested for truth, and a TypeError in arithmetic
+class Column(namedtuple("Column", ['values', 'na'])):
+    def truth(self):
+        return (self.values != 0) & ~self.na
+
+    def comparable(self):
+        return np.where(self.na, -np.inf, self.values)
+
+    # The values at the given positions, e.g. those of each binding, from the values of each distinct operand
+    def take(self, positions):
+        return Column(self.values[positions], self.na[positions])
+
+def literal(value):
+    # Heap values are converted to strings by the per-binding path before being evaluated,
+    # which rounds floats; they are rounded the same way here
+    if value is None:
+        return 0
+    elif isinstance(value, float):
+        return float(str(value))
+    else:
+        return value
+
+def toColumn(values):
+    return Column(np.array([literal(v) for v in values]),
+                  np.array([v is None for v in values], dtype = bool))
+
+def constant(value):
+    return Column(np.array(value), np.array(False))
+
+# Operators are given by the names of their NumPy functions
+arithmeticOperators = { ast.Add: ('add', '+'),
+                        ast.Sub: ('subtract', '-'),
+                        ast.Mult: ('multiply', '*'),
+                        ast.Div: ('divide', '/'),
+                        ast.BitXor: ('bitwise_xor', '^') }
+
+unaryOperators = { ast.USub: ('negative', '-'),
+                   ast.UAdd: ('asarray', '+') }
+
+comparisonOperators = { ast.Eq: 'equal',
+                        ast.NotEq: 'not_equal',
+                        ast.Lt: 'less',
+                        ast.LtE: 'less_equal',
+                        ast.Gt: 'greater',
+                        ast.GtE: 'greater_equal' }
+
+# Errors of the bindings, raised once the whole condition is evaluated: the per-binding path
+# raises the first error of the first binding which fails, whichever node it comes from
+# A binding which failed isn't evaluated any further, as the per-binding path stops at its first error
+class Failures(object):
+    def __init__(self, count):
+        self.failed = np.zeros(count, dtype = bool)
+        self.first = None
+
+    # The active bindings which haven't failed
+    def live(self, active):
+        return active & ~self.failed
+
+    # Records `error` for the bindings of `mask` which haven't failed yet
+    def add(self, mask, error):
+        failing = mask & ~self.failed
+        if np.any(failing):
+            binding = int(np.argmax(failing))
+            if self.first is None or binding < self.first[0]:
+                self.first = (binding, error)
+            self.failed |= failing
+
+    def check(self):
+        if self.first is not None:
+            raise self.first[1]
+
+def naError(message):
+    return TypeError(message + ": 'NoneType'")
+
+# Evaluates a node of the parsed condition for all bindings
+# `active` marks the bindings for which the per-binding path would actually evaluate the node
+# (`and`, `or` and chained comparisons short-circuit); errors are only recorded in `failures` for those
+def evaluateNode(node, columns, active, failures):
+    if isinstance(node, ast.Name):
+        return columns[int(node.id[1:])]
+
+    elif isinstance(node, ast.Num):
+        return constant(node.n)
+
+    elif isinstance(node, ast.UnaryOp):
+        operand = evaluateNode(node.operand, columns, active, failures)
+        function, symbol = unaryOperators[type(node.op)]
+        failures.add(active & operand.na, naError("bad operand type for unary " + symbol))
+        return Column(getattr(np, function)(operand.values), operand.na)
+
+    elif isinstance(node, ast.BinOp):
+        left = evaluateNode(node.left, columns, active, failures)
+        right = evaluateNode(node.right, columns, failures.live(active), failures)
+        active = failures.live(active)
+        function, symbol = arithmeticOperators[type(node.op)]
+        failures.add(active & (left.na | right.na), naError("unsupported operand type(s) for " + symbol))
+        if isinstance(node.op, ast.Div):
+            failures.add(active & (right.values == 0), ZeroDivisionError("float division by zero"))
+        if isinstance(node.op, ast.BitXor) and \
+           (left.values.dtype.kind == 'f' or right.values.dtype.kind == 'f'):
+            failures.add(active, TypeError("unsupported operand type(s) for ^: 'float'"))
+        with np.errstate(all = 'ignore'):
+            return Column(getattr(np, function)(left.values, right.values), np.array(False))
+
+    elif isinstance(node, ast.Compare):
+        left = evaluateNode(node.left, columns, active, failures)
+        result = np.ones(len(active), dtype = bool)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = evaluateNode(comparator, columns, failures.live(active) & result, failures)
+            result = result & getattr(np, comparisonOperators[type(op)])(left.comparable(), right.comparable())
+            left = right
+        return Column(result, np.array(False))
+
+    elif isinstance(node, ast.BoolOp):
+        # `and` and `or` return one of their operands, not a boolean
+        result = evaluateNode(node.values[0], columns, active, failures)
+        for value in node.values[1:]:
+            proceed = result.truth() if isinstance(node.op, ast.And) else ~result.truth()
+            right = evaluateNode(value, columns, failures.live(active) & proceed, failures)
+            result = Column(np.where(proceed, right.values, result.values),
+                            np.where(proceed, right.na, result.na))
+        return result
+
+    else:
+        raise SyntaxError("Unsupported construct in condition: " + type(node).__name__)
+
+# Evaluates a condition for many bindings at once and returns a boolean mask
+# `tokens` is the sequence of source tokens of the condition, where each operand is None
+# `operandValues` holds, for each operand in order, the list of its heap values for every binding
+def evaluate(tokens, operandValues, count):
+    importNumPy()
+    return evaluateColumns(tokens, [toColumn(v) for v in operandValues], count)
+
+# Same as evaluate, with the values of each operand given as a Column
+def evaluateColumns(tokens, columns, count):
+    importNumPy()
+    if count == 0:
+        return np.zeros(0, dtype = bool)
+
+    slots = iter(range(len(columns)))
+    source = ' '.join([slotName(next(slots)) if t is None else t for t in tokens])
+    tree = compile(source, '<condition>', 'eval', ast.PyCF_ONLY_AST).body
+
+    active = np.ones(count, dtype = bool)
+    failures = Failures(count)
+    result = evaluateNode(tree, columns, active, failures)
+    failures.check()
+    return result.truth() & active
@@ -0,0 +1,382 @@
+from elements import *
+
+# Hand-written parser for Formulas
+# It follows the pyparsing grammar of grammar.py rule by rule, with the same ordered choices
+# and the same whitespace skipping, and builds the same elements, but without pyparsing's overhead.
+# Expressions are memoized by position: the grammar tries `equation | expression`
+# for each (possibly nested) sum, which otherwise parses each expression twice at each level.
+# Each rule takes a position and returns an (element, position) pair, or None if it doesn't match.
+# As in grammar.py, lists of elements are stored as tuples.
+
+WHITESPACE = ' \t\n\r'
+ALPHAS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+NUMS = '0123456789'
+ALPHANUMS = ALPHAS + NUMS
+VARIABLE_NAME_START = ALPHAS + '_%$@'
+VARIABLE_NAME_BODY = ALPHANUMS + '_'
+# Characters which can't surround a keyword (pyparsing's Keyword.DEFAULT_KEYWORD_CHARS)
+KEYWORD_CHARS = ALPHANUMS + '_$'
+
+OPERATORS = ['+', '-', '*', '/', '^']
+COMPARISON_OPERATORS = ['<>', '<=', '<', '>=', '>', '==']
+BOOLEAN_OPERATORS = ['and', 'or', 'xor']
+OPTIONS = ['!pv', '!p', '!Pv', '!P']
+
+class ParseFailure(Exception): pass
+
+class Parser(object):
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        self.expressions = {}
+
+    def skip(self, pos):
+        while pos < self.length and self.text[pos] in WHITESPACE:
+            pos += 1
+        return pos
+
+    def word(self, pos, start, body):
+        pos = self.skip(pos)
+        if pos >= self.length or self.text[pos] not in start:
+            return None
+        end = pos + 1
+        while end < self.length and self.text[end] in body:
+            end += 1
+        return self.text[pos:end], end
+
+    def literal(self, pos, s):
+        pos = self.skip(pos)
+        if self.text.startswith(s, pos):
+            return s, pos + len(s)
+        return None
+
+    def one_of(self, pos, strings):
+        for s in strings:
+            match = self.literal(pos, s)
+            if match is not None:
+                return match
+        return None
+
+    def keyword(self, pos, s):
+        pos = self.skip(pos)
+        end = pos + len(s)
+        if self.text.startswith(s, pos) and \
+           (end >= self.length or self.text[end] not in KEYWORD_CHARS) and \
+           (pos == 0 or self.text[pos - 1] not in KEYWORD_CHARS):
+            return s, end
+        return None
+
+    # delimitedList(rule)
+    def delimited_list(self, pos, rule):
+        first = rule(pos)
+        if first is None:
+            return None
+        items, pos = [first[0]], first[1]
+        while True:
+            comma = self.literal(pos, ',')
+            if comma is None:
+                break
+            item = rule(comma[1])
+            if item is None:
+                break
+            items.append(item[0])
+            pos = item[1]
+        return items, pos
+
+    def integer(self, pos):
+        pos = self.skip(pos)
+        end = pos + 1 if self.text.startswith('-', pos) else pos
+        digits = end
+        while end < self.length and self.text[end] in NUMS:
+            end += 1
+        if end == digits:
+            return None
+        return Integer(int(self.text[pos:end])), end
+
+    def real(self, pos):
+        pos = self.skip(pos)
+        end = pos + 1 if self.text.startswith('-', pos) else pos
+        for part in range(2):
+            digits = end
+            while end < self.length and self.text[end] in NUMS:
+                end += 1
+            if end == digits:
+                return None
+            if part == 0:
+                if not self.text.startswith('.', end):
+                    return None
+                end += 1
+        return Real(float(self.text[pos:end])), end
+
+    def variable_name(self, pos):
+        match = self.word(pos, VARIABLE_NAME_START, VARIABLE_NAME_BODY)
+        if match is None:
+            return None
+        return VariableName(match[0]), match[1]
+
+    def placeholder(self, pos):
+        bar = self.literal(pos, '|')
+        if bar is None:
+            return None
+        name = self.variable_name(bar[1])
+        if name is None:
+            return None
+        bar = self.literal(name[1], '|')
+        if bar is None:
+            return None
+        return Placeholder(name[0]), bar[1]
+
+    def identifier_part(self, pos):
+        return self.variable_name(pos) or self.placeholder(pos)
+
+    def identifier(self, pos):
+        part = self.identifier_part(pos)
+        if part is None:
+            return None
+        parts = []
+        while part is not None:
+            parts.append(part[0])
+            pos = part[1]
+            part = self.identifier_part(pos)
+        return Identifier(tuple(parts)), pos
+
+    def index(self, pos):
+        bracket = self.literal(pos, '[')
+        if bracket is None:
+            return None
+        expressions = self.delimited_list(bracket[1], self.expression)
+        if expressions is None:
+            return None
+        bracket = self.literal(expressions[1], ']')
+        if bracket is None:
+            return None
+        return Index(tuple(expressions[0])), bracket[1]
+
+    def time_offset(self, pos):
+        paren = self.literal(pos, '(')
+        if paren is None:
+            return None
+        value = self.integer(paren[1]) or self.variable_name(paren[1])
+        if value is None:
+            return None
+        paren = self.literal(value[1], ')')
+        if paren is None:
+            return None
+        return TimeOffset(value[0]), paren[1]
+
+    # operand = array | identifier | real | integer
+    # where array = identifier + index + Group(Optional(timeOffset))
+    def operand(self, pos):
+        identifier = self.identifier(pos)
+        if identifier is not None:
+            index = self.index(identifier[1])
+            if index is None:
+                return identifier
+            timeOffset = self.time_offset(index[1])
+            if timeOffset is None:
+                return Array(identifier[0], index[0], ()), index[1]
+            return Array(identifier[0], index[0], (timeOffset[0],)), timeOffset[1]
+        return self.real(pos) or self.integer(pos)
+
+    def func(self, pos):
+        name = self.variable_name(pos)
+        if name is None:
+            return None
+        paren = self.literal(name[1], '(')
+        if paren is None:
+            return None
+        expressions = self.delimited_list(paren[1], self.expression)
+        if expressions is None:
+            return None
+        paren = self.literal(expressions[1], ')')
+        if paren is None:
+            return None
+        return Func(name[0], tuple(expressions[0])), paren[1]
+
+    def sum_func(self, pos):
+        keyword = self.literal(pos, 'sum')
+        if keyword is None:
+            return None
+        paren = self.literal(keyword[1], '(')
+        if paren is None:
+            return None
+        formula = self.formula(paren[1])
+        if formula is None:
+            return None
+        paren = self.literal(formula[1], ')')
+        if paren is None:
+            return None
+        return SumFunc(formula[0]), paren[1]
+
+    # atom = sumFunc | func | openParen + expression + closeParen | operand
+    # Returns a list of elements, as the parenthesized alternative yields three of them
+    def atom(self, pos):
+        match = self.sum_func(pos) or self.func(pos)
+        if match is not None:
+            return [match[0]], match[1]
+        paren = self.literal(pos, '(')
+        if paren is not None:
+            expression = self.expression(paren[1])
+            if expression is not None:
+                closing = self.literal(expression[1], ')')
+                if closing is not None:
+                    return [BaseElement('('), expression[0], BaseElement(')')], closing[1]
+        match = self.operand(pos)
+        if match is not None:
+            return [match[0]], match[1]
+        return None
+
+    def binary_operator(self, pos):
+        match = self.one_of(pos, OPERATORS)
+        if match is not None:
+            return Operator(match[0]), match[1]
+        match = self.one_of(pos, COMPARISON_OPERATORS)
+        if match is not None:
+            return ComparisonOperator(match[0]), match[1]
+        match = self.one_of(pos, BOOLEAN_OPERATORS)
+        if match is not None:
+            return BooleanOperator(match[0]), match[1]
+        return None
+
+    # expression = Optional(unaryOperator) + atom + ZeroOrMore(operator + atom)
+    def expression(self, pos):
+        if pos in self.expressions:
+            return self.expressions[pos]
+
+        elements = []
+        start = pos
+        unary = self.one_of(pos, ['+', '-'])
+        if unary is not None:
+            elements.append(Operator(unary[0]))
+            pos = unary[1]
+
+        atom = self.atom(pos)
+        if atom is None and unary is not None:
+            # Optional(unaryOperator) backtracks when the atom doesn't match after it
+            elements, pos = [], start
+            atom = self.atom(pos)
+
+        if atom is None:
+            result = None
+        else:
+            elements.extend(atom[0])
+            pos = atom[1]
+            while True:
+                operator = self.binary_operator(pos)
+                if operator is None:
+                    break
+                atom = self.atom(operator[1])
+                if atom is None:
+                    break
+                elements.append(operator[0])
+                elements.extend(atom[0])
+                pos = atom[1]
+            result = Expression(tuple(elements)), pos
+
+        self.expressions[start] = result
+        return result
+
+    def equation(self, pos):
+        lhs = self.expression(pos)
+        if lhs is None:
+            return None
+        equal = self.literal(lhs[1], '=')
+        if equal is None:
+            return None
+        rhs = self.expression(equal[1])
+        if rhs is None:
+            return None
+        return Equation(lhs[0], rhs[0]), rhs[1]
+
+    def condition(self, pos):
+        keyword = self.keyword(pos, 'if')
+        if keyword is None:
+            return None
+        expression = self.expression(keyword[1])
+        if expression is None:
+            return None
+        return Condition(expression[0]), expression[1]
+
+    def lst_raw(self, pos):
+        word = self.word(pos, ALPHANUMS, ALPHANUMS)
+        if word is None:
+            return None
+        words = []
+        while word is not None:
+            words.append(word[0])
+            pos = word[1]
+            word = self.word(pos, ALPHANUMS, ALPHANUMS)
+        return words, pos
+
+    def lst(self, pos):
+        base = self.lst_raw(pos)
+        if base is None:
+            return None
+        pos = base[1]
+        remove = []
+        backslash = self.literal(pos, '\\')
+        if backslash is not None:
+            removed = self.lst_raw(backslash[1])
+            if removed is not None:
+                remove, pos = removed
+        return Lst(tuple(base[0]), tuple(remove)), pos
+
+    # grouped(rule) = rule | openParen + delimitedList(rule) + closeParen
+    def grouped(self, pos, rule):
+        match = rule(pos)
+        if match is not None:
+            return Grouped((match[0],)), match[1]
+        paren = self.literal(pos, '(')
+        if paren is None:
+            return None
+        items = self.delimited_list(paren[1], rule)
+        if items is None:
+            return None
+        paren = self.literal(items[1], ')')
+        if paren is None:
+            return None
+        return Grouped(tuple(items[0])), paren[1]
+
+    def iter(self, pos):
+        variableNames = self.grouped(pos, self.variable_name)
+        if variableNames is None:
+            return None
+        keyword = self.keyword(variableNames[1], 'in')
+        if keyword is None:
+            return None
+        lsts = self.grouped(keyword[1], self.lst) or self.variable_name(keyword[1])
+        if lsts is None:
+            return None
+        return Iter(variableNames[0], lsts[0]), lsts[1]
+
+    def formula(self, pos):
+        options = []
+        option = self.one_of(pos, OPTIONS)
+        if option is not None:
+            options, pos = [option[0]], option[1]
+
+        equation = self.equation(pos) or self.expression(pos)
+        if equation is None:
+            return None
+        pos = equation[1]
+
+        conditions = []
+        condition = self.condition(pos)
+        if condition is not None:
+            conditions, pos = [condition[0]], condition[1]
+
+        iterators = []
+        comma = self.literal(pos, ',')
+        if comma is not None:
+            iters = self.delimited_list(comma[1], self.iter)
+            if iters is not None:
+                iterators, pos = iters
+
+        return Formula(tuple(options), equation[0], tuple(conditions), tuple(iterators)), pos
+
+# Parses a Formula; as with pyparsing's parseString, any text left after the Formula is ignored
+def parse(text):
+    match = Parser(text.expandtabs()).formula(0)
+    if match is None:
+        raise ParseFailure(text)
+    return match[0]
@@ -1,12 +1,15 @@
+from functools import partial
+
 from pyparsing import *
 
 from elements import *
 
+# Lists of elements are stored as tuples, which are smaller
 def tokensAsList(kls, tokens):
-    return kls(tokens.asList())
+    return kls(tuple(tokens.asList()))
 
 def tokensAsArguments(kls, tokens):
-    return kls(*tokens.asList())
+    return kls(*[tuple(t) if isinstance(t, list) else t for t in tokens.asList()])
 
 def setParseClass(self, kls, unpack = False):
     self.setParseAction(partial(tokensAsArguments if unpack else tokensAsList, kls))
@@ -74,3 +77,10 @@ formula << (Group(Optional(options)) +
             (equation | expression) +
             Group(Optional(condition)) +
             Group(Optional(Suppress(',') + delimitedList(iter)))).setParseClass(Formula, True)
+
+# Packrat parsing memoizes the result of each grammar element at each position,
+# so that expressions aren't parsed again when `equation | expression` backtracks.
+# pyparsing can only enable it; disabling it restores the uncached parse method.
+def setPackrat(enabled):
+    ParserElement._packratEnabled = enabled
+    ParserElement._parse = ParserElement._parseCache if enabled else ParserElement._parseNoCache
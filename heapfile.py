@@ -0,0 +1,387 @@
+import os, sys, csv, copy, mmap, struct
+
+# Binary heap format
+# Loading tmp_all_vars.csv means parsing every one of its columns into floats, at each startup,
+# although a formula only ever reads a few of them.
+# The CSV is thus converted once into a binary file, which is then memory-mapped,
+# so that only the pages actually read are loaded from disk.
+# The CSV holds one row per period (observation), whose first column is the label of the period (not a variable);
+# all periods are kept, as a periods x variables matrix stored variable by variable:
+#   magic     8 bytes      'MODELHP3'
+#   count     uint32       number of variables
+#   periods   uint32       number of periods
+#   offsets   uint32 * (count + 1), offsets of the variable names in the names block
+#   offsets   uint32 * (periods + 1), offsets of the period labels in the labels block
+#   names     the variable names, sorted, concatenated (utf-8)
+#   labels    the period labels, in the order of the CSV, concatenated (utf-8)
+#   padding   up to a multiple of 8 bytes
+#   values    float64 * count * periods, in the order of the names,
+#             the values of a variable in all periods being contiguous, NaN for NA
+
+MAGIC = b'MODELHP3'
+HEADER = struct.Struct('<8sII')
+OFFSET = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+
+def heapPath(csvPath):
+    return os.path.splitext(csvPath)[0] + '.heap'
+
+def parseValue(e):
+    return float(e) if e != 'NA' else None
+
+# Heap keys can end with a time offset, e.g. X_01(-1) for the value of X_01 in the previous period,
+# as in the compiled Conditions. Returns the name and the offset
+def splitOffset(key):
+    if key.endswith(')') and '(' in key:
+        name, offset = key[:-1].split('(', 1)
+        try:
+            return name, int(offset)
+        except ValueError:
+            pass
+    return key, 0
+
+# Rows whose first column (the label of the period) is empty aren't periods
+def isPeriodRow(row):
+    return len(row) > 0 and row[0] != ''
+
+# Periods are given by their position, or by their label (e.g. '2006')
+def periodIndex(labels, period):
+    if isinstance(period, int):
+        if not 0 <= period < len(labels):
+            raise IndexError("No such period: " + str(period))
+        return period
+    if period not in labels:
+        raise KeyError("No such period: " + period)
+    return labels.index(period)
+
+# Reads the variable names and their values from the CSV exported by eViews
+# Values are on the third row, NA values become None
+# The first column holds the labels of the periods (e.g. 2006 or 2006Q1), and isn't a variable
+def readCSV(csvPath):
+    with open(csvPath, 'rb') as csvfile:
+        rows = list(csv.reader(csvfile))
+        return dict(zip(rows[0][1:], [parseValue(e) for e in rows[2][1:]]))
+
+# Reads all the periods of the CSV exported by eViews
+# Returns the labels of the periods, and a dict of the values of each variable in each period
+def readSeries(csvPath):
+    with open(csvPath, 'rb') as csvfile:
+        rows = list(csv.reader(csvfile))
+        periods = [r for r in rows[1:] if isPeriodRow(r)]
+        return [r[0] for r in periods], dict(zip(rows[0][1:], zip(*[[parseValue(e) for e in r[1:]] for r in periods])))
+
+def encodeBlock(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = [0]
+    for s in encoded:
+        offsets.append(offsets[-1] + len(s))
+    return b''.join([OFFSET.pack(o) for o in offsets]), b''.join(encoded)
+
+def write(labels, series, path):
+    names = sorted(series.keys())
+    nameOffsets, namesBlock = encodeBlock(names)
+    labelOffsets, labelsBlock = encodeBlock(labels)
+    padding = -(HEADER.size + len(nameOffsets) + len(labelOffsets) + len(namesBlock) + len(labelsBlock)) % 8
+    values = struct.Struct('<%dd' % len(labels))
+
+    # Written to a temporary file of its own first, so that a reader never sees a partial heap,
+    # and concurrent writers don't write the same file
+    tmpPath = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmpPath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(names), len(labels)))
+        f.write(nameOffsets)
+        f.write(labelOffsets)
+        f.write(namesBlock)
+        f.write(labelsBlock)
+        f.write(b'\0' * padding)
+        for n in names:
+            f.write(values.pack(*[v if v is not None else float('nan') for v in series[n]]))
+
+    # Replacing the heap is atomic, except on Windows, where the heap must be removed first,
+    # and can't be while another process maps it (e.g. a compile server)
+    try:
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmpPath, path)
+    except OSError:
+        os.remove(tmpPath)
+        raise
+
+def convert(csvPath, path = None):
+    path = path or heapPath(csvPath)
+    labels, series = readSeries(csvPath)
+    write(labels, series, path)
+    return path
+
+# Whether a file is a heap in the current format
+def isHeap(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+# A read-only, dict-like view of a binary heap file, for one of its periods (the first by default)
+# Lookups are binary searches in the memory-mapped names block
+class Heap(object):
+    def __init__(self, path, period = 0):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, self.count, self.periods = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise IOError("Not a heap file: " + path)
+
+        self.labelOffsetsStart = HEADER.size + OFFSET.size * (self.count + 1)
+        self.namesStart = self.labelOffsetsStart + OFFSET.size * (self.periods + 1)
+        self.labelsStart = self.namesStart + self.offset(self.count)
+        labelsEnd = self.labelsStart + self.labelOffset(self.periods)
+        self.valuesStart = labelsEnd + (-labelsEnd % 8)
+
+        self.labels = [self.label(t) for t in range(self.periods)]
+        self.period = periodIndex(self.labels, period)
+
+    def offset(self, i):
+        return OFFSET.unpack_from(self.mm, HEADER.size + OFFSET.size * i)[0]
+
+    def labelOffset(self, t):
+        return OFFSET.unpack_from(self.mm, self.labelOffsetsStart + OFFSET.size * t)[0]
+
+    def label(self, t):
+        raw = self.mm[self.labelsStart + self.labelOffset(t):self.labelsStart + self.labelOffset(t + 1)]
+        return raw if isinstance(raw, str) else raw.decode('utf-8')
+
+    # The same heap, for another period
+    # The view shares the memory map of the heap, so that switching periods copies nothing
+    def at(self, period):
+        view = copy.copy(self)
+        view.period = periodIndex(self.labels, period)
+        return view
+
+    def rawName(self, i):
+        return self.mm[self.namesStart + self.offset(i):self.namesStart + self.offset(i + 1)]
+
+    def name(self, i):
+        raw = self.rawName(i)
+        return raw if isinstance(raw, str) else raw.decode('utf-8')
+
+    # Value of the i-th variable, `offset` periods away from the current one
+    # Values outside of the periods of the heap are NA
+    def value(self, i, offset = 0):
+        t = self.period + offset
+        if not 0 <= t < self.periods:
+            return None
+        v = VALUE.unpack_from(self.mm, self.valuesStart + VALUE.size * (i * self.periods + t))[0]
+        return None if v != v else v
+
+    # Position of a name in the sorted names block, or -1
+    def find(self, key):
+        key = key.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.rawName(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self.rawName(lo) == key else -1
+
+    def __getitem__(self, key):
+        name, offset = splitOffset(key)
+        i = self.find(name)
+        if i < 0:
+            raise KeyError(key)
+        return self.value(i, offset)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.find(splitOffset(key)[0]) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (self.name(i) for i in range(self.count))
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        return [(self.name(i), self.value(i)) for i in range(self.count)]
+
+    # Closes the memory map, shared with the views of the heap for other periods
+    def close(self):
+        self.mm.close()
+
+def splitRow(line, maxsplit = -1):
+    return next(csv.reader([line])) if '"' in line else line.split(',', maxsplit)
+
+# A read-only, dict-like view of the CSV exported by eViews, whose values are converted lazily
+# Converting every column of a freshly exported CSV (or writing its binary heap) takes
+# much longer than compiling a single formula, which only reads a few of them.
+# The rows are only split when one of their values is first read, and values are converted when first looked up
+# Periods are selected as in Heap
+class CSVHeap(object):
+    def __init__(self, path, period = 0):
+        self.path = path
+        with open(path, 'rb') as f:
+            lines = f.read().splitlines()
+        self.names = splitRow(lines[0])[1:]
+        self.lines = [l for l in lines[1:] if isPeriodRow(splitRow(l, 1))]
+        self.labels = [splitRow(l, 1)[0] for l in self.lines]
+        self.periods = len(self.lines)
+        self.columns = None
+        # Split rows, by period, and converted values, by (name, period), shared with the views
+        self.rows = {}
+        self.values = {}
+        self.period = periodIndex(self.labels, period)
+
+    def at(self, period):
+        view = copy.copy(self)
+        view.period = periodIndex(self.labels, period)
+        return view
+
+    def column(self, key):
+        if self.columns is None:
+            self.columns = dict(zip(self.names, range(1, len(self.names) + 1)))
+        return self.columns.get(key, -1)
+
+    def row(self, t):
+        if t not in self.rows:
+            self.rows[t] = splitRow(self.lines[t])
+        return self.rows[t]
+
+    def __getitem__(self, key):
+        name, offset = splitOffset(key)
+        t = self.period + offset
+        if (name, t) not in self.values:
+            i = self.column(name)
+            if i < 0:
+                raise KeyError(key)
+            self.values[(name, t)] = parseValue(self.row(t)[i]) if 0 <= t < self.periods else None
+        return self.values[(name, t)]
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.column(splitOffset(key)[0]) >= 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def keys(self):
+        return list(self.names)
+
+    def items(self):
+        return [(n, self[n]) for n in self.names]
+
+    def close(self):
+        pass
+
+MISSING = object()
+
+# A heap whose values differ from those of another heap, `base`, for some variables and periods
+# `changes` holds the new values, by name and period position (e.g. ('X_01', 0) for the first period)
+# The base is shared with the other overlays of the same heap, and isn't closed with them
+# Periods are selected as in Heap
+class OverlayHeap(object):
+    def __init__(self, base, changes):
+        self.base = base
+        self.changes = changes
+        self.labels = base.labels
+        self.periods = base.periods
+        self.period = base.period
+
+    def at(self, period):
+        view = copy.copy(self)
+        view.base = self.base.at(period)
+        view.period = view.base.period
+        return view
+
+    def __getitem__(self, key):
+        name, offset = splitOffset(key)
+        change = self.changes.get((name, self.period + offset), MISSING)
+        return change if change is not MISSING else self.base[key]
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in self.base
+
+    def __len__(self):
+        return len(self.base)
+
+    def __iter__(self):
+        return iter(self.base)
+
+    def keys(self):
+        return self.base.keys()
+
+    def items(self):
+        return [(n, self[n]) for n in self.base]
+
+    def close(self):
+        pass
+
+def readLines(csvPath):
+    with open(csvPath, 'rb') as f:
+        return f.read().splitlines()
+
+# The values which changed between two versions of the lines of a CSV exported by eViews,
+# by name and period position, or None if its variables or periods changed
+# Only the rows which changed are split, and only the values which changed are converted
+def changedValues(oldLines, newLines):
+    if len(oldLines) == 0 or len(newLines) == 0 or oldLines[0] != newLines[0]:
+        return None
+    oldRows = [l for l in oldLines[1:] if isPeriodRow(splitRow(l, 1))]
+    newRows = [l for l in newLines[1:] if isPeriodRow(splitRow(l, 1))]
+    if [splitRow(l, 1)[0] for l in oldRows] != [splitRow(l, 1)[0] for l in newRows]:
+        return None
+
+    names = splitRow(newLines[0])
+    changes = {}
+    for t, (old, new) in enumerate(zip(oldRows, newRows)):
+        if old != new:
+            oldValues, newValues = splitRow(old), splitRow(new)
+            if len(newValues) != len(names):
+                raise ValueError("Row %s has %d values, for %d variables" % (newValues[0], len(newValues), len(names)))
+            for i in range(1, len(names)):
+                if i >= len(oldValues) or oldValues[i] != newValues[i]:
+                    changes[(names[i], t)] = parseValue(newValues[i])
+    return changes
+
+# Opens the binary heap corresponding to a CSV file,
+# converting the CSV first if the binary heap is missing, in an older format or older than the CSV
+# With `lazy`, the CSV isn't converted but read as a CSVHeap instead,
+# for the entry points that compile a single formula, as it is when the binary heap can't be replaced
+def load(csvPath, lazy = False):
+    path = heapPath(csvPath)
+    if not os.path.exists(path) or not isHeap(path) or \
+       (os.path.exists(csvPath) and os.path.getmtime(path) < os.path.getmtime(csvPath)):
+        if lazy:
+            return CSVHeap(csvPath)
+        try:
+            convert(csvPath, path)
+        # The stale heap is mapped by another process and can't be replaced: the CSV is read instead
+        except OSError:
+            return CSVHeap(csvPath)
+    return Heap(path)
+
+# Converts a CSV file to a binary heap
+# e.g. python heapfile.py tmp_all_vars.csv
+if __name__ == '__main__':
+    print (convert(sys.argv[1] if len(sys.argv) > 1 else 'tmp_all_vars.csv'))
@@ -0,0 +1,103 @@
+import os, sys, threading
+from timeit import default_timer as timer
+
+import caching
+import heapfile
+import profiling
+import resultcache
+
+# Reloads the heap of a long-running compiler (server.py, async-compiler.py) when eViews exports new values
+# The CSV is polled every INTERVAL seconds, and reloaded once it has stopped changing, i.e. once its size
+# and modification time are the same in two successive polls, so that a CSV being written isn't read.
+# When only values changed, only the rows which changed are split, and only the values which changed are
+# converted: the new heap is the heap loaded at startup, overlaid with the new values (see heapfile.OverlayHeap).
+# When variables or periods were added or removed, the CSV is read again, lazily (see heapfile.CSVHeap).
+# The binary heap isn't written again, as it is mapped in memory by the compiler; the next compiler started
+# converts the CSV again (see heapfile.load).
+# The new heap is swapped in at once by `swap`, e.g. by setting the heap of the server: each compilation reads
+# the heap once, and uses either the old or the new one throughout. The compiled formulas which read values
+# that changed are then discarded from the result cache, and the reload is logged, with the version of the heap,
+# the number of values which changed and the time taken, also as a reload record when profiling (see profiling.py).
+# If the CSV can't be read, the old heap is kept until the CSV changes again.
+# Reloading is disabled by setting the MODEL_HEAP_RELOAD environment variable to 0
+
+INTERVAL = 1.0
+
+def enabled():
+    return caching.enabled('MODEL_HEAP_RELOAD')
+
+def signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime, stat.st_size
+
+class HeapWatcher(object):
+    def __init__(self, csvPath, heap, swap, interval = INTERVAL, results = resultcache.cache, out = sys.stdout):
+        self.csvPath = csvPath
+        self.swap = swap
+        self.interval = interval
+        self.results = results
+        self.out = out
+        self.heap = heap
+        # The heap read last from the CSV, and the values which changed since, by name and period position
+        self.base = heap
+        self.changes = {}
+        self.version = 1
+        self.signature = signature(csvPath)
+        self.lines = heapfile.readLines(csvPath)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        pending = self.signature
+        while not self.stopped.wait(self.interval):
+            current = signature(self.csvPath)
+            if current is not None and current != self.signature and current == pending:
+                self.reload(current)
+            pending = current
+
+    # Reloads the CSV, and returns the new heap, or None if it couldn't be read
+    def reload(self, current = None):
+        start = timer()
+        self.signature = current or signature(self.csvPath)
+        try:
+            lines = heapfile.readLines(self.csvPath)
+            changed = heapfile.changedValues(self.lines, lines)
+            if changed is None:
+                base, changes = heapfile.CSVHeap(self.csvPath), {}
+                heap = base
+            else:
+                base, changes = self.base, dict(self.changes)
+                changes.update(changed)
+                heap = heapfile.OverlayHeap(base, changes)
+        except (IOError, IndexError, KeyError, ValueError) as e:
+            self.log("Heap not reloaded: %s" % e)
+            return None
+
+        self.swap(heap)
+        self.heap, self.base, self.changes, self.lines = heap, base, changes, lines
+        self.version += 1
+        discarded = self.results.invalidate(heap)
+        seconds = timer() - start
+        count = len(changed) if changed is not None else None
+        self.log("Heap version %d: %s, %d compiled formulas discarded, reloaded in %.3f s" %
+                 (self.version, "%d values changed" % count if count is not None else "read again", discarded, seconds))
+        profiling.reload(self.version, count, discarded, seconds)
+        return heap
+
+    def log(self, message):
+        self.out.write(message + "\n")
+        self.out.flush()
@@ -1,7 +1,14 @@
-import os, sys, csv, time, random
+import profiling
+import os, sys, time, random
 
-import pyparsing
-import grammar
+import compilation
+import heapfile
+import parsecache
+import resultcache
+
+# Profiling is enabled with --profile, see profiling.py
+profiling.configure(sys.argv)
+startup = profiling.startup('imcompiler')
 
 # The formula to be compiled is passed in the first command line argument
 # If no formula was passed, exit
@@ -15,11 +22,9 @@ if code[0] == '"':
 code = code.strip()
 
 # Load values of all variables
-with open('tmp_all_vars.csv', 'rb') as csvfile:
-    rows = list(csv.reader(csvfile))
-    heap = dict(zip(rows[0],
-                    [float(e) if e != 'NA' else
-                     None for e in rows[2]]))
+# A CSV newer than its binary heap is read lazily rather than converted
+with startup.phase('heap'):
+    heap = heapfile.load('tmp_all_vars.csv', lazy = True)
 
 compiler_out = "_compiler_out"
 
@@ -32,17 +37,25 @@ ensure_directory(compiler_out)
 # Name of the file where the output will be saved
 filename = str(int(time.time())) + str(random.randint(0, 999)) + ".txt"
 
-# Compilation
-try:
-    output = grammar.formula.parseString(code)[0].compile(heap)
-except pyparsing.ParseException as e:
-    output = "Error\r\n" + str(e)
-except:
-    output = "Error\r\n" + str(sys.exc_info()[0])
-
-# Writes the output, compiled code or error message to a file in _compiler_out
-with open(os.path.join(compiler_out, filename), 'w') as f:
-    f.write(output)
+# Parsed and compiled formulas are cached on disk between runs
+cache = parsecache.persistent_cache()
+results = resultcache.persistent_cache()
+startup.write()
+
+with profiling.formula(code) as profile:
+    # Compilation
+    try:
+        with profile.phase('codegen'):
+            output = compilation.compile_formula(code, heap, results, cache)
+    except:
+        e = sys.exc_info()[1]
+        output = "Error\r\n" + (str(e) if parsecache.isParseError(e) else str(sys.exc_info()[0]))
+
+    # Writes the output, compiled code or error message to a file in _compiler_out
+    with profile.phase('write'):
+        with open(os.path.join(compiler_out, filename), 'w') as f:
+            f.write(output)
+    profile.count('output', len(output))
 
 # Prints the filename to stdout, so that eViews can then load it
 print (filename)
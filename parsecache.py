@@ -0,0 +1,70 @@
+import os, sys
+
+import caching
+import profiling
+import fastparser
+
+# Cache of parsed Formulas, keyed by their normalized text
+# Parsing is the most expensive step for long formulas, and model files compile
+# the same formulas over and over again.
+# The cache is disabled by setting the MODEL_PARSE_CACHE environment variable to 0
+# The parser is chosen with the MODEL_PARSER environment variable:
+#   fast        the hand-written parser of fastparser.py (default); the formulas it rejects
+#               are parsed again by pyparsing, so that errors are reported the same way
+#   pyparsing   the grammar of grammar.py
+#   packrat     the grammar of grammar.py, with packrat parsing
+# pyparsing and the grammar are only imported when they are first used, as building
+# the grammar takes a noticeable part of the startup time of compiler.py
+
+BACKENDS = ['fast', 'pyparsing', 'packrat']
+
+def backend():
+    name = os.environ.get('MODEL_PARSER', 'fast').lower()
+    if name not in BACKENDS:
+        raise ValueError("Unknown parser: " + name)
+    return name
+
+def normalize(code):
+    return ' '.join(code.split())
+
+def parse(code, parser = None):
+    with profiling.phase('parse'):
+        parser = parser or backend()
+        if parser == 'fast':
+            try:
+                return fastparser.parse(code)
+            except fastparser.ParseFailure:
+                pass
+        import grammar
+        grammar.setPackrat(parser == 'packrat')
+        return grammar.formula.parseString(code)[0]
+
+# Whether an exception is a parse error, i.e. a ParseException of pyparsing
+# (which can only have been raised if pyparsing was imported)
+def isParseError(e):
+    pyparsing = sys.modules.get('pyparsing')
+    return pyparsing is not None and isinstance(e, pyparsing.ParseException)
+
+class ParseCache(caching.Cache):
+    # Returns the parsed Formula for a piece of code
+    def parse(self, code):
+        if not self.enabled:
+            return parse(code)
+
+        with profiling.phase('parse'):
+            text = normalize(code)
+            formula = self.fetch(text)
+            if formula is None:
+                formula = parse(text)
+                self.put(text, formula)
+            return formula
+
+def enabled():
+    return caching.enabled('MODEL_PARSE_CACHE')
+
+# Cache shared by all the compilations of a process
+cache = ParseCache(enabled = enabled())
+
+# Cache backed by a directory on disk, for the entry points that compile a single formula
+def persistent_cache():
+    return ParseCache(directory = os.environ.get('MODEL_PARSE_CACHE_DIR', '_parse_cache'), enabled = enabled())
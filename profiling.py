@@ -0,0 +1,195 @@
+import os, json, time, threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+# Instrumentation of the compiler
+# Tells where the time of a slow compilation goes: starting the process, loading the heap,
+# parsing, evaluating Conditions or generating the code.
+# Profiling is enabled with --profile on the command line of the entry points (compiler.py,
+# imcompiler.py, async-compiler.py and server.py), or by setting the MODEL_PROFILE environment variable to 1.
+# Records are appended to a log as JSON lines, _profile.log by default (MODEL_PROFILE_LOG):
+#   start      once per process: the time taken by imports until the entry point starts (startup),
+#              and to load the heap (heap)
+#   compile    once per formula, with the wall times of its phases, in seconds:
+#                parse        parsing, including the lookups in the parse cache
+#                conditions   evaluating Conditions, including their heap lookups (and the conversion
+#                             of the values of a lazily loaded CSV, see heapfile.CSVHeap)
+#                simplify     simplifying the compiled code, with MODEL_SIMPLIFY (see simplify.py)
+#                codegen      compiling, except for the phases above
+#                write        writing the output
+#              and counters: bindings (iterator bindings generated), conditions (Conditions or
+#              conjuncts evaluated, one per binding), evals (expressions evaluated by Python,
+#              see Expression.evaluate and evaluator.py) and output (size of the output)
+#   reload     once per reload of the heap by a long-running entry point (see heapwatch.py): the version
+#              of the new heap, the number of values which changed (null if the CSV was read again),
+#              the number of compiled formulas discarded from the result cache, and the time taken (seconds)
+# Phases don't overlap: the time of a phase started within another one is only counted in the former.
+# With --profile=cprofile (or MODEL_PROFILE=cprofile), each formula is also compiled under cProfile,
+# and its statistics are dumped in the _profile directory (MODEL_PROFILE_DIR), to be read with pstats
+
+# Imported first by the entry points, so that the time taken by the other imports is known
+LOADED = timer()
+
+MODES = ['', 'log', 'cprofile']
+
+def modeOf(value):
+    value = value.lower()
+    if value in ['', '0']:
+        return ''
+    elif value in ['1', 'log']:
+        return 'log'
+    elif value in MODES:
+        return value
+    raise ValueError("Unknown profiling mode: " + value)
+
+mode = modeOf(os.environ.get('MODEL_PROFILE', ''))
+
+def logPath():
+    return os.environ.get('MODEL_PROFILE_LOG', '_profile.log')
+
+def dumpDirectory():
+    return os.environ.get('MODEL_PROFILE_DIR', '_profile')
+
+# Enables profiling if --profile is on the command line, and removes it from the arguments
+def configure(argv):
+    global mode
+    for a in list(argv[1:]):
+        if a == '--profile' or a.startswith('--profile='):
+            mode = modeOf(a.partition('=')[2] or 'log')
+            argv.remove(a)
+    return argv
+
+# Records are written by any thread, and by any process
+logLock = threading.Lock()
+
+def log(record):
+    line = json.dumps(record) + "\n"
+    with logLock:
+        with open(logPath(), 'a') as f:
+            f.write(line)
+
+class Profile(object):
+    def __init__(self, event, **fields):
+        self.record = OrderedDict([('event', event), ('time', time.time())] + sorted(fields.items()))
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+        self.running = []
+        self.since = timer()
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def phase(self, name):
+        return Phase(self, name)
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def write(self):
+        self.record['phases'] = self.phases
+        self.record['counters'] = self.counters
+        log(self.record)
+
+class Phase(object):
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        profile, now = self.profile, timer()
+        if len(profile.running) > 0:
+            profile.add(profile.running[-1], now - profile.since)
+        profile.running.append(self.name)
+        profile.since = now
+
+    def __exit__(self, *exc):
+        profile, now = self.profile, timer()
+        profile.add(profile.running.pop(), now - profile.since)
+        profile.since = now
+
+# Stands for the Profile when profiling is disabled
+class NullProfile(object):
+    def phase(self, name):
+        return self
+
+    def count(self, name, n = 1):
+        pass
+
+    def write(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+nullProfile = NullProfile()
+
+# The Profile of the formula being compiled by each thread, if any
+class Current(threading.local):
+    profile = None
+
+current = Current()
+
+# Hooks for the compiler, which do nothing unless a formula is being profiled
+def phase(name):
+    profile = current.profile
+    return profile.phase(name) if profile is not None else nullProfile
+
+def count(name, n = 1):
+    profile = current.profile
+    if profile is not None:
+        profile.count(name, n)
+
+# The start record of an entry point, whose phases are to be completed and written
+def startup(entry):
+    if mode == '':
+        return nullProfile
+    profile = Profile('start', entry = entry, pid = os.getpid())
+    profile.add('startup', timer() - LOADED)
+    return profile
+
+# Profiles the compilation of a formula, within a with statement, and writes its record at the end
+class Formula(object):
+    sequence = 0
+
+    def __init__(self, code):
+        self.profile = Profile('compile', formula = code, pid = os.getpid())
+        self.profiler = None
+
+    def __enter__(self):
+        current.profile = self.profile
+        if mode == 'cprofile':
+            import cProfile
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        return self.profile
+
+    def __exit__(self, excType, exc, traceback):
+        current.profile = None
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profile.record['cprofile'] = self.dump()
+        if excType is not None:
+            self.profile.record['error'] = repr(exc)
+        self.profile.write()
+
+    def dump(self):
+        directory = dumpDirectory()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with logLock:
+            Formula.sequence += 1
+            name = "%d_%d_%d.prof" % (int(time.time()), os.getpid(), Formula.sequence)
+        path = os.path.join(directory, name)
+        self.profiler.dump_stats(path)
+        return path
+
+def formula(code):
+    return Formula(code) if mode != '' else nullProfile
+
+def reload(version, changed, discarded, seconds):
+    if mode != '':
+        log(OrderedDict([('event', 'reload'), ('time', time.time()), ('pid', os.getpid()), ('version', version),
+                         ('changed', changed), ('discarded', discarded), ('seconds', seconds)]))
@@ -0,0 +1,53 @@
+import os, struct
+
+# Protocol spoken between the compile server (server.py) and its clients (client.py)
+# Each message is framed as a 4-byte big-endian length, followed by the utf-8 encoded body
+# Requests are a command, optionally followed by a space and its argument:
+#   compile <formula>    answered with the compiled code, or "Error\r\n<message>"
+#   ping                 answered with "pong"
+#   shutdown             answered with "OK", then the server stops
+
+PORT = int(os.environ.get('MODEL_COMPILER_PORT', 5557))
+
+COMPILE = 'compile'
+PING = 'ping'
+SHUTDOWN = 'shutdown'
+
+LENGTH = struct.Struct('>I')
+
+def encode(message):
+    return message if isinstance(message, bytes) else message.encode('utf-8')
+
+def decode(data):
+    return data if isinstance(data, str) else data.decode('utf-8')
+
+def send(sock, message):
+    data = encode(message)
+    sock.sendall(LENGTH.pack(len(data)) + data)
+
+def receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            if len(chunks) > 0:
+                raise IOError("Connection closed in the middle of a message")
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+# Returns the next message, or None if the connection was closed
+def receive(sock):
+    header = receive_exactly(sock, LENGTH.size)
+    if header is None:
+        return None
+    length = LENGTH.unpack(header)[0]
+    return decode(receive_exactly(sock, length) or b'')
+
+def request(command, argument = None):
+    return command if argument is None else command + ' ' + argument
+
+def parse_request(message):
+    command, _, argument = message.partition(' ')
+    return command, argument
@@ -0,0 +1,85 @@
+import os
+from collections import namedtuple
+from timeit import default_timer as timer
+
+import caching
+import parsecache
+
+# Cache of compiled Formulas
+# The compiled code only depends on the text of the Formula, and on the values
+# read from the heap when evaluating its Conditions.
+# Each entry thus records the heap values it has read, and is only reused
+# as long as the heap holds the same values for those variables
+# Each entry also records how long the compilation took, so that the time saved by reusing it is known
+# The cache is disabled by setting the MODEL_RESULT_CACHE environment variable to 0
+
+MISSING = object()
+
+class Result(namedtuple("Result", ['output', 'reads', 'seconds'])):
+    def upToDate(self, heap):
+        return all([heap.get(k, MISSING) == v for k, v in self.reads.items()])
+
+# Records the values read from a heap
+class RecordingHeap(object):
+    def __init__(self, heap):
+        self.heap = heap
+        self.reads = {}
+
+    def __getitem__(self, key):
+        value = self.heap[key]
+        self.reads[key] = value
+        return value
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+class ResultCache(caching.Cache):
+    def __init__(self, *args, **kwargs):
+        caching.Cache.__init__(self, *args, **kwargs)
+        # Compilation time of the results that were reused
+        self.saved = 0.0
+
+    def stats(self):
+        return dict(caching.Cache.stats(self), saved = self.saved)
+
+    # Returns the compiled code of a piece of code
+    # Formulas that have to be compiled are parsed with `parser`
+    def compile(self, code, heap, parser = parsecache.cache):
+        if not self.enabled:
+            return parser.parse(code).compile(heap)
+
+        text = parsecache.normalize(code)
+        result = self.fetch(text, lambda r: r.upToDate(heap))
+        if result is None:
+            start = timer()
+            recordingHeap = RecordingHeap(heap)
+            output = parser.parse(text).compile(recordingHeap)
+            result = Result(output, recordingHeap.reads, timer() - start)
+            self.put(text, result)
+        else:
+            with self.lock:
+                self.saved += result.seconds
+        return result.output
+
+    # Discards the entries of the in-memory cache that depend on values that have changed in the heap,
+    # and returns the number of discarded entries
+    # Entries on disk are checked the same way when they are loaded
+    def invalidate(self, heap):
+        with self.lock:
+            stale = [k for k, r in self.entries.items() if not r.upToDate(heap)]
+            for k in stale:
+                del self.entries[k]
+        return len(stale)
+
+def enabled():
+    return caching.enabled('MODEL_RESULT_CACHE')
+
+# Cache shared by all the compilations of a process
+cache = ResultCache(enabled = enabled())
+
+# Cache backed by a directory on disk, for the entry points that compile a single formula
+def persistent_cache():
+    return ResultCache(directory = os.environ.get('MODEL_RESULT_CACHE_DIR', '_result_cache'), enabled = enabled())
@@ -0,0 +1,76 @@
+import profiling
+import os, sys, threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import compilation
+import heapfile
+import heapwatch
+import protocol
+
+# Long-running compile server
+# The grammar and the heap are loaded once, then formulas are compiled on request,
+# any number of them per connection (see protocol.py)
+# The heap is reloaded when the CSV changes (see heapwatch.py)
+# Usage: python server.py [working directory] [port] [--profile]
+
+class CompileHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            message = protocol.receive(self.request)
+            if message is None:
+                return
+
+            command, argument = protocol.parse_request(message)
+            if command == protocol.COMPILE:
+                with profiling.formula(argument) as profile:
+                    with profile.phase('codegen'):
+                        output = compilation.compile_or_error(argument, self.server.heap)
+                    with profile.phase('write'):
+                        protocol.send(self.request, output)
+                    profile.count('output', len(output))
+            elif command == protocol.PING:
+                protocol.send(self.request, 'pong')
+            elif command == protocol.SHUTDOWN:
+                protocol.send(self.request, 'OK')
+                # shutdown() waits for serve_forever() to return, so it can't be called from this thread
+                threading.Thread(target = self.server.shutdown).start()
+                return
+            else:
+                protocol.send(self.request, "Error\r\nUnknown command: " + command)
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, heap):
+        self.heap = heap
+        socketserver.TCPServer.__init__(self, address, CompileHandler)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+if __name__ == '__main__':
+    profiling.configure(sys.argv)
+    startup = profiling.startup('server')
+    if len(sys.argv) > 1:
+        os.chdir(sys.argv[1])
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else protocol.PORT
+
+    with startup.phase('heap'):
+        heap = heapfile.load('tmp_all_vars.csv')
+    server = CompileServer(('127.0.0.1', port), heap)
+    if heapwatch.enabled():
+        heapwatch.HeapWatcher('tmp_all_vars.csv', heap, lambda heap: setattr(server, 'heap', heap)).start()
+    startup.write()
+    print ("Ready to compile on port " + str(server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print ("Shutting down")
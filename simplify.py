@@ -0,0 +1,438 @@
+import os, re, math
+from collections import namedtuple
+
+import heapfile
+import profiling
+
+# Simplification of the compiled code
+# The compiled code is loose: each sum starts with `0 + `, an empty sum compiles to 0, and
+# the terms of variables which are zero in the heap (e.g. the price and volume of a product
+# which isn't produced) are kept, although eViews then computes them in each period.
+# Each compiled equation is thus parsed again, and simplified:
+#   variables which are zero in the heap are replaced by 0, as in Conditions such as `if X[c] <> 0`,
+#   which assume that a variable which is zero in the heap is structurally zero
+#   constants are folded, and the terms which are added zeros or multiplied by zero are dropped
+#   (x + 0, 0 + x, x - 0, 0 * x, x * 0, 0 / x, x * 1, x / 1)
+#   redundant parentheses are removed
+# Equations which are then 0 = 0 (e.g. the equation of a variable which is zero, and whose terms
+# are all zero) are dropped.
+# Within the arguments of functions (e.g. log or @elem), divisors and the bases of powers, variables are
+# never replaced by 0, and constants are only folded: an equation which divides by a variable which is
+# zero in the heap is kept as it is, rather than divided by 0 in every period.
+# Equations which can't be parsed (e.g. with comparisons) are kept as they are.
+# Simplification is enabled by setting the MODEL_SIMPLIFY environment variable to 1,
+# or with the --simplify option of batch.py, which also reports how much the model shrank
+
+def enabled():
+    return os.environ.get('MODEL_SIMPLIFY', '0') not in ['', '0']
+
+# Numbers, names, strings and operators; any other character is matched by the last group
+TOKEN = re.compile(r'\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+(?:[eE][-+]?\d+)?)|([@%A-Za-z_][A-Za-z0-9_]*)|("[^"]*")|([-+*/^(),=])|(\S))')
+
+# Nodes of the parsed equations
+Num = namedtuple("Num", ['value', 'text'])
+# A variable, with its time offset if any, e.g. X_01(-1)
+Ref = namedtuple("Ref", ['name', 'offset'])
+# Any other operand, such as %baseyear or a string
+Atom = namedtuple("Atom", ['text'])
+Call = namedtuple("Call", ['name', 'args'])
+Neg = namedtuple("Neg", ['operand'])
+# Chains of additions and subtractions are kept flat, as (sign, term) pairs, e.g. a - b + c as
+# (('+', a), ('-', b), ('+', c)), and chains of multiplications and divisions as (operator, factor) pairs,
+# rather than as nested binary operations: compiled sums can hold thousands of terms
+Sum = namedtuple("Sum", ['terms'])
+Product = namedtuple("Product", ['factors'])
+Power = namedtuple("Power", ['base', 'exponent'])
+
+# Tokens as (kind, text), the kind being the group of TOKEN which matched
+# Unless `strict`, other characters (e.g. those of comparisons) are taken as operators
+def tokenize(text, strict = True):
+    tokens = []
+    for groups in TOKEN.findall(text):
+        kind = 1 if groups[0] else 2 if groups[1] else 3 if groups[2] else 4 if groups[3] else 5
+        if kind == 5:
+            if strict:
+                raise SyntaxError("Can't simplify: " + text)
+            kind, groups = 4, groups[:3] + groups[4:]
+        tokens.append((kind, groups[kind - 1]))
+    return tokens
+
+# A recursive-descent parser of eViews expressions, with the usual precedences:
+#   expression := term (('+' | '-') term)*
+#   term       := unary (('*' | '/') unary)*
+#   unary      := ('-' | '+') unary | power
+#   power      := primary ['^' factor]
+#   factor     := '-' factor | primary
+#   primary    := number | name | name '(' arguments ')' | string | '(' expression ')'
+class Parser(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        # The texts of the tokens, followed by None at the end
+        self.texts = [t[1] for t in tokens] + [None]
+        self.position = 0
+
+    def peek(self):
+        return self.texts[self.position]
+
+    def next(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def expect(self, text):
+        if self.peek() != text:
+            raise SyntaxError("Expected " + text)
+        self.position += 1
+
+    def done(self):
+        return self.position == len(self.tokens)
+
+    def expression(self):
+        terms = [('+', self.term())]
+        while self.peek() in ['+', '-']:
+            terms.append((self.next()[1], self.term()))
+        return Sum(tuple(terms)) if len(terms) > 1 else terms[0][1]
+
+    def term(self):
+        factors = [('*', self.unary())]
+        while self.peek() in ['*', '/']:
+            factors.append((self.next()[1], self.unary()))
+        return Product(tuple(factors)) if len(factors) > 1 else factors[0][1]
+
+    def unary(self, negated = False):
+        if self.peek() == '-':
+            self.next()
+            return Neg(self.unary(True))
+        if self.peek() == '+':
+            self.next()
+            return self.unary(negated)
+        return self.power(negated)
+
+    # Whether -a ^ b is (-a) ^ b or -(a ^ b), and a ^ b ^ c is (a ^ b) ^ c or a ^ (b ^ c), is left
+    # to eViews: such equations are kept as they are
+    def power(self, negated = False):
+        node = self.primary()
+        if self.peek() == '^':
+            self.next()
+            node = Power(node, self.factor())
+            if negated or self.peek() == '^':
+                raise SyntaxError("Ambiguous ^")
+        return node
+
+    def factor(self):
+        if self.peek() == '-':
+            self.next()
+            return Neg(self.factor())
+        return self.primary()
+
+    def primary(self):
+        if self.done():
+            raise SyntaxError("Unexpected end")
+        kind, text = self.next()
+        if kind == 1:
+            return Num(float(text), text)
+        if kind == 3:
+            return Atom(text)
+        if kind == 2:
+            if self.peek() != '(':
+                return Atom(text) if text[0] in '@%' else Ref(text, None)
+            self.next()
+            args = [] if self.peek() == ')' else self.arguments()
+            self.expect(')')
+            offset = timeOffset(args)
+            if offset is not None and text[0] not in '@%':
+                return Ref(text, offset)
+            return Call(text, tuple(args))
+        if text == '(':
+            node = self.expression()
+            self.expect(')')
+            return node
+        raise SyntaxError("Unexpected " + text)
+
+    def arguments(self):
+        args = [self.expression()]
+        while self.peek() == ',':
+            self.next()
+            args.append(self.expression())
+        return args
+
+# X(-1) is the value of X in the previous period: the only argument is an integer
+def timeOffset(args):
+    if len(args) != 1:
+        return None
+    a = args[0]
+    if isinstance(a, Neg) and isinstance(a.operand, Num):
+        return '-' + a.operand.text if a.operand.text.isdigit() else None
+    if isinstance(a, Num) and a.text.isdigit():
+        return a.text
+    return None
+
+# Splits an equation into its two sides, at its only top-level equal sign
+def parse_equation(text):
+    tokens = tokenize(text)
+    equals = [i for i, t in enumerate(tokens) if t[1] == '=']
+    if len(equals) != 1:
+        raise SyntaxError("Can't simplify: " + text)
+    sides = []
+    for part in [tokens[:equals[0]], tokens[equals[0] + 1:]]:
+        parser = Parser(part)
+        sides.append(parser.expression())
+        if not parser.done():
+            raise SyntaxError("Can't simplify: " + text)
+    return sides
+
+# Constants are only folded into finite values, which can be written back
+def isFinite(value):
+    return not (math.isinf(value) or math.isnan(value))
+
+def number(value):
+    if value == int(value) and abs(value) < 1e15:
+        return Num(float(int(value)), str(int(value)))
+    return Num(value, repr(value))
+
+def isNum(node, value = None):
+    return isinstance(node, Num) and (value is None or node.value == value)
+
+def isNegative(node):
+    return isinstance(node, Neg) or (isNum(node) and node.value < 0)
+
+def negate(node):
+    if isNum(node) and isFinite(node.value):
+        return number(-node.value)
+    if isinstance(node, Neg):
+        return node.operand
+    return Neg(node)
+
+# Looking a variable up in a binary heap is a binary search in its names, while the compiled code
+# of a model refers to hundreds of thousands of variables: the names of the variables which are zero
+# in a binary heap are thus rather listed once, in a single pass over the heap, kept for the next formulas
+# Other heaps, and variables with a time offset, are looked up
+class Zeros(object):
+    def __init__(self, heap):
+        self.heap = heap
+        self.names = set([k for k, v in heap.items() if v == 0]) if isinstance(heap, heapfile.Heap) else None
+
+    def __contains__(self, ref):
+        return self.isZero(ref.name, ref.offset)
+
+    def isZero(self, name, offset = None):
+        name = name.upper()
+        if offset is None and self.names is not None:
+            return name in self.names
+        return self.heap.get(name + ('(' + offset + ')' if offset is not None else '')) == 0
+
+lastZeros = None
+
+def zerosOf(heap):
+    global lastZeros
+    zeros = lastZeros
+    if zeros is None or zeros.heap is not heap:
+        zeros = lastZeros = Zeros(heap)
+    return zeros
+
+# The opposite of a node which is written with a leading minus sign, e.g. -a, -2 or -a * b, or None
+def opposite(node):
+    if isNegative(node):
+        return negate(node)
+    if isinstance(node, Product) and isNegative(node.factors[0][1]):
+        return Product(((node.factors[0][0], negate(node.factors[0][1])),) + node.factors[1:])
+    return None
+
+# Folds a node; variables in `zeros` are replaced by 0, unless `zeros` is None
+# (in divisors and the bases of powers, zeros are never replaced)
+def fold(node, zeros):
+    if isinstance(node, Ref):
+        return number(0) if zeros is not None and node in zeros else node
+    if isinstance(node, Call):
+        return Call(node.name, tuple([fold(a, None) for a in node.args]))
+    if isinstance(node, Neg):
+        return negate(fold(node.operand, zeros))
+    if isinstance(node, Sum):
+        return foldSum(node.terms, zeros)
+    if isinstance(node, Product):
+        return foldProduct(node.factors, zeros)
+    if isinstance(node, Power):
+        return Power(fold(node.base, None), fold(node.exponent, zeros))
+    return node
+
+# Adds a folded term to a sum: the terms of a sum within parentheses are added one by one,
+# the signs of negative terms are moved to the sum, and zeros are dropped
+def addTerm(terms, sign, term):
+    if isinstance(term, Sum):
+        for s, t in term.terms:
+            addTerm(terms, sign if s == '+' else flip(sign), t)
+    elif isNum(term, 0):
+        pass
+    elif opposite(term) is not None:
+        terms.append((flip(sign), opposite(term)))
+    else:
+        terms.append((sign, term))
+
+def flip(sign):
+    return '-' if sign == '+' else '+'
+
+def foldSum(terms, zeros):
+    folded = []
+    for sign, term in terms:
+        addTerm(folded, sign, fold(term, zeros))
+    # Constants are folded from the left, as they are computed, e.g. 1 + 2 + a, but not a + 1 + 2
+    while len(folded) >= 2 and isNum(folded[0][1]) and isNum(folded[1][1]):
+        value = sum([t.value if s == '+' else -t.value for s, t in folded[:2]])
+        if not isFinite(value):
+            break
+        folded[:2] = [] if value == 0 else [('-', number(-value)) if value < 0 else ('+', number(value))]
+    if len(folded) == 0:
+        return number(0)
+    if len(folded) == 1:
+        return folded[0][1] if folded[0][0] == '+' else negate(folded[0][1])
+    return Sum(tuple(folded))
+
+# Adds a folded factor to a product: the factors of a product within parentheses are added one by one,
+# e.g. a / (b / c) as a / b * c
+def addFactor(factors, op, factor):
+    if isinstance(factor, Product):
+        for o, f in factor.factors:
+            addFactor(factors, '*' if o == op else '/', f)
+    else:
+        factors.append((op, factor))
+
+def foldProduct(factors, zeros):
+    folded = []
+    for op, factor in factors:
+        addFactor(folded, op, fold(factor, zeros if op == '*' else None))
+    # 0 * x, x * 0, 0 / x, but not x / 0
+    if any([op == '*' and isNum(f, 0) for op, f in folded]):
+        return number(0)
+    # The product starts with a multiplied factor, 1 if the first one left divides, e.g. 1 / 2 * 3
+    folded = [(op, f) for op, f in folded if not isNum(f, 1)]
+    if len(folded) == 0 or folded[0][0] == '/':
+        folded.insert(0, ('*', number(1)))
+    while len(folded) >= 2 and isNum(folded[0][1]) and isNum(folded[1][1]) and \
+          (folded[1][0] == '*' or folded[1][1].value != 0):
+        a, b = folded[0][1].value, folded[1][1].value
+        value = a * b if folded[1][0] == '*' else a / b
+        if not isFinite(value):
+            break
+        folded[:2] = [('*', number(value))]
+    if len(folded) == 1:
+        return folded[0][1]
+    return Product(tuple(folded))
+
+# Atoms and functions are written without parentheses anywhere
+def isAtom(node):
+    return isinstance(node, (Ref, Atom, Call)) or (isNum(node) and node.value >= 0)
+
+def write(node):
+    if isinstance(node, (Num, Atom)):
+        return node.text
+    if isinstance(node, Ref):
+        return node.name + ('(' + node.offset + ')' if node.offset is not None else '')
+    if isinstance(node, Call):
+        return node.name + '(' + ', '.join([write(a) for a in node.args]) + ')'
+    if isinstance(node, Neg):
+        # -a * b needs no parentheses, -(a + b) and -(a ^ b) do
+        return '-' + parenthesize(node.operand, isinstance(node.operand, (Sum, Power)) or isNegative(node.operand))
+    if isinstance(node, Sum):
+        parts = []
+        for k, (sign, term) in enumerate(node.terms):
+            if k == 0:
+                parts.append(write(Neg(term)) if sign == '-' else parenthesize(term, isinstance(term, Sum)))
+            else:
+                parts.append(' ' + sign + ' ' + parenthesize(term, isinstance(term, Sum) or opposite(term) is not None))
+        return ''.join(parts)
+    if isinstance(node, Product):
+        parts = []
+        for k, (op, factor) in enumerate(node.factors):
+            parentheses = isinstance(factor, (Sum, Product)) or (k > 0 and not isAtom(factor) and not isinstance(factor, Power))
+            parts.append((' ' + op + ' ' if k > 0 else '') + parenthesize(factor, parentheses))
+        return ''.join(parts)
+    # The operands of ^ are only written without parentheses when they are atoms
+    return parenthesize(node.base, not isAtom(node.base)) + ' ^ ' + parenthesize(node.exponent, not isAtom(node.exponent))
+
+def parenthesize(node, parentheses):
+    return '(' + write(node) + ')' if parentheses else write(node)
+
+# Children of a node
+def children(node):
+    if isinstance(node, Call):
+        return node.args
+    if isinstance(node, Neg):
+        return (node.operand,)
+    if isinstance(node, Sum):
+        return tuple([t for s, t in node.terms])
+    if isinstance(node, Product):
+        return tuple([f for o, f in node.factors])
+    if isinstance(node, Power):
+        return (node.base, node.exponent)
+    return ()
+
+# Number of terms of a node, i.e. of its variables and constants, those of its functions included
+def terms(node):
+    if isinstance(node, (Num, Ref, Atom)):
+        return 1
+    return sum([terms(c) for c in children(node)])
+
+OPERAND = re.compile(r'[A-Za-z_%][A-Za-z0-9_]*(?!\s*\()|\d+\.?\d*')
+
+# Counts of the equations and terms before and after simplification
+class Report(object):
+    def __init__(self):
+        self.equations = [0, 0]
+        self.terms = [0, 0]
+
+    def add(self, other):
+        for mine, theirs in [(self.equations, other.equations), (self.terms, other.terms)]:
+            mine[0] += theirs[0]
+            mine[1] += theirs[1]
+
+    # Counts an equation left as it is, with its number of terms
+    def unchanged(self, text, terms):
+        self.equations[0] += 1
+        self.equations[1] += 1
+        self.terms[0] += terms
+        self.terms[1] += terms
+        return text
+
+    def summary(self):
+        return "%s equations, %s terms after simplification" % (shrink(self.equations), shrink(self.terms))
+
+def shrink(counts):
+    before, after = counts
+    return "%d -> %d (%+.1f%%)" % (before, after, 100.0 * (after - before) / before if before > 0 else 0.0)
+
+# Most compiled equations are sums and products of variables, e.g. PQ_01 * Q_01 = PQD_01 * QD_01 + PQM_01 * QM_01,
+# which are left as they are unless one of their variables is zero: they aren't parsed
+NAME = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+PLAIN = re.compile(r'{0}(?: [-+*] {0})* = {0}(?: [-+*] {0})*$'.format(NAME.pattern))
+
+# Simplifies one equation; returns its simplified text, or None if it is dropped
+def simplify_equation(text, zeros, report):
+    if PLAIN.match(text):
+        names = NAME.findall(text)
+        if not any([zeros.isZero(n) for n in names]):
+            return report.unchanged(text, len(names))
+    try:
+        lhs, rhs = parse_equation(text)
+    except SyntaxError:
+        return report.unchanged(text, len(OPERAND.findall(text)))
+
+    report.equations[0] += 1
+    report.terms[0] += terms(lhs) + terms(rhs)
+    folded = fold(rhs, zeros)
+    zeroLhs = fold(lhs, zeros)
+    if isNum(folded) and isNum(zeroLhs) and folded.value == zeroLhs.value:
+        return None
+    # The left-hand side of an equation keeps its variables, even if they are zero
+    lhs = fold(lhs, None)
+    report.equations[1] += 1
+    report.terms[1] += terms(lhs) + terms(folded)
+    return write(lhs) + ' = ' + write(folded)
+
+# Simplifies the compiled code of a Formula, one equation per line, and counts what it dropped in `report`
+def simplify(output, heap, report = None):
+    if report is None:
+        report = Report()
+    with profiling.phase('simplify'):
+        zeros = zerosOf(heap)
+        equations = [simplify_equation(e, zeros, report) for e in output.split('\n')]
+    return '\n'.join([e for e in equations if e is not None])
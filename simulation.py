@@ -0,0 +1,482 @@
+import sys, argparse
+from collections import namedtuple
+
+import numpy as np
+
+import blocks
+import heapfile
+import simplify
+
+# Simulation of compiled equations, without eViews
+# The compiled equations of a model (e.g. the output of batch.py) are ordered in blocks (see blocks.py),
+# and each block is solved for all the periods of the data at once: each equation is lowered to
+# Python code computing its two sides with NumPy, as arrays of the values of its operands in all periods.
+#   X_01        the values of X_01 in all periods, a row of the variables x periods matrix of the data
+#   X_01(-1)    the same row, shifted by one period (NA before the first period)
+#   log, exp    np.log, np.exp
+#   d(x), d(x, n)   x minus x shifted by one period, n times
+#   @elem(x, p) the value of x in period p, given by its label, e.g. "2006" or %baseyear
+#   M(i, j)     an element of a matrix of coefficients, e.g. ES_KLEM(1, 1)
+# Strings such as %baseyear are given by `strings`, %baseyear being the first period by default,
+# and the elements of matrices by `coefficients`, e.g. {'ES_KLEM(1, 1)': 0.5}.
+# Each block is solved by Gauss-Seidel, as by eViews: the equations are computed in turn, until the largest
+# relative change of their variables is below the tolerance. An equation whose left-hand side is its variable
+# (e.g. X_01 = ...) gives the new values of its variable; any other one (e.g. PCH_01 * CH_01 = ...,
+# d(log(K_01)) = ...), or one which reads its variable in other periods, takes a Newton step in its variable
+# in all periods at once, with numerical derivatives, so that e.g. K_01 is solved in all periods
+# in a few steps rather than one more period per sweep.
+# With the newton method, each simultaneous block is solved by Newton's method instead: its Jacobian
+# is computed by differences, one variable of the block at a time, for the equations of its sparsity pattern
+# only, and solved as a dense matrix in each period, which suits blocks of up to a few hundred equations.
+# As all periods are solved at once, a block whose equations refer to its own variables in other periods
+# is solved iteratively even when it's recursive, and the blocks are solved again as long as a block
+# refers to the variables of later blocks in other periods.
+# Variables which no equation determines must be in the data; those the equations determine start at START
+# in the periods solved where they are NA. Periods are solved from the first one for which the data holds all the lags the equations read.
+# Usage: python simulation.py [equations file] [-o results.csv] [--heap tmp_all_vars.csv]
+#                             [--first P] [--last P] [--method gauss-seidel|newton] [--string %baseyear=2006]
+#                             [--coefficients FILE]
+# where FILE holds the elements of matrices, one per line, e.g. ES_KLEM(1, 1) = 0.5
+
+TOLERANCE = 1e-8
+ITERATIONS = 5000
+START = 1.0
+# Relative step of the numerical derivatives
+STEP = 1e-6
+HALVINGS = 10
+
+METHODS = ['gauss-seidel', 'newton']
+
+# Number of iterations of a block, the largest relative change of its variables in the last one,
+# and whether it converged, i.e. the change is below the tolerance, or one iteration solves the block
+Convergence = namedtuple("Convergence", ['block', 'iterations', 'change', 'converged'])
+
+# Values of the variables in all periods, as a variables x periods matrix, NaN for NA
+class Data(object):
+    def __init__(self, labels, names, values):
+        self.labels = list(labels)
+        self.names = list(names)
+        self.rows = dict([(n.upper(), k) for k, n in enumerate(self.names)])
+        self.values = np.array(values, dtype = float).reshape(len(self.names), len(self.labels))
+
+    def __contains__(self, name):
+        return name.upper() in self.rows
+
+    def row(self, name):
+        return self.rows[name.upper()]
+
+    def series(self, name):
+        return self.values[self.row(name)]
+
+    # Adds the variables which aren't in the data, NA in all periods
+    def extend(self, names):
+        added = [n for n in names if n not in self]
+        for n in added:
+            self.rows[n.upper()] = len(self.names)
+            self.names.append(n)
+        self.values = np.vstack([self.values, np.nan * np.ones((len(added), len(self.labels)))])
+
+    def period(self, label):
+        return heapfile.periodIndex(self.labels, label)
+
+def from_series(labels, series):
+    names = sorted(series)
+    return Data(labels, names, [[v if v is not None else np.nan for v in series[n]] for n in names])
+
+# Reads all the periods of the heap of a CSV file, converted as by heapfile.load,
+# or of the CSV itself when its heap couldn't be replaced
+def load_data(csvPath):
+    heap = heapfile.load(csvPath)
+    if not isinstance(heap, heapfile.Heap):
+        return from_series(*heapfile.readSeries(csvPath))
+    try:
+        values = np.frombuffer(heap.mm, dtype = '<f8', count = heap.count * heap.periods, offset = heap.valuesStart)
+        return Data(heap.labels, [heap.name(i) for i in range(heap.count)], values.copy())
+    finally:
+        heap.close()
+
+# Functions of the generated code
+
+def shift(values, offset):
+    shifted = np.empty(len(values))
+    shifted.fill(np.nan)
+    if abs(offset) < len(values):
+        if offset < 0:
+            shifted[-offset:] = values[:offset]
+        else:
+            shifted[:len(values) - offset] = values[offset:]
+    return shifted
+
+def difference(values, times):
+    values = np.asarray(values, dtype = float)
+    if values.ndim == 0:
+        return 0.0
+    for i in range(times):
+        values = np.concatenate([[np.nan], np.diff(values)])
+    return values
+
+def elem(values, t):
+    values = np.asarray(values, dtype = float)
+    if values.ndim == 0:
+        return values
+    return values[t] if 0 <= t < len(values) else np.nan
+
+# Values of an expression in the periods solved, whether it's an array or a constant
+def at(values, periods):
+    values = np.asarray(values, dtype = float)
+    return values[periods] if values.ndim > 0 else values * np.ones(periods.stop - periods.start)
+
+# Largest relative change between the old and new values of a variable, infinite if a value becomes NA
+def change(old, new):
+    changes = np.abs(new - old) / np.maximum(1.0, np.abs(old))
+    changes[np.isnan(old) & np.isnan(new)] = 0.0
+    changes[np.isnan(changes)] = np.inf
+    return changes.max() if len(changes) > 0 else 0.0
+
+# Derivatives of residuals in the values of a variable (its `row`), by differences, as matrices of the derivatives
+# of each residual in each period solved (row) in the value of the variable in each period solved (column)
+# The residuals are `before` at first. The equations read the variable from `lag` periods before the current one
+# to `lead` periods after it: the periods are perturbed lag + lead + 1 periods apart, so that the residual
+# in each period reads at most one of the perturbed values, which gives all the derivatives in as many residuals
+def jacobians(residuals, before, x, row, periods, reach):
+    lag, lead = reach
+    stride = lag + lead + 1
+    old = x[row, periods].copy()
+    count = len(old)
+    h = STEP * np.fmax(1.0, np.abs(old))
+    matrices = [np.zeros((count, count)) for f in residuals]
+    t = np.arange(count)
+    for first in range(min(stride, count)):
+        # The perturbed period the residual in each period reads, if any
+        read = first + stride * -((first + lag - t) // stride)
+        reads = (read <= t + lead) & (read >= 0) & (read < count)
+        read = read[reads]
+        perturbed = old.copy()
+        perturbed[first::stride] += h[first::stride]
+        x[row, periods] = perturbed
+        for f, r, matrix in zip(residuals, before, matrices):
+            matrix[t[reads], read] = (at(f(x), periods) - r)[reads] / h[read]
+    x[row, periods] = old
+    return matrices
+
+# Newton steps in the values of a variable in the periods solved, from the residuals of its equation
+# and their derivatives; the periods whose residual or derivatives are NA get NA steps
+def steps(jacobian, residuals):
+    diagonal = np.diagonal(jacobian)
+    known = ~np.isnan(residuals) & ~np.isnan(jacobian).any(axis = 1)
+    result = residuals / diagonal
+    try:
+        result[known] = np.linalg.solve(jacobian[np.ix_(known, known)], residuals[known])
+    except np.linalg.LinAlgError:
+        pass
+    return result
+
+# A Newton step of an equation in the values of its variable, in all the periods solved at once
+# The step is halved, up to HALVINGS times, in the periods where it makes the residual NA (e.g. the log
+# of a negative value), as the variable would then stay NA
+def newton(residual, x, row, periods, reach):
+    old = x[row, periods].copy()
+    r = at(residual(x), periods)
+    jacobian = jacobians([residual], [r], x, row, periods, reach)[0]
+    step = r / np.diagonal(jacobian) if reach == (0, 0) else steps(jacobian, r)
+    for i in range(HALVINGS + 1):
+        new = old - step
+        x[row, periods] = new
+        failed = np.isnan(at(residual(x), periods)) & ~np.isnan(r)
+        if not failed.any():
+            break
+        step[failed] /= 2
+    return change(old, new)
+
+# Generates the Python code of the nodes of parsed equations (see simplify.py), over the rows of `data`
+# `lag` is the largest number of periods before the current one the code reads, and `references` gives
+# the variables it reads, with the first and last of the periods it reads them in, relative to the current one
+# (e.g. -2, -1 for d(X(-1)), None, None within @elem)
+class Lowering(object):
+    def __init__(self, data, strings, coefficients):
+        self.data = data
+        self.strings = strings
+        self.coefficients = coefficients
+        self.lag = 0
+        self.references = []
+        self.fixed = False
+
+    def lower(self, node, lag = 0):
+        if isinstance(node, simplify.Num):
+            return repr(node.value)
+        if isinstance(node, simplify.Ref):
+            name = node.name.upper()
+            if name not in self.data:
+                raise KeyError("No data for " + node.name)
+            offset = int(node.offset) if node.offset is not None else 0
+            if self.fixed:
+                self.references.append((name, None, None))
+            else:
+                self.lag = max(self.lag, lag - offset)
+                self.references.append((name, offset - lag, offset))
+            row = 'x[%d]' % self.data.row(name)
+            return row if offset == 0 else 'shift(%s, %d)' % (row, offset)
+        if isinstance(node, simplify.Neg):
+            return '(-%s)' % self.lower(node.operand, lag)
+        if isinstance(node, simplify.Sum):
+            return '(' + ' '.join([s + ' ' + self.lower(t, lag) for s, t in node.terms])[2:] + ')'
+        if isinstance(node, simplify.Product):
+            return '(' + ' '.join([o + ' ' + self.lower(f, lag) for o, f in node.factors])[2:] + ')'
+        if isinstance(node, simplify.Power):
+            return '(%s ** %s)' % (self.lower(node.base, lag), self.lower(node.exponent, lag))
+        if isinstance(node, simplify.Call):
+            return self.call(node.name.lower(), node.args, lag)
+        raise ValueError("Can't simulate " + simplify.write(node))
+
+    def call(self, name, args, lag):
+        if name in ['log', 'exp'] and len(args) == 1:
+            return 'np.%s(%s)' % (name, self.lower(args[0], lag))
+        if name == 'd' and len(args) in [1, 2]:
+            times = int(self.string(args[1])) if len(args) == 2 else 1
+            return 'difference(%s, %d)' % (self.lower(args[0], lag + times), times)
+        if name == '@elem' and len(args) == 2:
+            # The value of a given period isn't a lag
+            fixed, self.fixed = self.fixed, True
+            values = self.lower(args[0])
+            self.fixed = fixed
+            return 'elem(%s, %d)' % (values, self.data.period(self.string(args[1])))
+        if all([simplify.isNum(a) for a in args]):
+            element = coefficient(name, [a.text for a in args])
+            if element not in self.coefficients:
+                raise KeyError("No value for " + element)
+            return repr(self.coefficients[element])
+        raise ValueError("Can't simulate function " + name + " with " + str(len(args)) + " arguments")
+
+    def string(self, node):
+        if isinstance(node, simplify.Atom):
+            text = node.text
+            if text.startswith('"'):
+                return text[1:-1]
+            if text.lower() in self.strings:
+                return self.strings[text.lower()]
+        if isinstance(node, simplify.Num):
+            return node.text
+        raise ValueError("Can't simulate " + simplify.write(node))
+
+# Key of an element of a matrix, e.g. es_klem(1, 1) as ES_KLEM(1, 1)
+def coefficient(name, indices):
+    return '%s(%s)' % (name.upper(), ', '.join([str(int(float(i))) for i in indices]))
+
+def parse_coefficient(element):
+    name, indices = element.strip().rstrip(')').split('(', 1)
+    return name.strip(), indices.split(',')
+
+# Reads the elements of matrices, one per line, e.g. ES_KLEM(1, 1) = 0.5
+def read_coefficients(f):
+    coefficients = {}
+    for line in f:
+        if len(line.strip()) > 0:
+            element, value = line.split('=')
+            coefficients[coefficient(*parse_coefficient(element))] = float(value)
+    return coefficients
+
+# An equation, as the code of its residual (left-hand side minus right-hand side), and the code giving
+# the new values of its variable if the left-hand side is its variable
+Lowered = namedtuple("Lowered", ['variable', 'residual', 'value', 'references'])
+
+def lower_equation(equation, variable, lowering):
+    try:
+        lhs, rhs = simplify.parse_equation(equation)
+    except SyntaxError:
+        raise ValueError("Can't simulate: " + equation)
+    start = len(lowering.references)
+    left, right = lowering.lower(lhs), lowering.lower(rhs)
+    normalized = isinstance(lhs, simplify.Ref) and lhs.offset is None and lhs.name.upper() == variable
+    return Lowered(variable, '%s - %s' % (left, right), right if normalized else None, lowering.references[start:])
+
+# The equations of a block, compiled to Python functions
+#   sweep(x, periods)       computes the equations in turn, and returns the largest change
+#   residuals()[k](x)       the residual of the k-th equation, compiled when first needed, for Newton's method
+# The equations whose left-hand side is their variable, and which read it in the current period only,
+# give its values; the others take Newton steps in all periods at once
+# A block is iterative if one sweep may not solve it
+class Stage(object):
+    def __init__(self, block, lowered, rows, later):
+        self.block = block
+        self.rows = rows
+        variables = set(block.variables)
+        references = [r for e in lowered for r in e.references]
+        own = [(first, last) for name, first, last in references if name in variables]
+        self.iterative = block.simultaneous or any([e.value is None for e in lowered]) or \
+            any([(first, last) != (0, 0) for first, last in own])
+        # Periods before and after the current one in which the block reads its own variables
+        self.reach = (max([-first for first, last in own if first is not None] + [0]),
+                      max([last for first, last in own if first is not None] + [0]))
+        # Whether the block refers to the variables of later blocks in other periods
+        self.feedback = any([(first, last) != (0, 0) and name in later for name, first, last in references])
+
+        lines, implicit = ['def sweep(x, periods):', '    largest = 0.0'], []
+        for k, (e, row) in enumerate(zip(lowered, rows)):
+            if e.value is not None and all([(first, last) == (0, 0) for name, first, last in e.references if name == e.variable]):
+                lines.append('    new = at(%s, periods)' % e.value)
+                lines.append('    largest = max(largest, change(x[%d, periods], new))' % row)
+                lines.append('    x[%d, periods] = new' % row)
+            else:
+                lines.append('    largest = max(largest, newton(residual%d, x, %d, periods, %r))' % (k, row, self.reach))
+                implicit.append('residual%d = lambda x: %s' % (k, e.residual))
+        lines.append('    return largest')
+        self.sweep = self.compile(lines + implicit)['sweep']
+        self.code = [e.residual for e in lowered]
+        self.compiled = None
+
+    def compile(self, lines):
+        namespace = dict(NAMESPACE)
+        exec(compile('\n'.join(lines) + '\n', '<block %s>' % self.block.variables[0], 'exec'), namespace)
+        return namespace
+
+    def residuals(self):
+        if self.compiled is None:
+            self.compiled = self.compile(['residuals = [%s]' % ', '.join(['lambda x: ' + c for c in self.code])])['residuals']
+        return self.compiled
+
+    def solve(self, x, periods, method, tolerance, iterations):
+        if method == 'newton' and self.block.simultaneous:
+            return self.newton(x, periods, tolerance, iterations)
+        largest, previous = self.sweep(x, periods), None
+        iteration = 1
+        # Values which keep overflowing, or becoming NA, diverged
+        while self.iterative and largest > tolerance and iteration < iterations and \
+              not (largest == np.inf and previous == np.inf):
+            largest, previous = self.sweep(x, periods), largest
+            iteration += 1
+        return Convergence(self.block, iteration, largest, largest <= tolerance or not self.iterative)
+
+    # Newton's method over the whole block, in all the periods solved at once
+    def newton(self, x, periods, tolerance, iterations):
+        n, count = len(self.rows), periods.stop - periods.start
+        # The equations each variable appears in, by position in the block
+        columns = [[] for c in range(n)]
+        for r, c in self.block.pattern:
+            columns[c].append(r)
+
+        iteration, largest = 0, np.inf
+        while largest > tolerance and iteration < iterations:
+            functions = self.residuals()
+            residuals = np.array([at(f(x), periods) for f in functions])
+            jacobian = np.zeros((count, n, n))
+            for c, row in enumerate(self.rows):
+                matrices = jacobians([functions[r] for r in columns[c]], residuals[columns[c]], x, row, periods, self.reach)
+                for r, matrix in zip(columns[c], matrices):
+                    jacobian[:, r, c] = np.diagonal(matrix)
+            try:
+                steps = np.linalg.solve(jacobian, -residuals.T[:, :, np.newaxis])[:, :, 0]
+            except np.linalg.LinAlgError:
+                return Convergence(self.block, iteration, np.inf, False)
+            old = x[self.rows, periods].copy()
+            x[self.rows, periods] = old + steps.T
+            largest = max([change(o, x[row, periods]) for o, row in zip(old, self.rows)])
+            iteration += 1
+        return Convergence(self.block, iteration, largest, largest <= tolerance)
+
+NAMESPACE = {'np': np, 'shift': shift, 'difference': difference, 'elem': elem, 'at': at,
+             'change': change, 'newton': newton}
+
+# A model, i.e. compiled equations, to be simulated over data
+# The variables the equations determine are added to the data if they aren't in it
+class Model(object):
+    def __init__(self, equations, data, strings = None, coefficients = None):
+        self.data = data
+        self.strings = dict([(k.lower(), v) for k, v in (strings or {}).items()])
+        self.strings.setdefault('%baseyear', data.labels[0])
+        self.coefficients = dict([(coefficient(*parse_coefficient(k)), v) for k, v in (coefficients or {}).items()])
+        self.blocks = blocks.order(equations)
+        data.extend([v for b in self.blocks for v in b.variables])
+
+        lowering = Lowering(data, self.strings, self.coefficients)
+        later = set([v for b in self.blocks for v in b.variables])
+        self.stages = []
+        for b in self.blocks:
+            later.difference_update(b.variables)
+            lowered = [lower_equation(e, v, lowering) for e, v in zip(b.equations, b.variables)]
+            self.stages.append(Stage(b, lowered, [data.row(v) for v in b.variables], later))
+        self.lag = lowering.lag
+
+    # Solves the model in the given periods (labels or positions), and returns the convergence of each block
+    def solve(self, first = None, last = None, method = 'gauss-seidel', tolerance = TOLERANCE, iterations = ITERATIONS):
+        if method not in METHODS:
+            raise ValueError("No such method: " + method)
+        first = self.data.period(first) if first is not None else self.lag
+        last = self.data.period(last) if last is not None else len(self.data.labels) - 1
+        if first > last:
+            raise ValueError("No period to solve: the equations read %d periods before the first one" % self.lag)
+        periods = slice(first, last + 1)
+
+        x = self.data.values
+        for s in self.stages:
+            start = x[s.rows, periods]
+            start[np.isnan(start)] = START
+            x[s.rows, periods] = start
+
+        # The iterations of each block are added up over the passes
+        feedback = any([s.feedback for s in self.stages])
+        results, totals, passes = None, None, 0
+        while results is None or (feedback and passes < iterations and
+                                  any([r.iterations > 1 or r.change > tolerance for r in results])):
+            with np.errstate(all = 'ignore'):
+                results = [s.solve(x, periods, method, tolerance, iterations) for s in self.stages]
+            totals = results if totals is None else \
+                [r._replace(iterations = t.iterations + r.iterations) for r, t in zip(results, totals)]
+            passes += 1
+        return totals
+
+# Counts of the blocks which converged, for reports
+def summary(results):
+    failed = [r for r in results if not r.converged]
+    return "%d blocks solved, %d did not converge, %d iterations at most" % \
+        (len(results) - len(failed), len(failed), max([r.iterations for r in results]) if len(results) > 0 else 0)
+
+# Writes the values of variables in the periods of the data, as the CSV exported by eViews
+def write_csv(f, data, names):
+    f.write(','.join(['obs'] + names) + '\n')
+    for t, label in enumerate(data.labels):
+        values = [data.series(n)[t] for n in names]
+        f.write(','.join([label] + ['NA' if v != v else repr(v) for v in values]) + '\n')
+
+def parse_arguments(args):
+    parser = argparse.ArgumentParser(description = "Simulates compiled equations, one per line")
+    parser.add_argument('input', nargs = '?', default = '-', help = "file of equations, or - for stdin (default)")
+    parser.add_argument('-o', '--output', default = '-', help = "CSV file for the values of the variables, or - for stdout (default)")
+    parser.add_argument('--heap', default = 'tmp_all_vars.csv', help = "values of the variables (default: tmp_all_vars.csv)")
+    parser.add_argument('--first', help = "label of the first period solved (default: the first one with all the lags)")
+    parser.add_argument('--last', help = "label of the last period solved (default: the last one)")
+    parser.add_argument('--method', choices = METHODS, default = 'gauss-seidel', help = "method of the simultaneous blocks")
+    parser.add_argument('--coefficients', metavar = 'FILE', help = "file of the elements of matrices, e.g. ES_KLEM(1, 1) = 0.5")
+    parser.add_argument('--string', action = 'append', default = [], metavar = 'NAME=VALUE',
+                        help = "value of a string of the equations, e.g. %%baseyear=2006")
+    return parser.parse_args(args)
+
+def main(args):
+    options = parse_arguments(args)
+    if options.input == '-':
+        equations = [l.strip() for l in sys.stdin if len(l.strip()) > 0]
+    else:
+        with open(options.input, 'r') as f:
+            equations = [l.strip() for l in f if len(l.strip()) > 0]
+
+    coefficients = {}
+    if options.coefficients is not None:
+        with open(options.coefficients, 'r') as f:
+            coefficients = read_coefficients(f)
+    try:
+        model = Model(equations, load_data(options.heap), dict([s.split('=', 1) for s in options.string]), coefficients)
+        results = model.solve(options.first, options.last, options.method)
+    except (KeyError, ValueError) as e:
+        sys.stderr.write(str(e.args[0]) + "\n")
+        return 2
+
+    variables = [v for b in model.blocks for v in b.variables]
+    if options.output == '-':
+        write_csv(sys.stdout, model.data, variables)
+    else:
+        with open(options.output, 'w') as f:
+            write_csv(f, model.data, variables)
+    sys.stderr.write(blocks.summary(model.blocks) + "\n" + summary(results) + "\n")
+    return 1 if any([not r.converged for r in results]) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
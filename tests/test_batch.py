@@ -0,0 +1,113 @@
+from .. import batch
+from .. import heapfile
+from .. import parsecache
+import os, sys, json, shutil, tempfile, StringIO
+
+class TestBatch(object):
+    formulas = ['"|V|[com] = |V|D[com] + |V|M[com], V in Q CH, com in 01 02"',
+                '',
+                '= QD[c]',
+                'CH[c] = CHD[c] if CHD[c] > 1000, c in 01 02 03',
+                'Q[c] = QD[c] if NOT_A_VARIABLE[c] > 0, c in 01']
+
+    @classmethod
+    def setup_class(cls):
+        cls.heap = heapfile.readCSV('../tmp_all_vars.csv')
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    # Runs batch.main, and returns its exit status and the report it wrote to stderr
+    def main(self, args):
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            return batch.main(args), sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+    def test_reads_one_formula_per_line(self):
+        assert batch.read_formulas(["Q = QD\n", "  \n", '"X = Y"\r\n']) == ["Q = QD", '"X = Y"']
+
+    def test_compiles_formulas_in_order_and_reports_errors(self):
+        outputs = list(batch.compile_all(batch.read_formulas([f + "\n" for f in self.formulas]), self.heap))
+        assert len(outputs) == 4
+        assert outputs[0] == parsecache.parse(self.formulas[0][1:-1]).compile(self.heap)
+        assert outputs[1].startswith("Error\r\n")
+        assert outputs[2] == parsecache.parse(self.formulas[3]).compile(self.heap)
+        assert outputs[3].startswith("Error\r\nKeyError")
+
+    def test_main_writes_output_file(self):
+        formulasPath = os.path.join(self.directory, 'model.txt')
+        outputPath = os.path.join(self.directory, 'model.out')
+        with open(formulasPath, 'w') as f:
+            f.write("Q[c] = QD[c], c in 01 02\nX = Y\n")
+        status, report = self.main([formulasPath, '-o', outputPath, '--heap', '../tmp_all_vars.csv'])
+        assert status == 0 and report.startswith("2 formulas compiled, 0 errors")
+        assert open(outputPath).read() == "Q_01 = QD_01\nQ_02 = QD_02\nX = Y\n"
+
+    def test_main_simplifies_and_reports_what_it_dropped(self):
+        formulasPath = os.path.join(self.directory, 'model.txt')
+        outputPath = os.path.join(self.directory, 'model.out')
+        with open(formulasPath, 'w') as f:
+            f.write("CH[c] = CHD[c] + CHM[c], c in 01 10\nX = Y\nQ[c] = QD[c] if NOT_A_VARIABLE[c] > 0, c in 01\n")
+        status, report = self.main([formulasPath, '-o', outputPath, '--heap', '../tmp_all_vars.csv', '--simplify', '-j', '2'])
+        assert status == 1
+        assert open(outputPath).read().startswith("CH_01 = CHD_01 + CHM_01\nX = Y\nError\r\n")
+        assert "3 -> 2 (-33.3%) equations, 8 -> 5 (-37.5%) terms" in report
+
+    def test_main_hoists_subexpressions_repeated_over_formulas(self):
+        formulasPath = os.path.join(self.directory, 'model.txt')
+        outputPath = os.path.join(self.directory, 'model.out')
+        with open(formulasPath, 'w') as f:
+            f.write("Q[c] = (QD[c] + QM[c]) * 2, c in 01 02\nX[c] = Y + (QD[c] + QM[c]) * 2, c in 01 02\n= QD[c]\n")
+        status, report = self.main([formulasPath, '-o', outputPath, '--heap', '../tmp_all_vars.csv', '--cse'])
+        assert status == 1
+        lines = open(outputPath).read().split('\n')
+        first, second = [l.split(' = ')[0] for l in lines[:2]]
+        assert lines[:6] == [first + " = (QD_01 + QM_01) * 2", second + " = (QD_02 + QM_02) * 2",
+                             "Q_01 = " + first, "Q_02 = " + second, "X_01 = Y + " + first, "X_02 = Y + " + second]
+        assert lines[6] == "Error\r"
+        assert "2 auxiliary equations for repeated subexpressions" in report
+
+    def test_main_writes_equations_in_block_order(self):
+        formulasPath = os.path.join(self.directory, 'model.txt')
+        outputPath = os.path.join(self.directory, 'model.out')
+        blocksPath = os.path.join(self.directory, 'blocks.jsonl')
+        with open(formulasPath, 'w') as f:
+            f.write("Q[c] = QD[c] + X[c], c in 01 02\nX[c] = Q[c] * 0.5 + Y[c](-1), c in 01 02\n= QD[c]\nY[c] = QD[c], c in 01 02\n")
+        status, report = self.main([formulasPath, '-o', outputPath, '--heap', '../tmp_all_vars.csv', '--blocks', blocksPath])
+        assert status == 1 and "6 equations in 4 blocks" in report
+        output = open(outputPath).read()
+        assert output.startswith("Error\r\n")
+        assert output.endswith("Q_01 = QD_01 + X_01\nX_01 = Q_01 * 0.5 + Y_01(-1)\nQ_02 = QD_02 + X_02\nX_02 = Q_02 * 0.5 + Y_02(-1)\n"
+                               "Y_01 = QD_01\nY_02 = QD_02\n")
+        found = [json.loads(line) for line in open(blocksPath)]
+        assert [(b['first'], b['equations'], b['simultaneous']) for b in found] == \
+            [(0, 2, True), (2, 2, True), (4, 1, False), (5, 1, False)]
+        assert found[0]['variables'] == ['Q_01', 'X_01'] and found[0]['pattern'] == [[0, 0], [0, 1], [1, 0], [1, 1]]
+
+    def test_compiles_in_parallel_in_order(self):
+        formulas = batch.read_formulas([f + "\n" for f in self.formulas] * 5)
+        assert list(batch.compile_all(formulas, self.heap, jobs = 3)) == list(batch.compile_all(formulas, self.heap))
+        heap = heapfile.load('../tmp_all_vars.csv')
+        assert list(batch.compile_all(formulas, heap, jobs = 2)) == list(batch.compile_all(formulas, self.heap))
+
+    def test_rebuilds_only_formulas_whose_text_or_inputs_changed(self):
+        directory = os.path.join(self.directory, 'cache')
+        formulas = [self.formulas[3], "Q[c] = QD[c], c in 01 02"]
+        first = list(batch.build_all(formulas, self.heap, directory = directory))
+        assert [reused for output, reused, saved in first] == [False, False]
+
+        second = list(batch.build_all(formulas, self.heap, jobs = 2, directory = directory))
+        assert [output for output, reused, saved in second] == [output for output, reused, saved in first]
+        assert [reused for output, reused, saved in second] == [True, True]
+        assert all([saved > 0 for output, reused, saved in second])
+
+        heap = dict(self.heap, CHD_02 = 0.0)
+        third = list(batch.build_all(formulas + ["X = Y"], heap, directory = directory))
+        assert [reused for output, reused, saved in third] == [False, True, False]
+        assert third[0][0] == parsecache.parse(formulas[0]).compile(heap)
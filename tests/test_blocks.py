@@ -0,0 +1,39 @@
+from .. import blocks
+
+class TestBlocks(object):
+    def test_finds_the_variable_of_an_equation_and_its_dependencies(self):
+        assert blocks.incidence("PCH_01 * CH_01 = PCHD_01 * CHD_01 + X_01(1)") == ('PCH_01', ['CH_01', 'PCHD_01', 'CHD_01', 'X_01'])
+        assert blocks.incidence("d(log(K_01)) = d(log(CK_01)) - ES_KLEM(1, 1) * d(log(PK_01) - log(PQ_01))") == \
+            ('K_01', ['CK_01', 'PK_01', 'PQ_01'])
+        assert blocks.incidence("EBE_01 = VA_01 - @elem(PK_01(-1), %baseyear) * Tdec_01 * K_01(-1)") == ('EBE_01', ['VA_01', 'TDEC_01'])
+        assert blocks.incidence("X = @recode(A >= 0, B, X)") == ('X', ['A', 'B', 'X'])
+
+    def test_rejects_equations_without_variable_or_determining_the_same_one(self):
+        for equations in [["0 = A"], ["A = B", "A = C"]]:
+            try:
+                blocks.order(equations)
+                assert False
+            except ValueError:
+                pass
+
+    def test_orders_equations_in_recursive_and_simultaneous_blocks(self):
+        equations = ["A = B + C", "B = A * 2 + D", "C = D(-1)", "D = E", "F = F(-1) + F * 0.5", "E = X"]
+        ordered = blocks.order(equations)
+        assert [b.equations for b in ordered] == [["E = X"], ["D = E"], ["C = D(-1)"], ["A = B + C", "B = A * 2 + D"],
+                                                  ["F = F(-1) + F * 0.5"]]
+        assert [b.simultaneous for b in ordered] == [False, False, False, True, True]
+        assert ordered[3].variables == ['A', 'B']
+        assert blocks.summary(ordered) == "6 equations in 5 blocks: 3 recursive, 2 simultaneous (largest: 2 equations)"
+
+    def test_gives_the_sparsity_pattern_of_blocks(self):
+        ordered = blocks.order(["A = B", "B = C + X", "C = A * B"])
+        assert len(ordered) == 1
+        assert ordered[0].variables == ['A', 'B', 'C']
+        assert ordered[0].pattern == [(0, 0), (0, 1), (1, 1), (1, 2), (2, 0), (2, 1), (2, 2)]
+
+    def test_orders_chains_deeper_than_the_recursion_limit(self):
+        equations = ["V%d = V%d + V%d(-1)" % (k, k + 1, k) for k in range(5000)] + ["V5000 = V0"]
+        ordered = blocks.order(equations)
+        assert len(ordered) == 1 and len(ordered[0].equations) == 5001
+        ordered = blocks.order(equations[:-1])
+        assert [b.variables[0] for b in ordered][:2] == ['V4999', 'V4998'] and len(ordered) == 5000
@@ -1,5 +1,5 @@
 from .. import grammar
-import csv
+import csv, itertools, StringIO
 
 class TestCompiler(object):
     @classmethod
@@ -172,6 +172,49 @@ class TestCompiler(object):
         assert res.evaluate({grammar.VariableName('com'): '24', grammar.VariableName('sec'): '2403'},
                             {'Q_24_2403': 1, 'X_24_2403': 10}) == True
 
+    def test_evaluates_Expression_for_all_bindings(self):
+        bindingsList = [{grammar.VariableName('c'): c} for c in ['01', '02', '03', '04']]
+        heap = {'Q_01': 15, 'Q_02': 0, 'Q_03': None, 'Q_04': -2.5,
+                'X_01': 1.5, 'X_02': 2, 'X_03': 0, 'X_04': None}
+        for code in ["Q[c] <> 0", "Q[c] == 0", "Q[c] > 0", "Q[c] <= 0", "-1 < Q[c] < 20",
+                     "Q[c] > 0 and X[c] > 0", "Q[c] < 0 or X[c] > 1", "Q[c] and X[c]",
+                     "X[c] <> 0 and Q[c] > 10", "X[c] == X[c]", "X[c] > 0 and 2 * X[c] - 3 > 0"]:
+            res = grammar.expression.parseString(code)[0]
+            expected = [bool(res.evaluate(b, heap)) for b in bindingsList]
+            assert res.evaluate_all(bindingsList, heap).tolist() == expected
+
+    def test_evaluates_Expression_for_all_bindings_on_heap(self):
+        bindingsList = [{grammar.VariableName('c'): c, grammar.VariableName('s'): s}
+                        for c in ['01', '02', '03', '04', '05'] for s in ['01', '02', '03', '04', '05']]
+        res = grammar.expression.parseString("CH[c] > 0.5 * CHD[c] or CHM[c] <= 10")[0]
+        expected = [bool(res.evaluate(b, self.heap)) for b in bindingsList]
+        assert res.evaluate_all(bindingsList, self.heap).tolist() == expected
+
+    def test_evaluates_Expression_for_all_bindings_errors(self):
+        bindingsList = [{grammar.VariableName('c'): c} for c in ['01', '02']]
+        heap = {'Q_01': 0, 'Q_02': None}
+        res = grammar.expression.parseString("Q[c] * 2 > 0")[0]
+        try:
+            res.evaluate_all(bindingsList, heap)
+            assert False
+        except TypeError:
+            pass
+        # NA values are never used in arithmetic here, thanks to short-circuiting
+        res = grammar.expression.parseString("Q[c] > -1 and Q[c] * 2 >= 0")[0]
+        assert res.evaluate_all(bindingsList, heap).tolist() == [True, False]
+
+    # The error raised is the one of the first binding which fails, as with the per-binding path
+    def test_evaluates_Expression_for_all_bindings_first_error(self):
+        heap = {'A_01': 1, 'A_02': None, 'B_01': 0, 'B_02': 1}
+        for code in ["A[c] / B[c] > 0", "A[c] * 2 + 1 / B[c] > 0", "1 / B[c] + A[c] * 2 > 0"]:
+            res = grammar.expression.parseString(code)[0]
+            for names, error in [(['01', '02'], ZeroDivisionError), (['02', '01'], TypeError)]:
+                bindingsList = [{grammar.VariableName('c'): c} for c in names]
+                try: res.evaluate(bindingsList[0], heap); assert False
+                except error: pass
+                try: res.evaluate_all(bindingsList, heap); assert False
+                except error: pass
+
     def test_parses_Equation(self):
         res = grammar.equation.parseString("energy|O|[com] + _test|X||M|[sec] = log(B[j])")[0]
         assert isinstance(res, grammar.Equation)
@@ -284,3 +327,142 @@ class TestCompiler(object):
                     "Q_06 = Test_3 + 2 * 3")
         res = grammar.formula.parseString("Q[c] = Test[$c] + 2 * $c, c in 04 05 06")[0]
         assert res.compile({}) == expected
+
+    def test_compiles_Formula_lazily(self):
+        res = grammar.formula.parseString("|V|[c, s] = |V|D[c, s] if CHD[c] > 0, V in Q CH, c in 01 02 03, s in 01 02")[0]
+        res = res._replace(conditions = [])
+        equations = res.iter_compile({})
+        assert list(itertools.islice(equations, 3)) == ["Q_01_01 = QD_01_01", "Q_01_02 = QD_01_02", "Q_02_01 = QD_02_01"]
+        assert len(list(equations)) == 9
+
+    def test_compiles_Formula_in_chunks(self):
+        res = grammar.formula.parseString("|V|[com] = |V|D[com] if CHD[com] > 0, V in Q CH, com in 01 02 03")[0]
+        heap = {"CHD_01": 0, "CHD_02": 15, "CHD_03": 2}
+        expected = res.compile(heap)
+        grammar.Formula.chunkSize = 2
+        try:
+            assert res.compile(heap) == expected == "Q_02 = QD_02\nQ_03 = QD_03\nCH_02 = CHD_02\nCH_03 = CHD_03"
+        finally:
+            grammar.Formula.chunkSize = 4096
+
+    def test_writes_compiled_Formula(self):
+        res = grammar.formula.parseString("!pv Q[c] = QD[c] + QM[c], c in 01 02")[0]
+        f = StringIO.StringIO()
+        res.write_compiled({}, f)
+        assert f.getvalue() == res.compile({})
+
+    def test_lowers_Equation_to_identical_Template(self):
+        formulas = ["|V|[com] = |V|D[com] + |V|M[com], V in Q CH, com in 01 02",
+                    "!pv |V|[com] = |V|D[com] + |V|M[com] * 2.5, V in Q CH, com in 01 02",
+                    "!pv Q[c](-1) = value(QD[c] + ID[c]) + d(log(Q[c])) - A / B, c in 01 02",
+                    "EBE[s] = VA[s] - @elem(PK[s](-1), %baseyear) * Tdec[s] * K[s](outOfTime), s in 01 02",
+                    "!pv X[s](lag) = Y[s](lag) + ( X[s] - 3 ) ^ 2, s in 01",
+                    "Q[c] = Test[$c] + 2 * $c + c, c in 04 05 06 \\ 05",
+                    "test|V|_energy|O|[c] = |O|[c, 5, c], (V, O) in (Q CH, M X), c in 01 02",
+                    "!pv CI[s] = sum(CID[c, s] + CIM[c, s] if CID[c, s] <> 0, c in 01 02 03) + 1, s in 01 02",
+                    "CI[s] = sum(sum(CID[c, s] * CIM[c, t], t in 01 02) if CID[c, s] > 1, c in 01 02 03), s in 01 02"]
+        for code in formulas:
+            res = grammar.formula.parseString(code)[0]
+            expected = "\n".join([res.equation.compile(b, self.heap, res.option()) for b in res.iter_bindings({}, self.heap)])
+            assert res.compile(self.heap) == expected
+
+    def test_elements_have_no_dict(self):
+        res = grammar.formula.parseString("!pv CI[s] = sum(CID[c, s] if CID[c, s] <> 0 and c > 1, c in 01 02) + X(-1), s in 01 02")[0]
+        stack = [res]
+        while len(stack) > 0:
+            e = stack.pop()
+            if isinstance(e, tuple):
+                assert type(e).__dictoffset__ == 0, type(e)
+                stack.extend(e)
+
+    def test_interns_names_and_shares_operators(self):
+        first = grammar.formula.parseString("QD[c] + QM[c], c in 01")[0]
+        second = grammar.formula.parseString("QD[c] - QM[c], c in 01")[0]
+        assert first.equation.value[0].identifier.value[0].value is second.equation.value[0].identifier.value[0].value
+        assert first.iterators[0].lsts_.value[0].base[0] is second.iterators[0].lsts_.value[0].base[0]
+        assert grammar.Operator('+') is first.equation.value[1]
+        assert grammar.Operator('-') is not grammar.ComparisonOperator('-')
+        # Equality and hashing are those of tuples
+        assert grammar.Operator('+') == grammar.BaseElement('+')
+        assert {grammar.VariableName('c'): '01'}[grammar.VariableName('c')] == '01'
+
+    def test_pickled_elements_are_interned_and_shared(self):
+        import pickle
+        res = grammar.formula.parseString("X[c] = A[c] * B[c], c in 01 02")[0]
+        copy = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+        assert copy == res and repr(copy) == repr(res)
+        assert copy.equation.rhs.value[1] is grammar.Operator('*')
+        assert copy.compile({}) == res.compile({})
+
+    def test_looks_up_enclosing_bindings_without_copying_them(self):
+        outer = {grammar.VariableName('s'): '10', grammar.VariableName('c'): '99'}
+        scope = grammar.Scope(outer)
+        scope[grammar.VariableName('c')] = '01'
+        assert scope[grammar.VariableName('c')] == '01' and scope[grammar.VariableName('s')] == '10'
+        assert grammar.VariableName('s') in scope and grammar.VariableName('t') not in scope
+        assert scope.get(grammar.VariableName('t'), '00') == '00'
+        assert set(scope.keys()) == set(outer.keys()) and len(dict.keys(scope)) == 1
+        try:
+            scope[grammar.VariableName('t')]
+            assert False
+        except KeyError:
+            pass
+
+    def test_sum_iterators_shadow_those_of_the_Formula(self):
+        res = grammar.formula.parseString("X[c] = sum(Y[c] if Y[c] > 0, c in 01 02), c in 03")[0]
+        assert res.compile({'Y_01': 1, 'Y_02': 2}) == "X_03 = 0 + Y_01 + Y_02"
+
+    def test_splits_Condition_into_conjuncts(self):
+        res = grammar.condition.parseString("if X[c] > 0 and (Y > 0 or Z > 0) and W[c, s] <> 0")[0]
+        assert [e.compile({}, {}, '') for e in res.conjuncts()] == ["X_c > 0", "( Y > 0 or Z > 0 )", "W_c_s <> 0"]
+        res = grammar.condition.parseString("if X[c] > 0 and Y > 0 or Z > 0")[0]
+        assert res.conjuncts() == [res.expression]
+
+    def test_prefilters_conjuncts_on_their_iterators(self):
+        class CountingHeap(dict):
+            reads = 0
+            def __getitem__(self, key):
+                CountingHeap.reads += 1
+                return dict.__getitem__(self, key)
+        heap = CountingHeap(self.heap)
+        formulas = ["|V|[c, s] = |V|D[c, s] if CHD[c] > 100, V in Q CH, c in 01 02 03 04, s in 01 02 03",
+                    "X[c, s] = Y[c, s] if CID[c, s] > 0 and CHD[c] > 0 and AIC_VAL > 0, s in 01 02 03, c in 01 02 03",
+                    "X[c, s] = Y[c, s] if CHD[c] > 0 or CHD[s] > 0, s in 01 02 03, c in 01 02 03",
+                    "X[c, s] = Y[c, s] if CHD[c] > 10 and CHD[s] > 10, (c, s) in (01 02 03, 04 05 06)",
+                    "X[c, s] = Y[c, s] if CHD[c] > 10 and CID[c, s] > CHD[s], c in 01 02 03 04 \\ 02 03, s in 01 02 \\ 01",
+                    "X[c, s] = Y[c, s] if CHD[c] > 10 and AIC_VAL < 0, c in 01 02 03, s in 01 02"]
+        for code in formulas:
+            res = grammar.formula.parseString(code)[0]
+            iteratorDicts = res.build_iterator_dicts()
+            expected = [b for c, b in zip(res.evaluate_conditions({}, self.heap, iteratorDicts), iteratorDicts) if c]
+            assert list(res.iter_bindings({}, self.heap)) == expected
+        # CHD[c] is only read once for each c
+        res = grammar.formula.parseString(formulas[0])[0]
+        list(res.iter_bindings({}, heap))
+        assert CountingHeap.reads == 4
+
+    def test_expands_iterators_with_removals_as_masks(self):
+        res = grammar.formula.parseString("X[c, s] = Y[$c, s], c in 01 02 03 \\ 02, (s, t) in (01 02, 03 04)")[0]
+        c, s = [i.dimension() for i in res.iterators]
+        assert [[n.value for n in d[0]] for d in (c, s)] == [['c', '$c'], ['s', 't', '$s']]
+        assert c[1:] == ([('01', 1), ('02', 2), ('03', 3)], [True, False, True])
+        assert s[1:] == ([('01', '03', 1), ('02', '04', 2)], [True, True])
+        assert [sorted((k.value, v) for k, v in b.items()) for b in res.iter_iterator_dicts()][1] == \
+            [('$c', 1), ('$s', 2), ('c', '01'), ('s', '02'), ('t', '04')]
+        assert len(list(res.iter_iterator_dicts())) == 4
+        assert res.compile({}) == "X_01_01 = Y_1_01\nX_01_02 = Y_1_02\nX_03_01 = Y_3_01\nX_03_02 = Y_3_02"
+
+    def test_evaluates_Conditions_on_a_table_of_iterator_values(self):
+        res = grammar.formula.parseString("X[c, s] = Y[c, s] if CHD[c] > 25000 and CID[c, s] <> 0, c in 01 02 03, s in 01 02 \\ 01")[0]
+        table = grammar.IteratorTable(res.iterator_dimensions(), {}, self.heap)
+        assert table.sizes == (3, 2) and table.mask.tolist() == [[False, True]] * 3
+        assert table.positions(res.conditions[0].conjuncts()[0]) == (0,)
+        bindings = [sorted((k.value, v) for k, v in b.items()) for b in table.iter_bindings(res.conditions[0], 2)]
+        expected = [[('$c', int(c)), ('$s', 2), ('c', c), ('s', '02')] for c in ['01', '02', '03']
+                    if self.heap['CHD_' + c] > 25000 and self.heap['CID_%s_02' % c] != 0]
+        assert bindings == expected and 0 < len(expected) < 3
+
+    def test_evaluates_whole_Condition_when_a_conjunct_fails(self):
+        # CHD[s] / CHD[c] only depends on s and c, but can't be evaluated on its own for c = 01
+        res = grammar.formula.parseString("X|V|[c, s] = Y[c, s] if CHD[c] <> 0 and CHD[s] / CHD[c] >= 1, s in 01 02, c in 01 02, V in A B")[0]
+        assert res.compile({'CHD_01': 0, 'CHD_02': 1}) == "XA_02_02 = Y_02_02\nXB_02_02 = Y_02_02"
@@ -0,0 +1,63 @@
+from .. import cse
+from .. import simplify
+
+class TestCSE(object):
+    def test_hoists_subexpressions_repeated_over_equations(self):
+        name = cse.Hoisting(set()).name(simplify.parse_equation("X = d(log(CK_01))")[1])
+        auxiliary, rewritten = cse.hoist(["Y_01 = d(log(CK_01)) * A", "Z_01 = B - d(log(CK_01))", "W = A + B",
+                                          "V_01 = d(log(CK_01))"])
+        assert auxiliary == [name + " = d(log(CK_01))"]
+        assert rewritten == ["Y_01 = " + name + " * A", "Z_01 = B - " + name, "W = A + B", "V_01 = " + name]
+
+    def test_names_subexpressions_by_their_code(self):
+        equations = ["X = (A + B) * C", "Y = (A + B) * D", "Z = (A + B) * E"]
+        auxiliary, rewritten = cse.hoist(equations)
+        assert cse.hoist(["Q = 1"] + equations)[0] == auxiliary
+        assert auxiliary[0].startswith(cse.PREFIX) and len(auxiliary[0].split(' = ')[0]) == len(cse.PREFIX) + cse.HASH
+        assert cse.hoist(equations, prefix = 'AUX_')[0][0].startswith('AUX_')
+
+    def test_skips_taken_names(self):
+        equations = ["X = (A + B) * C", "Y = (A + B) * D", "Z = (A + B) * E"]
+        name = cse.hoist(equations)[0][0].split(' = ')[0]
+        taken = cse.hoist(equations + [name + " = 1"])[0][0].split(' = ')[0]
+        assert taken != name and taken.startswith(name)
+
+    def test_keeps_function_arguments_and_left_hand_sides(self):
+        auxiliary, rewritten = cse.hoist(["d(log(A * B)) = d(A * B) + C", "d(log(A * B)) = d(A * B) + D"])
+        name = auxiliary[0].split(' = ')[0]
+        assert auxiliary == [name + " = d(A * B)"]
+        assert rewritten == ["d(log(A * B)) = " + name + " + C", "d(log(A * B)) = " + name + " + D"]
+
+    def test_hoists_subexpressions_of_at_least_the_threshold(self):
+        equations = ["X = A * B + C", "Y = A * B + D", "Z = A * B + E"]
+        assert cse.hoist(equations, threshold = 4) == ([], equations)
+        assert len(cse.hoist(equations)[0]) == 1
+
+    def test_only_hoists_subexpressions_when_the_model_gets_smaller(self):
+        for equations in [["X = A * B + C", "Y = A * B + D"], ["X = d(log(K)) + C", "Y = d(log(K)) + D"]]:
+            assert cse.hoist(equations) == ([], equations)
+        equations = ["X = (A + B) * C + D", "Y = (A + B) * C + E"]
+        auxiliary, rewritten = cse.hoist(equations)
+        assert len(auxiliary) == 1
+        assert cse.summary(equations, auxiliary, rewritten).endswith("16 -> 14 (-12.5%) nodes")
+
+    def test_hoists_nested_subexpressions_which_repeat_on_their_own(self):
+        auxiliary, rewritten = cse.hoist(["X = (A + B) * C + D", "Y = (A + B) * C + D", "Z = (A + B) * E"])
+        outer, inner = [a.split(' = ')[0] for a in auxiliary]
+        assert auxiliary == [outer + " = " + inner + " * C + D", inner + " = A + B"]
+        assert rewritten == ["X = " + outer, "Y = " + outer, "Z = " + inner + " * E"]
+
+    def test_does_not_hoist_what_only_repeats_within_a_hoisted_subexpression(self):
+        auxiliary, rewritten = cse.hoist(["X = (A + B) * C + D", "Y = (A + B) * C + D"])
+        assert len(auxiliary) == 1 and auxiliary[0].endswith(" = (A + B) * C + D")
+
+    def test_keeps_equations_which_cannot_be_parsed(self):
+        equations = ["X = A * B + C", "Y = A * B + C if D > 0", "Z = A * B + C"]
+        auxiliary, rewritten = cse.hoist(equations)
+        assert rewritten[1] == equations[1] and rewritten[0] != equations[0]
+
+    def test_reports_equations_and_nodes(self):
+        equations = ["X = A * B + C", "Y = A * B + C", "Z = A * B + C"]
+        auxiliary, rewritten = cse.hoist(equations)
+        assert cse.summary(equations, auxiliary, rewritten) == \
+            "1 auxiliary equations for repeated subexpressions, 18 -> 12 (-33.3%) nodes"
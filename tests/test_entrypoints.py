@@ -0,0 +1,29 @@
+import os, sys, shutil, tempfile, subprocess
+
+# Runs the single-formula entry points as eViews does, in a working directory holding the CSV
+class TestEntryPoints(object):
+    package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(self.package, 'tmp_all_vars.csv'), self.directory)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def run(self, script, *args):
+        return subprocess.check_output([sys.executable, os.path.join(self.package, script)] + list(args),
+                                       cwd = self.directory, stderr = subprocess.STDOUT)
+
+    def test_compiler_compiles_in_txt_to_out_txt(self):
+        for code, output in [('"Q[c] = QD[c] + QM[c], c in 01 02"', "Q_01 = QD_01 + QM_01\nQ_02 = QD_02 + QM_02"),
+                             ("= QD[c]", "Error\r\n")]:
+            with open(os.path.join(self.directory, 'in.txt'), 'w') as f:
+                f.write(code + "\n")
+            self.run('compiler.py')
+            assert open(os.path.join(self.directory, 'out.txt'), 'rb').read().startswith(output)
+
+    def test_imcompiler_writes_the_output_in_compiler_out(self):
+        filename = self.run('imcompiler.py', "Q[c] = QD[c] + QM[c], c in 01 02").strip()
+        with open(os.path.join(self.directory, '_compiler_out', filename)) as f:
+            assert f.read() == "Q_01 = QD_01 + QM_01\nQ_02 = QD_02 + QM_02"
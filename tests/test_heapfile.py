@@ -0,0 +1,180 @@
+from .. import heapfile
+from .. import grammar
+import os, shutil, tempfile
+
+class TestHeapFile(object):
+    @classmethod
+    def setup_class(cls):
+        cls.values = heapfile.readCSV('../tmp_all_vars.csv')
+        cls.path = os.path.join(tempfile.mkdtemp(), 'tmp_all_vars.heap')
+        heapfile.convert('../tmp_all_vars.csv', cls.path)
+        cls.heap = heapfile.Heap(cls.path)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.heap.close()
+        os.remove(cls.path)
+
+    def test_contains_all_values(self):
+        assert len(self.heap) == len(self.values)
+        assert dict(self.heap.items()) == self.values
+
+    def test_looks_up_values(self):
+        for name in ['AIC_VAL', 'CHD_01', 'OBS', 'obs']:
+            assert (name in self.heap) == (name in self.values)
+            assert self.heap.get(name) == self.values.get(name)
+
+    def test_NA_values_are_None(self):
+        na = [k for k, v in self.values.items() if v is None]
+        assert len(na) > 0
+        assert all([self.heap[k] is None for k in na])
+
+    def test_missing_value_raises_KeyError(self):
+        try:
+            self.heap['NOT_A_VARIABLE']
+            assert False
+        except KeyError:
+            pass
+
+    def test_compiles_Formula_with_Heap(self):
+        res = grammar.formula.parseString("|V|[com] = |V|D[com] if CHD[com] > 100, V in Q CH, com in 01 02 03 04")[0]
+        assert res.compile(self.heap) == res.compile(self.values)
+
+class TestCSVHeap(object):
+    @classmethod
+    def setup_class(cls):
+        cls.values = heapfile.readCSV('../tmp_all_vars.csv')
+
+    def setup(self):
+        self.heap = heapfile.CSVHeap('../tmp_all_vars.csv')
+
+    def test_contains_all_values(self):
+        assert len(self.heap) == len(self.values)
+        assert dict(self.heap.items()) == self.values
+
+    def test_converts_values_when_looked_up(self):
+        assert self.heap['CHD_01'] == self.values['CHD_01']
+        assert self.heap.get('NOT_A_VARIABLE') is None and 'NOT_A_VARIABLE' not in self.heap
+        assert list(self.heap.values.keys()) == [('CHD_01', 0)]
+
+    def test_load_reads_a_newer_CSV_lazily(self):
+        directory = tempfile.mkdtemp()
+        csvPath = os.path.join(directory, 'tmp_all_vars.csv')
+        shutil.copy('../tmp_all_vars.csv', csvPath)
+        try:
+            assert isinstance(heapfile.load(csvPath, lazy = True), heapfile.CSVHeap)
+            assert not os.path.exists(heapfile.heapPath(csvPath))
+            heap = heapfile.load(csvPath)
+            assert isinstance(heap, heapfile.Heap)
+            assert isinstance(heapfile.load(csvPath, lazy = True), heapfile.Heap)
+            heap.close()
+        finally:
+            shutil.rmtree(directory)
+
+class TestPeriods(object):
+    csv = "obs,X_01,X_02,Y\r\n,,,\r\n2006,1,2,NA\r\n2007,3,0,5\r\n2008,4,1,6\r\n"
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.csvPath = os.path.join(self.directory, 'tmp_all_vars.csv')
+        with open(self.csvPath, 'wb') as f:
+            f.write(self.csv)
+        self.heap = heapfile.load(self.csvPath)
+
+    def teardown(self):
+        self.heap.close()
+        shutil.rmtree(self.directory)
+
+    def heaps(self):
+        return [self.heap, heapfile.CSVHeap(self.csvPath), heapfile.OverlayHeap(self.heap, {('X_01', 1): 3.0})]
+
+    def test_reads_all_periods(self):
+        labels, series = heapfile.readSeries(self.csvPath)
+        assert labels == ['2006', '2007', '2008']
+        assert series['X_01'] == (1.0, 3.0, 4.0) and series['Y'] == (None, 5.0, 6.0)
+        for heap in self.heaps():
+            assert heap.labels == labels
+            assert dict(heap.items()) == heapfile.readCSV(self.csvPath)
+
+    def test_selects_periods_by_label_or_position(self):
+        for heap in self.heaps():
+            assert heap['X_01'] == 1.0
+            assert heap.at('2007')['X_01'] == 3.0 and heap.at(2)['Y'] == 6.0
+            assert heap.at('2007').at('2008')['X_02'] == 1.0
+            assert heap['X_01'] == 1.0
+            for period in ['2009', 3]:
+                try:
+                    heap.at(period)
+                    assert False
+                except (KeyError, IndexError):
+                    pass
+
+    def test_reads_periods_of_any_frequency(self):
+        with open(self.csvPath, 'wb') as f:
+            f.write(self.csv.replace("2006", "2006Q1").replace("2007", "2006Q2").replace("2008", "2006Q3"))
+        os.utime(self.csvPath, (os.path.getmtime(self.csvPath) + 10,) * 2)
+        heap = heapfile.load(self.csvPath)
+        assert isinstance(heap, heapfile.Heap) and heap.labels == ['2006Q1', '2006Q2', '2006Q3']
+        assert sorted(heap.keys()) == ['X_01', 'X_02', 'Y'] and 'obs' not in heap
+        assert heap.at('2006Q2')['Y'] == 5.0 and heap.at('2006Q2')['X_01(1)'] == 4.0
+        assert dict(heapfile.CSVHeap(self.csvPath).at(1).items()) == dict(heap.at(1).items())
+        assert heapfile.readCSV(self.csvPath) == dict(heap.items())
+        heap.close()
+
+    def test_replaces_a_heap_which_is_mapped(self):
+        with open(self.csvPath, 'wb') as f:
+            f.write(self.csv.replace("2006,1,2", "2006,9,2"))
+        os.utime(self.csvPath, (os.path.getmtime(self.csvPath) + 10,) * 2)
+        heap = heapfile.load(self.csvPath)
+        assert heap['X_01'] == 9.0 and self.heap['X_01'] == 1.0
+        heap.close()
+        assert sorted(os.listdir(self.directory)) == ['tmp_all_vars.csv', 'tmp_all_vars.heap']
+
+    def test_removes_the_temporary_file_when_the_heap_cannot_be_replaced(self):
+        path = os.path.join(self.directory, 'heap')
+        os.mkdir(path)
+        open(os.path.join(path, 'entry'), 'w').close()
+        try:
+            heapfile.convert(self.csvPath, path)
+            assert False
+        except OSError:
+            pass
+        assert sorted(os.listdir(self.directory)) == ['heap', 'tmp_all_vars.csv', 'tmp_all_vars.heap']
+
+    def test_periods_share_the_memory_map(self):
+        assert self.heap.at('2008').mm is self.heap.mm
+
+    def test_reads_time_offsets(self):
+        for heap in self.heaps():
+            assert heap.at('2007')['X_01(-1)'] == 1.0 and heap.at('2007')['X_01(1)'] == 4.0
+            assert heap['X_01(-1)'] is None and heap.at('2008')['Y(1)'] is None
+            assert 'X_01(-1)' in heap and 'Z(-1)' not in heap
+
+    def test_compiles_Formula_in_a_period(self):
+        formula = grammar.formula.parseString("Z[c] = X[c] if X[c] > 1, c in 01 02")[0]
+        lagged = grammar.formula.parseString("Z[c] = X[c] if X[c](-1) > 1 and X[c] > 0, c in 01 02")[0]
+        for heap in self.heaps():
+            assert formula.compile(heap) == "Z_02 = X_02"
+            assert formula.compile(heap, '2007') == "Z_01 = X_01"
+            assert formula.compile(heap.at('2007')) == "Z_01 = X_01"
+            assert lagged.compile(heap, '2007') == ""
+            assert lagged.compile(heap, '2008') == "Z_01 = X_01"
+
+    def test_overlays_the_values_which_changed(self):
+        lines = heapfile.readLines(self.csvPath)
+        changed = self.csv.replace("2007,3,0,5", "2007,3,7,NA").replace("2008,4,1,6", "2008,4,1,6.0")
+        changes = heapfile.changedValues(lines, changed.splitlines())
+        assert changes == {('X_02', 1): 7.0, ('Y', 1): None, ('Y', 2): 6.0}
+        heap = heapfile.OverlayHeap(self.heap, changes)
+        assert heap.at('2007')['X_02'] == 7.0 and heap['X_02(1)'] == 7.0 and heap.at('2008')['X_02(-1)'] == 7.0
+        assert heap.at('2007')['Y'] is None and heap.at('2007')['X_01'] == 3.0 and heap['X_02'] == 2.0
+        assert dict(heap.at(1).items()) == {'X_01': 3.0, 'X_02': 7.0, 'Y': None}
+        assert heap.get('Z') is None and 'Z' not in heap
+        assert heapfile.changedValues(lines, lines) == {}
+        for other in [self.csv.replace("Y", "Z"), self.csv.replace("2008", "2009"), self.csv + "2009,1,1,1\r\n"]:
+            assert heapfile.changedValues(lines, other.splitlines()) is None
+        try:
+            heapfile.changedValues(lines, self.csv.replace("2007,3,0,5", "2007,3").splitlines())
+            assert False
+        except ValueError:
+            pass
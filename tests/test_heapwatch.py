@@ -0,0 +1,69 @@
+from .. import heapwatch
+from .. import heapfile
+from .. import resultcache
+import os, time, shutil, tempfile, StringIO
+
+class TestHeapWatcher(object):
+    csv = "obs,X_01,X_02\r\n,,\r\n2006,1,2\r\n2007,3,0\r\n"
+    formula = "Z[c] = X[c] if X[c] > 1, c in 01 02"
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.csvPath = os.path.join(self.directory, 'tmp_all_vars.csv')
+        self.write(self.csv)
+        self.heap = heapfile.load(self.csvPath)
+        self.swapped = []
+        self.results = resultcache.ResultCache()
+        self.out = StringIO.StringIO()
+        self.watcher = heapwatch.HeapWatcher(self.csvPath, self.heap, self.swapped.append, 0.01, self.results, self.out)
+
+    def teardown(self):
+        self.watcher.stop()
+        self.heap.close()
+        shutil.rmtree(self.directory)
+
+    # The modification time is set explicitly, as the CSV may be written again within the resolution of the clock
+    def write(self, csv, mtime = None):
+        with open(self.csvPath, 'wb') as f:
+            f.write(csv)
+        if mtime is not None:
+            os.utime(self.csvPath, (mtime, mtime))
+
+    def test_reloads_the_values_which_changed(self):
+        assert self.results.compile(self.formula, self.heap) == "Z_02 = X_02"
+        self.write(self.csv.replace("2006,1,2", "2006,5,1"))
+        heap = self.watcher.reload()
+        assert self.swapped == [heap] and self.watcher.version == 2
+        assert isinstance(heap, heapfile.OverlayHeap) and heap.base is self.heap
+        assert heap['X_01'] == 5.0 and heap['X_02'] == 1.0 and heap.at('2007')['X_01'] == 3.0
+        assert len(self.results.entries) == 0
+        assert self.results.compile(self.formula, heap) == "Z_01 = X_01"
+        assert "Heap version 2: 2 values changed, 1 compiled formulas discarded" in self.out.getvalue()
+
+        # Changes add up over the heap loaded first
+        self.write(self.csv.replace("2006,1,2", "2006,5,2").replace("2007,3,0", "2007,3,4"))
+        heap = self.watcher.reload()
+        assert heap.base is self.heap and self.watcher.version == 3
+        assert heap['X_01'] == 5.0 and heap['X_02'] == 2.0 and heap.at('2007')['X_02'] == 4.0
+
+    def test_reads_the_CSV_again_when_variables_or_periods_change(self):
+        self.write(self.csv + "2008,6,7\r\n")
+        heap = self.watcher.reload()
+        assert isinstance(heap, heapfile.CSVHeap) and heap.labels == ['2006', '2007', '2008']
+        assert heap.at('2008')['X_02'] == 7.0
+        assert "Heap version 2: read again" in self.out.getvalue()
+
+    def test_keeps_the_heap_when_the_CSV_cannot_be_read(self):
+        self.write(self.csv.replace("2007,3,0", "2007,3"))
+        assert self.watcher.reload() is None
+        assert self.swapped == [] and self.watcher.version == 1 and self.watcher.heap is self.heap
+        assert "Heap not reloaded" in self.out.getvalue()
+
+    def test_reloads_once_the_CSV_has_stopped_changing(self):
+        self.watcher.start()
+        self.write(self.csv.replace("2006,1,2", "2006,5,2"), time.time() + 10)
+        for i in range(500):
+            if self.watcher.version > 1:
+                break
+            time.sleep(0.01)
+        assert len(self.swapped) == 1 and self.swapped[0]['X_01'] == 5.0
@@ -0,0 +1,49 @@
+from .. import parsecache
+import shutil, tempfile
+
+class TestParseCache(object):
+    formula = "|V|[com] = |V|D[com] + |V|M[com] if CHD[com] > 0, V in Q CH, com in 01 02 \\ 02"
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_counts_hits_and_misses(self):
+        cache = parsecache.ParseCache()
+        first = cache.parse(self.formula)
+        assert cache.parse("  " + self.formula.replace(" ", "   ")) is first
+        assert cache.stats() == { 'hits': 1, 'diskHits': 0, 'misses': 1, 'size': 1 }
+        assert first.compile({"CHD_01": 1}) == parsecache.parse(self.formula).compile({"CHD_01": 1})
+
+    def test_evicts_least_recently_used(self):
+        cache = parsecache.ParseCache(maxsize = 2)
+        cache.parse("A = B")
+        cache.parse("C = D")
+        cache.parse("A = B")
+        cache.parse("E = F")
+        assert list(cache.entries.keys()) == ["A = B", "E = F"]
+        cache.parse("C = D")
+        assert cache.misses == 4 and cache.hits == 1
+
+    def test_persists_on_disk(self):
+        cache = parsecache.ParseCache(directory = self.directory)
+        formula = cache.parse(self.formula)
+        other = parsecache.ParseCache(directory = self.directory)
+        assert other.parse(self.formula) == formula
+        assert other.diskHits == 1 and other.misses == 0
+
+    def test_can_be_disabled(self):
+        cache = parsecache.ParseCache(directory = self.directory, enabled = False)
+        assert cache.parse("A = B") is not cache.parse("A = B")
+        assert cache.stats() == { 'hits': 0, 'diskHits': 0, 'misses': 0, 'size': 0 }
+
+    def test_imports_neither_NumPy_nor_pyparsing_until_needed(self):
+        import subprocess, sys
+        source = ("import sys, compilation; compilation.compile_or_error('%s', {'QD_01': 1, 'QD_02': 0}); "
+                  "print (sorted([m for m in ['numpy', 'pyparsing', 'funcy'] if m in sys.modules]))")
+        run = lambda code: subprocess.check_output([sys.executable, '-c', source % code], cwd = '..').strip()
+        assert run("Q[c] = QD[c], c in 01 02") == "[]"
+        assert run("Q[c] = QD[c] if QD[c] > 0, c in 01 02") == "['numpy']"
+        assert run("= QD[c]") == "['pyparsing']"
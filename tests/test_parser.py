@@ -0,0 +1,93 @@
+from .. import grammar
+from .. import fastparser
+from .. import parsecache
+from .. import benchmark
+from .. import bench_parser
+from pyparsing import ParseException
+import random
+
+# Counts the steps of the parser, i.e. the tokens it tries to match
+class CountingParser(fastparser.Parser):
+    steps = 0
+
+    def skip(self, pos):
+        self.steps += 1
+        return fastparser.Parser.skip(self, pos)
+
+def parse_steps(code):
+    parser = CountingParser(code.expandtabs())
+    assert parser.formula(0) is not None
+    return parser.steps
+
+class TestFastParser(object):
+    formulas = ["|V|[com] = |V|D[com] + |V|M[com] if CHD[com] > 0, V in Q CH, com in 01 02 \\ 02",
+                "!pv CH[c] = CHD[c] + CHM[c] if CH[c] > 0 and CHM[c] <> 0, c in 01 02",
+                "EBE[s] = VA[s] - @elem(PK[s](-1), %baseyear) * Tdec[s] * K[s](t), s in 01 02",
+                "CI[s] = sum(CID[c, s] + CIM[c, s] if CID[c, s] <> 0, c in 01 02), s in 01 02",
+                "X[c, s] = (A[c] + (B[s] - 1.5)) / -2, (c, s) in (01 02, 03 04)",
+                "PROG[s] = sum(X[c] * c, c in C), s in 01 02 03",
+                "-ES_KLEM($s, 1) * d(log(Q[s])) + sum(a, b)",
+                # Quirks of the grammar: identifiers absorb the names which follow them
+                "Q = QD if X > Y and Z > 0",
+                "!PV X = Y",
+                "X = Y trailing [ garbage"]
+
+    def check(self, code):
+        assert repr(fastparser.parse(code)) == repr(grammar.formula.parseString(code)[0])
+
+    def test_builds_the_same_elements_as_pyparsing(self):
+        for code in self.formulas + benchmark.load_corpus(benchmark.CORPUS):
+            self.check(code)
+
+    def test_agrees_with_pyparsing_on_random_formulas(self):
+        tokens = ['X', '|V|', 'D', '[', ']', '(', ')', ',', '=', '==', '<>', '>=', '+', '-', '*', '^',
+                  'and', 'or', 'if', 'in', 'sum', 'log', '1', '-2', '3.5', 'c', '01 02', '\\', '!pv', '@elem']
+        generator = random.Random(0)
+        for i in range(1000):
+            code = ''.join([generator.choice(tokens) + generator.choice(['', ' ']) for j in range(generator.randint(1, 12))])
+            try:
+                expected = repr(grammar.formula.parseString(code)[0])
+            except ParseException:
+                expected = None
+            try:
+                actual = repr(fastparser.parse(code))
+            except fastparser.ParseFailure:
+                actual = None
+            assert actual == expected, code
+
+    def test_rejects_what_pyparsing_rejects(self):
+        for code in ["", "= X", "+", ")"]:
+            try:
+                fastparser.parse(code)
+                assert False, code
+            except fastparser.ParseFailure:
+                pass
+
+    def test_falls_back_to_pyparsing_for_errors(self):
+        try:
+            parsecache.parse("= X", 'fast')
+            assert False
+        except ParseException as e:
+            assert str(e) == str(self.pyparsing_error("= X"))
+
+    def pyparsing_error(self, code):
+        try:
+            grammar.formula.parseString(code)
+        except ParseException as e:
+            return e
+
+    def test_backends_are_switchable(self):
+        code = self.formulas[3]
+        try:
+            trees = [repr(parsecache.parse(code, parser)) for parser in parsecache.BACKENDS]
+        finally:
+            grammar.setPackrat(False)
+        assert trees == [trees[0]] * len(parsecache.BACKENDS)
+
+    # Parsing should take a number of steps linear in the nesting depth of sums and the length of a formula
+    # (pyparsing alone backtracks, and doubles its time with each level of nesting, see bench_parser.py)
+    def test_scales_linearly_with_nesting_depth(self):
+        assert parse_steps(bench_parser.nested_sums(40)) < 2.5 * parse_steps(bench_parser.nested_sums(20))
+
+    def test_scales_linearly_with_length(self):
+        assert parse_steps(bench_parser.long_formula(400)) < 5 * parse_steps(bench_parser.long_formula(100))
@@ -0,0 +1,93 @@
+from .. import profiling
+from .. import parsecache
+import os, json, shutil, tempfile
+
+class TestProfiling(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.environ = dict(os.environ)
+        os.environ['MODEL_PROFILE_LOG'] = os.path.join(self.directory, 'profile.log')
+        os.environ['MODEL_PROFILE_DIR'] = os.path.join(self.directory, 'profile')
+        self.mode = profiling.mode
+
+    def teardown(self):
+        profiling.mode = self.mode
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.directory)
+
+    def records(self):
+        with open(os.environ['MODEL_PROFILE_LOG']) as f:
+            return [json.loads(line) for line in f]
+
+    def compile(self, code, heap):
+        with profiling.formula(code) as profile:
+            with profile.phase('codegen'):
+                output = parsecache.parse(code).compile(heap)
+            profile.count('output', len(output))
+        return output
+
+    def test_takes_profile_option_off_the_command_line(self):
+        argv = ['compiler.py', '--profile=cprofile', 'debug']
+        assert profiling.configure(argv) == ['compiler.py', 'debug'] and profiling.mode == 'cprofile'
+        profiling.configure(['compiler.py', '--profile'])
+        assert profiling.mode == 'log'
+        try:
+            profiling.modeOf('sometimes')
+            assert False
+        except ValueError:
+            pass
+
+    def test_does_nothing_when_disabled(self):
+        profiling.mode = ''
+        assert profiling.startup('compiler') is profiling.nullProfile
+        self.compile("X[c] = Y[c] if Y[c] > 0, c in 01", {'Y_01': 1})
+        assert not os.path.exists(os.environ['MODEL_PROFILE_LOG'])
+
+    def test_logs_phases_and_counters_of_each_formula(self):
+        profiling.mode = 'log'
+        startup = profiling.startup('compiler')
+        with startup.phase('heap'):
+            heap = {'Y_01': 1, 'Y_02': 0, 'Y_03': 2, 'Z_01': 1, 'Z_02': 1, 'Z_03': 1}
+        startup.write()
+        code = "X[c, s] = sum(Y[t] if Y[t] > 0, t in 01 02 03) if Y[c] > 0 and Z[s] > 0, c in 01 02 03, s in 01 02"
+        output = self.compile(code, heap)
+
+        start, record = self.records()
+        assert start['event'] == 'start' and start['entry'] == 'compiler'
+        assert set(start['phases'].keys()) == set(['startup', 'heap'])
+        assert record['event'] == 'compile' and record['formula'] == code
+        assert set(record['phases'].keys()) == set(['parse', 'conditions', 'codegen'])
+        # Two values of c out of three pass their conjunct, for each of which the sum generates 3 bindings
+        assert record['counters'] == { 'bindings': 4 + 4 * 3, 'conditions': 3 + 2 + 4 * 3, 'evals': 2 + 4,
+                                       'output': len(output) }
+
+    def test_phases_do_not_overlap(self):
+        start = profiling.timer()
+        profile = profiling.Profile('compile')
+        with profile.phase('codegen'):
+            with profile.phase('parse'):
+                pass
+            with profile.phase('parse'):
+                with profile.phase('codegen'):
+                    pass
+        assert sum(profile.phases.values()) <= profiling.timer() - start
+        assert profile.running == []
+
+    def test_dumps_cProfile_statistics(self):
+        import pstats
+        profiling.mode = 'cprofile'
+        self.compile("X[c] = Y[c], c in 01 02", {})
+        record, = self.records()
+        assert os.path.dirname(record['cprofile']) == os.environ['MODEL_PROFILE_DIR']
+        assert pstats.Stats(record['cprofile']).total_calls > 0
+
+    def test_logs_errors(self):
+        profiling.mode = 'log'
+        try:
+            self.compile("X[c] = Y[c] if Y[c] > 0, c in 01", {})
+            assert False
+        except KeyError:
+            pass
+        record, = self.records()
+        assert record['error'] == "KeyError('Y_01',)"
@@ -0,0 +1,50 @@
+from .. import resultcache
+from .. import parsecache
+import shutil, tempfile
+
+class TestResultCache(object):
+    formula = "Q[s] = sum(Q[c, s] if Q[c, s] <> 0, c in 01 02 03), s in 10 11"
+    heap = {'Q_01_10': 15, 'Q_02_10': 0,  'Q_03_10': 20,
+            'Q_01_11': 15, 'Q_02_11': 42, 'Q_03_11': 20,
+            'UNUSED': 1}
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_records_values_read(self):
+        cache = resultcache.ResultCache()
+        output = cache.compile(self.formula, self.heap)
+        assert output == parsecache.parse(self.formula).compile(self.heap)
+        result = cache.entries[self.formula]
+        assert result.reads == dict([(k, v) for k, v in self.heap.items() if k != 'UNUSED'])
+
+    def test_reuses_results_while_values_read_are_unchanged(self):
+        cache = resultcache.ResultCache()
+        cache.compile(self.formula, self.heap)
+        heap = dict(self.heap, UNUSED = 2)
+        assert cache.invalidate(heap) == 0
+        cache.compile(self.formula, heap)
+        assert cache.hits == 1 and cache.misses == 1
+
+    def test_recompiles_when_values_read_change(self):
+        cache = resultcache.ResultCache()
+        cache.compile(self.formula, self.heap)
+        heap = dict(self.heap, Q_02_10 = 3)
+        assert cache.invalidate(heap) == 1
+        assert cache.compile(self.formula, heap) == parsecache.parse(self.formula).compile(heap)
+        assert cache.misses == 2
+        # Stale entries are also detected without invalidate()
+        assert cache.compile(self.formula, self.heap) == parsecache.parse(self.formula).compile(self.heap)
+        assert cache.misses == 3
+
+    def test_persists_on_disk(self):
+        resultcache.ResultCache(directory = self.directory).compile(self.formula, self.heap)
+        other = resultcache.ResultCache(directory = self.directory)
+        other.compile(self.formula, self.heap)
+        assert other.diskHits == 1
+        other = resultcache.ResultCache(directory = self.directory)
+        other.compile(self.formula, dict(self.heap, Q_02_10 = 3))
+        assert other.diskHits == 0 and other.misses == 1
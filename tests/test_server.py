@@ -0,0 +1,34 @@
+from .. import server
+from .. import client
+from .. import heapfile
+import threading
+
+class TestServer(object):
+    @classmethod
+    def setup_class(cls):
+        cls.server = server.CompileServer(('127.0.0.1', 0), heapfile.readCSV('../tmp_all_vars.csv'))
+        cls.thread = threading.Thread(target = cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def teardown_class(cls):
+        c = client.Client(cls.server.port)
+        assert c.shutdown() == 'OK'
+        c.close()
+        cls.thread.join()
+        cls.server.server_close()
+
+    def test_compiles_many_formulas_per_connection(self):
+        c = client.Client(self.server.port)
+        assert c.ping() == 'pong'
+        assert c.compile('"Q[c] = QD[c] + QM[c], c in 01 02"') == "Q_01 = QD_01 + QM_01\nQ_02 = QD_02 + QM_02"
+        assert c.compile("CH[c] = CHD[c] if CHD[c] > 1000000000, c in 01 02") == ""
+        assert c.compile("Q = QD") == "Q = QD"
+        c.close()
+
+    def test_reports_errors(self):
+        c = client.Client(self.server.port)
+        assert c.compile("= QD[c]").startswith("Error\r\n")
+        assert c.compile("Q[c] = QD[c] if NOT_A_VARIABLE[c] > 0, c in 01").startswith("Error\r\nKeyError")
+        assert c.request('unknown').startswith("Error\r\n")
+        c.close()
@@ -0,0 +1,77 @@
+from .. import simplify
+from .. import compilation
+from .. import parsecache
+from .. import heapfile
+
+class TestSimplify(object):
+    heap = {'Z': 0.0, 'Z_01(-1)': 0.0, 'A': 2.0, 'B': 3.0}
+
+    @classmethod
+    def setup_class(cls):
+        cls.csvHeap = heapfile.readCSV('../tmp_all_vars.csv')
+
+    def simplified(self, equation):
+        return simplify.simplify(equation, self.heap)
+
+    def test_folds_constants_and_drops_zero_terms(self):
+        assert self.simplified("X = 0 + A + 0") == "X = A"
+        assert self.simplified("X = 0 + 0 + A * Z + Z / B + B") == "X = B"
+        assert self.simplified("X = 2 * 3 + A / 1 - 1 * B") == "X = 6 + A - B"
+        assert self.simplified("X = Z - A") == "X = -A"
+        assert self.simplified("X = A - -2 + -B") == "X = A + 2 - B"
+        assert self.simplified("X = A + Z_01(-1) + Z_01(-2)") == "X = A + Z_01(-2)"
+
+    def test_keeps_zero_variables_in_divisors_and_bases_of_powers(self):
+        assert self.simplified("X = A / Z") == "X = A / Z"
+        assert self.simplified("X = (A - 1) / (Z + Z) + Z * A") == "X = (A - 1) / (Z + Z)"
+        assert self.simplified("X = A / (B * Z_01(-1)) + Z / A") == "X = A / B / Z_01(-1)"
+        assert self.simplified("X = A + Z ^ -1 + B / (2 - 1)") == "X = A + Z ^ (-1) + B"
+
+    def test_folds_constants_divided_at_the_start_of_a_product(self):
+        assert simplify.simplify("X = 1 / 2 * 3", {}) == "X = 1.5"
+        assert simplify.simplify("X = (1/2) * -2 * B", {}) == "X = -1 * B"
+        assert simplify.simplify("X = 1 / 3 / (3)", {}) == "X = " + repr(1 / 3.0 / 3)
+        assert simplify.simplify("X = 1 / A * 1 / 2", {}) == "X = 1 / A / 2"
+
+    def test_leaves_constants_which_overflow_unfolded(self):
+        large, huge = "1" + "0" * 200, "1" + "0" * 400
+        for equation in ["X = %s * %s * A" % (large, large), "X = %s - %s + A" % (huge, huge), "X = -" + huge]:
+            assert simplify.simplify(equation, {}) == equation
+
+    def test_removes_redundant_parentheses(self):
+        assert self.simplified("X = (A + B) + (C * D)") == "X = A + B + C * D"
+        assert self.simplified("X = A - (B - C) / (C * D)") == "X = A - (B - C) / C / D"
+        assert self.simplified("X = A / (B / (C + D)) - (-B + C)") == "X = A / B * (C + D) + B - C"
+        assert self.simplified("X = -(A + B) * (C ^ 2)") == "X = -(A + B) * C ^ 2"
+
+    def test_keeps_variables_in_functions_and_on_the_left_hand_side(self):
+        assert self.simplified("d(log(Z)) = @elem(Z(-1), %baseyear) * d(0 + Z) + ES(1, 1)") == \
+            "d(log(Z)) = @elem(Z(-1), %baseyear) * d(Z) + ES(1, 1)"
+        assert self.simplified("Z = A * B + Z") == "Z = A * B"
+
+    def test_drops_equations_which_are_all_zeros(self):
+        assert self.simplified("Z = 0 + Z * A\nX = A\nPZ * Z = 0\nZ = A * Z") == "X = A"
+
+    def test_simplifies_sums_of_thousands_of_terms(self):
+        terms = ["A%d" % k for k in range(5000)]
+        assert self.simplified("X = 0 + " + " + Z + ".join(terms)) == "X = " + " + ".join(terms)
+
+    def test_keeps_equations_it_cannot_parse(self):
+        for equation in ["X = -A ^ 2", "X = A ^ B ^ 2", "X = @recode(A > 0, 1, Z)", "X = A = B"]:
+            assert self.simplified(equation) == equation
+
+    def test_reports_equations_and_terms_dropped(self):
+        report = simplify.Report()
+        simplify.simplify("X = 0 + A + Z\nZ = 0", self.heap, report)
+        simplify.simplify("X = A > B", self.heap, report)
+        assert report.equations == [3, 2]
+        assert report.terms == [9, 5]
+        assert report.summary() == "3 -> 2 (-33.3%) equations, 9 -> 5 (-44.4%) terms after simplification"
+
+    def test_simplifies_compiled_sums_with_the_heap(self):
+        output = parsecache.parse("CI[s] = sum(CID[c, s] + CIM[c, s], c in 01 08), s in 01").compile(self.csvHeap)
+        assert output == "CI_01 = 0 + CID_01_01 + CIM_01_01 + CID_08_01 + CIM_08_01"
+        assert simplify.simplify(output, self.csvHeap) == "CI_01 = CID_01_01 + CIM_01_01"
+        output = parsecache.parse("|V|[c] = |V|D[c] + |V|M[c], V in CH, c in 01 10").compile(self.csvHeap)
+        assert simplify.simplify(output, self.csvHeap) == "CH_01 = CHD_01 + CHM_01"
+        assert compilation.compile_formula("CH[c] = CHD[c] + CHM[c], c in 10 01", self.csvHeap, simplifying = True) == "CH_01 = CHD_01 + CHM_01"
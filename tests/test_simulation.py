@@ -0,0 +1,99 @@
+from .. import simulation
+from .. import heapfile
+import os, sys, shutil, tempfile, StringIO
+import numpy as np
+
+class TestSimulation(object):
+    labels = ['2000', '2001', '2002', '2003', '2004']
+
+    def data(self, **series):
+        return simulation.from_series(self.labels, dict([(k, v if v is not None else [None] * 5) for k, v in series.items()]))
+
+    def test_solves_simultaneous_and_implicit_equations(self):
+        for method in simulation.METHODS:
+            data = self.data(X = [1, 2, 3, 4, 5], K = [1, None, None, None, None], Y = None)
+            model = simulation.Model(['Y = 2 * X + Z', 'Z = 0.5 * Y + 1', 'd(log(K)) = 0.1',
+                                      'P * Y = @elem(X, %baseyear) * Y + Y(-1)'], data, {'%baseyear': '2001'})
+            results = model.solve(method = method)
+            assert model.lag == 1 and all([r.converged for r in results])
+            assert np.isnan(data.series('Y')[0])
+            assert np.allclose(data.series('Y')[1:], [10, 14, 18, 22]) and np.allclose(data.series('Z')[1:], [6, 8, 10, 12])
+            assert np.allclose(data.series('K'), np.exp(0.1 * np.arange(5)))
+            assert np.allclose(data.series('P')[2:], [2 + 10 / 14.0, 2 + 14 / 18.0, 2 + 18 / 22.0])
+
+    def test_solves_with_newton_what_gauss_seidel_cannot(self):
+        model = simulation.Model(['A = 2 * A + 1 + X'], self.data(X = [0] * 5))
+        assert not model.solve()[0].converged
+        model = simulation.Model(['A = 2 * A + 1 + X'], self.data(X = [0] * 5))
+        assert model.solve(method = 'newton')[0].converged
+        assert np.allclose(model.data.series('A'), -1)
+
+    def test_solves_again_blocks_reading_later_blocks_in_earlier_periods(self):
+        model = simulation.Model(['A = B(-1) + 1', 'B = A'], self.data(B = [0, None, None, None, None]))
+        results = model.solve()
+        assert [r.block.variables for r in results] == [['A'], ['B']]
+        assert np.allclose(model.data.series('B'), [0, 1, 2, 3, 4])
+
+    def test_solves_equations_over_time_in_a_few_iterations(self):
+        data = self.data(K = [1, None, None, None, None], I = [1] * 5)
+        results = simulation.Model(['K = 1.1 * K(-1) + I'], data).solve()
+        assert results[0].converged and results[0].iterations <= 3
+        assert np.allclose(data.series('K'), [1, 2.1, 3.31, 4.641, 6.1051])
+
+    def test_reads_elements_of_matrices(self):
+        model = simulation.Model(['Y = ES_KLEM(2, 1) * X'], self.data(X = [2] * 5), coefficients = {'es_klem(2,1)': 0.5})
+        model.solve()
+        assert list(model.data.series('Y')) == [1] * 5
+        assert simulation.read_coefficients(["ES_KLEM(2, 1) = 0.5\n", "\n"]) == {'ES_KLEM(2, 1)': 0.5}
+
+    def test_solves_the_given_periods(self):
+        model = simulation.Model(['Y = X(1) + d(X, 2)'], self.data(X = [1, 2, 4, 8, 16], Y = [0] * 5))
+        assert model.lag == 2
+        model.solve('2002', '2003')
+        assert list(model.data.series('Y')) == [0, 0, 8 + 1, 16 + 2, 0]
+
+    def test_reads_values_of_given_periods(self):
+        model = simulation.Model(['Y = @elem(X(-1), "2002") + @elem(X, %baseyear)'], self.data(X = [1, 2, 4, 8, 16]))
+        assert model.lag == 0
+        model.solve()
+        assert list(model.data.series('Y')) == [3] * 5
+
+    def test_reports_what_cannot_be_simulated(self):
+        for equations, error in [(['Y = NOT_A_VARIABLE'], KeyError), (['Y = M(1, 1)'], KeyError), (['Y = @pch(X)'], ValueError),
+                                 (['Y = X if X > 0'], ValueError), (['Y = X', 'Y = 2 * X'], ValueError)]:
+            try:
+                simulation.Model(equations, self.data(X = [1] * 5))
+                assert False
+            except error:
+                pass
+        model = simulation.Model(['Y = X(-5)'], self.data(X = [1] * 5))
+        try:
+            model.solve()
+            assert False
+        except ValueError as e:
+            assert "5 periods" in e.args[0]
+
+    def test_main_writes_the_values_of_the_variables(self):
+        directory = tempfile.mkdtemp()
+        try:
+            heapPath = os.path.join(directory, 'vars.csv')
+            with open(heapPath, 'w') as f:
+                f.write("obs,X,K\n,,\n2000,1,1\n2001,2,NA\n2002,3,NA\n")
+            equationsPath = os.path.join(directory, 'model.out')
+            with open(equationsPath, 'w') as f:
+                f.write("Y = 2 * X\nd(K) = Y\n")
+            outputPath = os.path.join(directory, 'results.csv')
+            stderr = sys.stderr
+            sys.stderr = StringIO.StringIO()
+            try:
+                assert simulation.main([equationsPath, '-o', outputPath, '--heap', heapPath]) == 0
+                report = sys.stderr.getvalue()
+            finally:
+                sys.stderr = stderr
+            labels, series = heapfile.readSeries(outputPath)
+            assert labels == ['2000', '2001', '2002']
+            assert sorted(series) == ['K', 'Y'] and series['Y'] == (None, 4.0, 6.0)
+            assert np.allclose(series['K'], [1, 5, 11])
+            assert "2 blocks solved, 0 did not converge" in report
+        finally:
+            shutil.rmtree(directory)